@@ -0,0 +1,75 @@
+"""
+Forward time and peak memory of each attention backend as the sequence length grows.
+
+Runs the backends directly on random (batch, nheads, seq, headsize) queries, keys and values with a
+causal mask, as in DecoderOnlyTransformer. Each (backend, length) pair runs in a fresh process, so
+peak memory is measured as in benchmarks/precision.py.
+
+    python benchmarks/attention_backends.py --seq-lens 256 512 1024 2048 4096
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+import torch as t
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(REPO_ROOT, "common"))
+
+import attention
+from precision import peak_memory_mb
+
+
+def run(backend, seq_len, args, results):
+    t.manual_seed(0)
+    device = args.device
+    Q, K, V = (t.randn(args.batch_size, args.heads, seq_len, args.headsize, device=device) for _ in range(3))
+    backend_fn = {
+        "reference": attention.reference_attention,
+        "sdpa": attention.sdpa_attention,
+        "tiled": lambda *tensors: attention.tiled_attention(*tensors, block_size=args.block_size),
+    }[backend]
+    start_memory = peak_memory_mb(device)
+    with t.inference_mode():
+        backend_fn(Q, K, V)
+        best = float("inf")
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            backend_fn(Q, K, V)
+            if device == "cuda":
+                t.cuda.synchronize()
+            best = min(best, time.perf_counter() - start)
+    results[(backend, seq_len)] = (best * 1e3, peak_memory_mb(device) - start_memory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=list(attention.ATTENTION_BACKENDS))
+    parser.add_argument("--seq-lens", nargs="+", type=int, default=[256, 512, 1024, 2048])
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--heads", type=int, default=8)
+    parser.add_argument("--headsize", type=int, default=32)
+    parser.add_argument("--block-size", type=int, default=128)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--device", default="cuda" if t.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Manager().dict()
+    for seq_len in args.seq_lens:
+        for backend in args.backends:
+            process = context.Process(target=run, args=(backend, seq_len, args, results))
+            process.start()
+            process.join()
+
+    print(f"batch {args.batch_size}, {args.heads} heads of size {args.headsize}, causal, on {args.device}")
+    print(f"{'seq_len':<10}" + "".join(f"{backend + ' ms':>14}{backend + ' MB':>14}" for backend in args.backends))
+    for seq_len in args.seq_lens:
+        row = "".join(f"{results[(backend, seq_len)][0]:>14.1f}{results[(backend, seq_len)][1]:>14.1f}" for backend in args.backends)
+        print(f"{seq_len:<10}{row}")
+
+
+if __name__ == "__main__":
+    main()
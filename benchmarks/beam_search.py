@@ -0,0 +1,49 @@
+"""
+Time per generated token of beam_search at several beam widths, against running sample_tokens
+once per beam (the cost of decoding the beams one at a time).
+
+    python benchmarks/beam_search.py --beams 1 4 8 --tokens 50
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch as t
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(REPO_ROOT, "common"))
+
+import sample_methods as s
+from kv_cache import load_shakespeare_tokenizer
+from transformer_modules import DecoderOnlyTransformer, TransformerConfig
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--beams", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--layers", type=int, default=12)
+    parser.add_argument("--prompt", default="turn down for what")
+    args = parser.parse_args()
+
+    config = TransformerConfig(
+        num_layers=args.layers, num_heads=8, vocab_size=34543, hidden_size=256, max_seq_len=128
+    )
+    model = DecoderOnlyTransformer(config).eval()
+    tokenizer = load_shakespeare_tokenizer(config.max_seq_len)
+
+    start = time.perf_counter()
+    s.sample_tokens(model, tokenizer, args.prompt, max_tokens_generated=args.tokens, temperature=0)
+    single = (time.perf_counter() - start) / args.tokens
+
+    print(f"{'beams':>6}{'beam_search ms/token':>22}{'sequential ms/token':>21}{'vs 1 beam':>11}")
+    for num_beams in args.beams:
+        start = time.perf_counter()
+        s.beam_search(model, tokenizer, args.prompt, num_beams=num_beams, max_new_tokens=args.tokens)
+        per_token = (time.perf_counter() - start) / args.tokens
+        print(f"{num_beams:>6}{per_token * 1e3:>22.2f}{num_beams * single * 1e3:>21.2f}{per_token / single:>10.2f}x")
+
+
+if __name__ == "__main__":
+    main()
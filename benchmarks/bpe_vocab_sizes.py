@@ -0,0 +1,110 @@
+"""
+WordsTokenizer against BPETokenizer at several vocabulary sizes: tokenizer training time, encoding
+speed, characters per token, and for a DecoderOnlyTransformer with that vocabulary the parameter
+count (and the embedding's share of it), training step time and inference forward time. Step times
+are for batch_size x seq_len tokens, and per thousand characters of text, since a smaller
+vocabulary needs more tokens for the same text.
+
+    python benchmarks/bpe_vocab_sizes.py --corpus decoder_transformer/100-0.txt --vocab-sizes 1024 4096 16384
+
+Without --corpus the repository's own Python and Markdown files are the text.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import torch as t
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(REPO_ROOT, "common"))
+
+from bpe_tokenizer import BPETokenizer
+from estimator import count_params
+from nlp_modules import WordsTokenizer
+from transformer_modules import DecoderOnlyTransformer, TransformerConfig
+
+
+def best_time(fn, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def repository_text():
+    paths = sorted(glob.glob(os.path.join(REPO_ROOT, "**", "*.py"), recursive=True))
+    paths += sorted(glob.glob(os.path.join(REPO_ROOT, "**", "*.md"), recursive=True))
+    texts = []
+    for path in paths:
+        with open(path) as f:
+            texts.append(f.read())
+    return "".join(texts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="text file; default the repository's sources")
+    parser.add_argument("--vocab-sizes", type=int, nargs="+", default=[1024, 4096, 16384])
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--seq-len", type=int, default=128)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.corpus:
+        with open(args.corpus) as f:
+            text = f.read()
+    else:
+        text = repository_text()
+    megabytes = len(text.encode()) / 1e6
+    t.set_flush_denormal(True)
+    t.manual_seed(0)
+
+    tokenizers = [("words", WordsTokenizer(args.seq_len))]
+    tokenizers += [(f"bpe {size}", BPETokenizer(args.seq_len, vocab_size=size)) for size in args.vocab_sizes]
+
+    print(f"{megabytes:.1f} MB of text, {args.layers} layers, batch {args.batch_size} x {args.seq_len}, {t.get_num_threads()} threads")
+    print(
+        f"{'tokenizer':<12}{'vocab':>7}{'build s':>9}{'enc MB/s':>10}{'chars/tok':>10}{'params M':>10}{'emb %':>7}"
+        f"{'train ms':>10}{'/1k chars':>10}{'infer ms':>10}{'/1k chars':>10}"
+    )
+    for name, tokenizer in tokenizers:
+        build_seconds = best_time(lambda: tokenizer.build_dict(text), 1)
+        encode_seconds = best_time(lambda: tokenizer.encode(text), 1)
+        chars_per_token = len(text) / len(tokenizer.encode(text))
+        vocab_size = len(tokenizer.id_word_map) if isinstance(tokenizer, WordsTokenizer) else len(tokenizer.vocab)
+
+        config = TransformerConfig(
+            num_layers=args.layers, num_heads=8, vocab_size=vocab_size, hidden_size=256, max_seq_len=args.seq_len
+        )
+        params = count_params(config)
+        model = DecoderOnlyTransformer(config)
+        optimizer = t.optim.AdamW(model.parameters())
+        x = t.randint(0, vocab_size, (args.batch_size, args.seq_len + 1))
+
+        def train_step():
+            optimizer.zero_grad()
+            model(x[:, :-1], targets=x[:, 1:]).backward()
+            optimizer.step()
+
+        def infer():
+            with t.inference_mode():
+                model(x[:, :-1])
+
+        train_step()
+        train_ms = best_time(train_step, args.repeats) * 1e3
+        infer_ms = best_time(infer, args.repeats) * 1e3
+        chars_per_step = args.batch_size * args.seq_len * chars_per_token / 1e3
+        print(
+            f"{name:<12}{vocab_size:>7}{build_seconds:>9.2f}{megabytes / encode_seconds:>10.1f}{chars_per_token:>10.2f}"
+            f"{params / 1e6:>10.2f}{100 * vocab_size * 256 / params:>7.0f}"
+            f"{train_ms:>10.1f}{train_ms / chars_per_step:>10.2f}{infer_ms:>10.1f}{infer_ms / chars_per_step:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Training memory against step time for each activation checkpointing setting
+(TransformerConfig.checkpoint_every: 0 = off, k = checkpoint segments of k blocks).
+
+Two memory figures are reported: the activations autograd holds for backward at the end of the
+forward pass (counted with saved_tensors_hooks, once per storage), which is what checkpointing
+removes; and the growth of peak RSS, measured as in benchmarks/precision.py in a fresh process per
+setting, which also includes parameters, gradients, the loss and allocator overhead. The loss is
+DecoderOnlyTransformer.loss / GPT.loss, so logits don't dominate either figure.
+
+    python benchmarks/checkpointing.py --model gpt --layers 12 --seq-len 1024 --batch-size 2
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+import torch as t
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(REPO_ROOT, "common"))
+
+from gpt_modules import GPT
+from precision import peak_memory_mb
+from transformer_modules import DecoderOnlyTransformer, TransformerConfig
+
+
+def saved_activation_bytes(loss_fn) -> int:
+    storages = {}
+
+    def pack(tensor):
+        storage = tensor.untyped_storage()
+        storages[storage.data_ptr()] = storage.nbytes()
+        return tensor
+
+    with t.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        loss = loss_fn()
+    loss.backward()
+    return sum(storages.values())
+
+
+def run(checkpoint_every, args, results):
+    # the randomly initialised models' softmax tails are denormal floats, which make CPU matmuls
+    # in backward many times slower and would swamp the recomputation cost
+    t.set_flush_denormal(True)
+    t.manual_seed(0)
+    device = args.device
+    config = TransformerConfig(
+        num_layers=args.layers,
+        num_heads=8,
+        vocab_size=34543,
+        hidden_size=args.hidden,
+        max_seq_len=args.seq_len,
+        checkpoint_every=checkpoint_every,
+    )
+    model = (GPT if args.model == "gpt" else DecoderOnlyTransformer)(config).to(device).train()
+    x = t.randint(0, config.vocab_size, (args.batch_size, args.seq_len + 1), device=device)
+    loss_fn = lambda: model.loss(x[:, :-1], x[:, 1:])
+    start_memory = peak_memory_mb(device)
+
+    saved_mb = saved_activation_bytes(loss_fn) / 2**20
+    model.zero_grad(set_to_none=False)
+    times = []
+    for _ in range(args.steps):
+        start = time.perf_counter()
+        loss_fn().backward()
+        model.zero_grad(set_to_none=False)
+        if device == "cuda":
+            t.cuda.synchronize()
+        times.append(time.perf_counter() - start)
+    results[checkpoint_every] = (min(times) * 1e3, saved_mb, peak_memory_mb(device) - start_memory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", choices=["transformer", "gpt"], default="transformer")
+    parser.add_argument("--settings", nargs="+", type=int, default=[0, 1, 2, 4])
+    parser.add_argument("--layers", type=int, default=6)
+    parser.add_argument("--hidden", type=int, default=256)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--seq-len", type=int, default=256)
+    parser.add_argument("--steps", type=int, default=2)
+    parser.add_argument("--device", default="cuda" if t.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Manager().dict()
+    for checkpoint_every in args.settings:
+        process = context.Process(target=run, args=(checkpoint_every, args, results))
+        process.start()
+        process.join()
+
+    print(f"{args.model}, {args.layers} layers, batch {args.batch_size} x {args.seq_len}, on {args.device}")
+    print(f"{'checkpoint_every':<18}{'step_ms':>10}{'activations_mb':>16}{'peak_rss_mb':>14}")
+    for checkpoint_every in args.settings:
+        step_ms, saved_mb, rss_mb = results[checkpoint_every]
+        print(f"{checkpoint_every:<18}{step_ms:>10.1f}{saved_mb:>16.1f}{rss_mb:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Peak training memory and step time of the full-logits loss (self(x) followed by cross_entropy, as
+in SHKTrainModule.training_step) against DecoderOnlyTransformer.loss, which never materializes the
+(batch, seq, vocab_size) logits.
+
+Each run is a fresh process; peak memory is measured as in benchmarks/precision.py.
+
+    python benchmarks/chunked_loss.py --batch-size 32 --seq-len 128 --chunk-size 1024
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+import torch as t
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(REPO_ROOT, "common"))
+
+from precision import peak_memory_mb
+from transformer_modules import DecoderOnlyTransformer, TransformerConfig
+
+
+def run(mode, args, results):
+    t.manual_seed(0)
+    device = args.device
+    config = TransformerConfig(
+        num_layers=args.layers, num_heads=8, vocab_size=34543, hidden_size=256, max_seq_len=args.seq_len
+    )
+    model = DecoderOnlyTransformer(config).to(device).train()
+    x = t.randint(0, config.vocab_size, (args.batch_size, args.seq_len + 1), device=device)
+    inputs, targets = x[:, :-1], x[:, 1:]
+    start_memory = peak_memory_mb(device)
+
+    def train_step():
+        if mode == "full":
+            logits = model(inputs)
+            loss = t.nn.functional.cross_entropy(logits.flatten(0, 1), targets.flatten())
+        else:
+            loss = model.loss(inputs, targets, chunk_size=args.chunk_size)
+        loss.backward()
+        model.zero_grad(set_to_none=False)
+        return loss.item()
+
+    times = []
+    for _ in range(args.steps):
+        start = time.perf_counter()
+        loss = train_step()
+        if device == "cuda":
+            t.cuda.synchronize()
+        times.append(time.perf_counter() - start)
+    results[mode] = {
+        "step_ms": min(times) * 1e3,
+        "peak_memory_mb": peak_memory_mb(device) - start_memory,
+        "loss": loss,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--seq-len", type=int, default=128)
+    parser.add_argument("--chunk-size", type=int, default=1024)
+    parser.add_argument("--steps", type=int, default=2)
+    parser.add_argument("--device", default="cuda" if t.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Manager().dict()
+    for mode in ["full", "chunked"]:
+        process = context.Process(target=run, args=(mode, args, results))
+        process.start()
+        process.join()
+
+    logits_mb = args.batch_size * args.seq_len * 34543 * 4 / 2**20
+    print(f"{args.layers} layers, batch {args.batch_size} x {args.seq_len}, full logits {logits_mb:.0f} MB, chunk {args.chunk_size}")
+    print(f"{'loss':<10}{'step_ms':>12}{'peak_memory_mb':>16}{'loss':>10}")
+    for mode in ["full", "chunked"]:
+        r = results[mode]
+        print(f"{mode:<10}{r['step_ms']:>12.1f}{r['peak_memory_mb']:>16.1f}{r['loss']:>10.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Eager against torch.compile (general_modules.compile_model) step time on CPU, for inference
+forward passes and training steps (chunked loss, backward and AdamW) of DecoderOnlyTransformer
+and GPT.
+
+The first compiled call includes compilation; it is reported separately and excluded from the
+step times.
+
+    python benchmarks/compile.py --layers 4 --batch-size 8 --seq-len 128
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch as t
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(REPO_ROOT, "common"))
+
+from general_modules import compile_model
+from gpt_modules import GPT
+from transformer_modules import DecoderOnlyTransformer, TransformerConfig
+
+
+def best_time(fn, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--seq-len", type=int, default=128)
+    parser.add_argument("--attention-backend", default="reference")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    config = TransformerConfig(
+        num_layers=args.layers,
+        num_heads=8,
+        vocab_size=34543,
+        hidden_size=256,
+        max_seq_len=args.seq_len,
+        attention_backend=args.attention_backend,
+    )
+    x = t.randint(0, config.vocab_size, (args.batch_size, args.seq_len + 1))
+    inputs, targets = x[:, :-1], x[:, 1:]
+
+    print(f"{args.layers} layers, batch {args.batch_size} x {args.seq_len}, {args.attention_backend} attention, {t.get_num_threads()} threads")
+    print(f"{'model':<24}{'step':<11}{'eager ms':>10}{'compiled ms':>13}{'speedup':>9}{'compile s':>11}")
+    for model_class in [DecoderOnlyTransformer, GPT]:
+        t.manual_seed(0)
+        model = model_class(config)
+        optimizer = t.optim.AdamW(model.parameters())
+
+        def forward():
+            with t.inference_mode():
+                model.eval()(inputs)
+
+        def train_step():
+            model.train()(inputs, targets=targets).backward()
+            optimizer.step()
+            optimizer.zero_grad()
+
+        eager = {}
+        for name, fn in [("inference", forward), ("train", train_step)]:
+            fn()
+            eager[name] = best_time(fn, args.repeats)
+
+        t._dynamo.reset()
+        compile_model(model)
+        for name, fn in [("inference", forward), ("train", train_step)]:
+            start = time.perf_counter()
+            fn()
+            compile_seconds = time.perf_counter() - start
+            compiled = best_time(fn, args.repeats)
+            print(
+                f"{model_class.__name__:<24}{name:<11}{eager[name]:>10.1f}{compiled:>13.1f}"
+                f"{eager[name] / compiled:>8.2f}x{compile_seconds:>11.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
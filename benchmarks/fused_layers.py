@@ -0,0 +1,96 @@
+"""
+Per-layer time and activation memory of transformer_modules' Dropout, GELU and LayerNorm against
+their previous, unfused implementations (reproduced below).
+
+Memory is the bytes autograd saves for backward, counted with saved_tensors_hooks. This is what
+a layer keeps alive per training step. Time is the best of --repeats forward+backward passes, and
+of forward-only passes under inference_mode.
+
+    python benchmarks/fused_layers.py --batch-size 32 --seq-len 128 --hidden 256
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch as t
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(REPO_ROOT, "common"))
+
+from transformer_modules import GELU, Dropout, LayerNorm
+
+
+def unfused_dropout(x, p=0.1):
+    dropout_matrix = t.rand(x.shape)
+    dropout_matrix[dropout_matrix < p] = 0
+    dropout_matrix[dropout_matrix >= p] = 1
+    return x * dropout_matrix.to(x.device) / (1 - p)
+
+
+def unfused_gelu(x):
+    return x * 0.5 * (1 + t.tanh(t.sqrt(t.tensor(2 / t.pi)) * (x + 0.044715 * x**3)))
+
+
+def unfused_layer_norm(x, weight, bias, eps=1e-5):
+    mean = t.mean(x, dim=-1, keepdim=True)
+    var = t.var(x, dim=-1, unbiased=False, keepdim=True)
+    return (x - mean) / t.sqrt(var + eps) * weight + bias
+
+
+def saved_bytes(fn, x):
+    nbytes = 0
+
+    def pack(tensor):
+        nonlocal nbytes
+        nbytes += tensor.numel() * tensor.element_size()
+        return tensor
+
+    with t.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        fn(x)
+    return nbytes
+
+
+def best_time(fn, repeats):
+    fn()
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--seq-len", type=int, default=128)
+    parser.add_argument("--hidden", type=int, default=256)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    layer_norm = LayerNorm(args.hidden)
+    dropout = Dropout(0.1).train()
+    gelu = GELU()
+    layers = [
+        # GELU sees the MLP's 4x wider activations
+        ("Dropout", args.hidden, unfused_dropout, dropout),
+        ("GELU", 4 * args.hidden, unfused_gelu, gelu),
+        ("LayerNorm", args.hidden, lambda x: unfused_layer_norm(x, layer_norm.weight, layer_norm.bias), layer_norm),
+    ]
+
+    print(f"activations of shape ({args.batch_size}, {args.seq_len}, hidden), {t.get_num_threads()} threads")
+    print(f"{'layer':<11}{'version':<9}{'fwd+bwd ms':>12}{'fwd ms':>10}{'saved MB':>10}")
+    for name, width, unfused, fused in layers:
+        x = t.randn(args.batch_size, args.seq_len, width, requires_grad=True)
+        grad = t.randn_like(x)
+        for version, fn in [("unfused", unfused), ("fused", fused)]:
+            train_ms = best_time(lambda: fn(x).backward(grad), args.repeats)
+            with t.inference_mode():
+                forward_ms = best_time(lambda: fn(x.detach()), args.repeats)
+            saved_mb = saved_bytes(fn, x) / 2**20
+            print(f"{name:<11}{version:<9}{train_ms:>12.1f}{forward_ms:>10.1f}{saved_mb:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Compares generation speed (tokens/sec) of sample_tokens with and without the KV cache.
+
+Uses a randomly initialised model with the Shakespeare transformer's configuration and the
+vocabulary pickles saved in decoder_transformer/, so no trained checkpoint is needed.
+
+    python benchmarks/kv_cache.py --tokens 100 --max-len 128
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch as t
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(REPO_ROOT, "common"))
+
+import sample_methods as s
+from nlp_modules import WordsTokenizer
+from transformer_modules import DecoderOnlyTransformer, TransformerConfig
+
+
+def load_shakespeare_tokenizer(model_max_length: int) -> WordsTokenizer:
+    tokenizer = WordsTokenizer(model_max_length)
+    tokenizer.load_saved(os.path.join(REPO_ROOT, "decoder_transformer"))
+    return tokenizer
+
+
+def time_generation(model, tokenizer, prompt, tokens, use_cache, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        t.manual_seed(0)
+        start = time.perf_counter()
+        s.sample_tokens(
+            model, tokenizer, prompt, max_tokens_generated=tokens, use_cache=use_cache, temperature=1.0, top_k=10
+        )
+        best = min(best, time.perf_counter() - start)
+    return tokens / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--max-len", type=int, default=128, help="tokenizer.model_max_length")
+    parser.add_argument("--layers", type=int, default=12)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--prompt", default="turn down for what")
+    args = parser.parse_args()
+
+    config = TransformerConfig(
+        num_layers=args.layers,
+        num_heads=8,
+        vocab_size=34543,
+        hidden_size=256,
+        max_seq_len=128,
+        dropout=0.1,
+    )
+    model = DecoderOnlyTransformer(config).eval()
+    tokenizer = load_shakespeare_tokenizer(args.max_len)
+
+    print(f"{args.layers} layers, {args.tokens} tokens, window {args.max_len}, {t.get_num_threads()} threads")
+    no_cache = time_generation(model, tokenizer, args.prompt, args.tokens, False, args.repeats)
+    cache = time_generation(model, tokenizer, args.prompt, args.tokens, True, args.repeats)
+    print(f"{'full recompute':<16}{no_cache:10.1f} tokens/sec")
+    print(f"{'kv cache':<16}{cache:10.1f} tokens/sec")
+    print(f"{'speedup':<16}{cache / no_cache:10.2f}x")
+
+
+if __name__ == "__main__":
+    main()
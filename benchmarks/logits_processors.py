@@ -0,0 +1,64 @@
+"""
+Per-step sampling latency of the batched logits-processor pipeline against apply_sampling_methods
+called once per row, on random logits over the Shakespeare vocabulary.
+
+    python benchmarks/logits_processors.py --batch-sizes 1 8 32 --seq-len 512
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch as t
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(REPO_ROOT, "common"))
+
+import sample_methods as s
+
+SETTINGS = {
+    "temperature": dict(temperature=0.8),
+    "top_k": dict(temperature=1.0, top_k=10),
+    "top_p": dict(temperature=1.0, top_p=0.9),
+    "top_p+freq_penalty": dict(temperature=1.0, top_p=0.9, freq_penalty=0.1),
+}
+
+
+def time_per_step(fn, steps):
+    fn()
+    start = time.perf_counter()
+    for _ in range(steps):
+        fn()
+    return (time.perf_counter() - start) / steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--seq-len", type=int, default=512, help="tokens already in each sequence")
+    parser.add_argument("--vocab-size", type=int, default=34543)
+    parser.add_argument("--steps", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'setting':<20}{'batch':>6}{'per-row ms':>12}{'pipeline ms':>13}{'speedup':>9}")
+    for name, kwargs in SETTINGS.items():
+        for batch_size in args.batch_sizes:
+            logits = t.randn(batch_size, args.vocab_size) * 3
+            input_ids = t.randint(0, args.vocab_size, (batch_size, args.seq_len))
+
+            def per_row():
+                for row in range(batch_size):
+                    s.apply_sampling_methods(input_ids[row], logits[row], **kwargs)
+
+            processors = s.make_logits_processors(input_ids.tolist(), args.vocab_size, **kwargs)
+
+            def pipeline():
+                s.sample_next_tokens(logits, processors)
+
+            old = time_per_step(per_row, args.steps)
+            new = time_per_step(pipeline, args.steps)
+            print(f"{name:<20}{batch_size:>6}{old * 1e3:>12.3f}{new * 1e3:>13.3f}{old / new:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+PyTorch eager against onnxruntime (onnx_export.OnnxModel on the CPU provider) for
+DecoderOnlyTransformer and GPT: parity of the logits, prefill latency, per-token decode latency
+with the KV cache, and end-to-end generation throughput through sample_methods.sample_tokens.
+
+    python benchmarks/onnx_runtime.py --layers 4 --batch-size 1 --seq-len 128 --new-tokens 64
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import torch as t
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(REPO_ROOT, "common"))
+
+import sample_methods as s
+from gpt_modules import GPT
+from onnx_export import OnnxModel, export_onnx
+from transformer_modules import DecoderOnlyTransformer, TransformerConfig
+
+
+class IdTokenizer:
+    """Token ids as space-separated integers, so generation needs no trained tokenizer."""
+
+    def __init__(self, model_max_length):
+        self.model_max_length = model_max_length
+
+    def encode(self, text):
+        return [int(word) for word in text.split()]
+
+    def decode(self, ids):
+        return " ".join(str(id) for id in ids)
+
+
+def best_time(fn, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1e3
+
+
+def measure(model, x, new_tokens, repeats):
+    prompt = " ".join(str(id) for id in x[0].tolist())
+    tokenizer = IdTokenizer(model_max_length=x.shape[1] + new_tokens)
+
+    def prefill():
+        return model(x, use_cache=True, only_last=True)
+
+    with t.inference_mode():
+        _, past = prefill()
+        next_token = x[:, -1:]
+
+        def decode_step():
+            model(next_token, past_key_values=past, use_cache=True, only_last=True)
+
+        prefill_ms = best_time(prefill, repeats)
+        decode_ms = best_time(decode_step, repeats * 4)
+
+    def generate():
+        s.sample_tokens(model, tokenizer, prompt, max_tokens_generated=new_tokens, temperature=0)
+
+    generate_ms = best_time(generate, 1)
+    return {
+        "prefill_ms": prefill_ms,
+        "decode_ms": decode_ms,
+        "tokens_per_sec": new_tokens / generate_ms * 1e3,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--seq-len", type=int, default=128)
+    parser.add_argument("--new-tokens", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    t.set_flush_denormal(True)
+    config = TransformerConfig(
+        num_layers=args.layers,
+        num_heads=8,
+        vocab_size=34543,
+        hidden_size=256,
+        max_seq_len=args.seq_len + args.new_tokens,
+    )
+    x = t.randint(0, config.vocab_size, (args.batch_size, args.seq_len))
+
+    print(f"{args.layers} layers, batch {args.batch_size} x {args.seq_len}, {args.new_tokens} new tokens, {t.get_num_threads()} threads")
+    print(f"{'model':<24}{'runtime':<13}{'prefill ms':>12}{'decode ms':>11}{'tokens/s':>10}{'max |diff|':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        for model_class in [DecoderOnlyTransformer, GPT]:
+            t.manual_seed(0)
+            model = model_class(config).eval()
+            start = time.perf_counter()
+            # generation only needs the last position's logits, so the graph only projects that one
+            path = os.path.join(directory, f"{model_class.__name__}.onnx")
+            onnx_model = OnnxModel(export_onnx(model, path, only_last=True))
+            export_seconds = time.perf_counter() - start
+
+            with t.inference_mode():
+                max_diff = (onnx_model(x, only_last=True) - model(x, only_last=True)).abs().max().item()
+            for runtime, runner in [("pytorch", model), ("onnxruntime", onnx_model)]:
+                results = measure(runner, x, args.new_tokens, args.repeats)
+                diff = f"{max_diff:>12.2e}" if runtime == "onnxruntime" else f"{'':>12}"
+                print(
+                    f"{model_class.__name__:<24}{runtime:<13}{results['prefill_ms']:>12.1f}"
+                    f"{results['decode_ms']:>11.2f}{results['tokens_per_sec']:>10.1f}{diff}"
+                )
+            print(f"{'':<24}export and session setup {export_seconds:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
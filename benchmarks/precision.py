@@ -0,0 +1,129 @@
+"""
+Training and inference speed and memory of the decoder-only transformer in each compute dtype:
+
+    fp32         float32 parameters and activations
+    bf16         bfloat16 parameters and activations (TransformerConfig(dtype=t.bfloat16))
+    fp16         float16 parameters and activations
+    bf16-mixed   float32 master weights, forward under t.autocast(dtype=t.bfloat16)
+
+Each mode runs in a fresh process, so peak memory is the growth of the process's peak RSS (or
+the peak CUDA allocation on a GPU) over that run: parameters, gradients, optimizer state and
+activations.
+
+Pure fp16 is only useful for inference: AdamW's eps underflows to zero in float16, so its training
+loss goes to nan. Train in bf16-mixed (or fp32) and cast the trained model for fp16 inference.
+
+    python benchmarks/precision.py --layers 4 --batch-size 8 --steps 5
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import torch as t
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(REPO_ROOT, "common"))
+
+from transformer_modules import DecoderOnlyTransformer, TransformerConfig
+
+MODES = {
+    "fp32": (t.float32, None),
+    "bf16": (t.bfloat16, None),
+    "fp16": (t.float16, None),
+    "bf16-mixed": (t.float32, t.bfloat16),
+}
+
+
+def peak_memory_mb(device: str) -> float:
+    if device == "cuda":
+        return t.cuda.max_memory_allocated() / 2**20
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def run_mode(mode, args, results):
+    t.manual_seed(0)
+    dtype, autocast_dtype = MODES[mode]
+    device = args.device
+    start_memory = peak_memory_mb(device)
+
+    config = TransformerConfig(
+        num_layers=args.layers, num_heads=8, vocab_size=34543, hidden_size=256, max_seq_len=args.seq_len, dtype=dtype
+    )
+    model = DecoderOnlyTransformer(config).to(device).train()
+    optimizer = t.optim.AdamW(model.parameters())
+    x = t.randint(0, config.vocab_size, (args.batch_size, args.seq_len + 1), device=device)
+    inputs, targets = x[:, :-1], x[:, 1:]
+
+    def train_step():
+        with t.autocast(device, dtype=autocast_dtype or t.bfloat16, enabled=autocast_dtype is not None):
+            logits = model(inputs)
+        loss = t.nn.functional.cross_entropy(logits.flatten(0, 1), targets.flatten())
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        return loss.item()
+
+    def synchronize():
+        if device == "cuda":
+            t.cuda.synchronize()
+
+    train_step()  # warmup
+    times = []
+    for _ in range(args.steps):
+        start = time.perf_counter()
+        loss = train_step()
+        synchronize()
+        times.append(time.perf_counter() - start)
+    train_memory = peak_memory_mb(device) - start_memory
+
+    model.eval()
+    with t.inference_mode(), t.autocast(device, dtype=autocast_dtype or t.bfloat16, enabled=autocast_dtype is not None):
+        model(inputs)
+        start = time.perf_counter()
+        for _ in range(args.steps):
+            model(inputs)
+        synchronize()
+        forward_time = (time.perf_counter() - start) / args.steps
+
+    tokens = args.batch_size * args.seq_len
+    results[mode] = {
+        "train_step_ms": min(times) * 1e3,
+        "train_tokens_per_sec": tokens / min(times),
+        "forward_ms": forward_time * 1e3,
+        "peak_train_memory_mb": train_memory,
+        "loss": loss,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=list(MODES))
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--seq-len", type=int, default=128)
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--device", default="cuda" if t.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Manager().dict()
+    for mode in args.modes:
+        process = context.Process(target=run_mode, args=(mode, args, results))
+        process.start()
+        process.join()
+
+    print(f"{args.layers} layers, batch {args.batch_size} x {args.seq_len} tokens on {args.device}")
+    columns = ["train_step_ms", "train_tokens_per_sec", "forward_ms", "peak_train_memory_mb", "loss"]
+    print(f"{'mode':<12}" + "".join(f"{column:>22}" for column in columns))
+    for mode in args.modes:
+        if mode not in results:
+            print(f"{mode:<12}{'failed':>22}")
+            continue
+        print(f"{mode:<12}" + "".join(f"{results[mode][column]:>22.2f}" for column in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Accuracy, speed and memory of the int8 dynamically quantized Shakespeare transformer against the
+float model.
+
+    python benchmarks/quantization.py --model decoder_transformer/transformer_shakespeare.pt --text 100-0.txt
+
+Without --model a randomly initialised model is used (so perplexities are meaningless, but speed
+and memory are not); without --text, random token ids are used as input.
+"""
+import argparse
+import os
+import sys
+
+import torch as t
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(REPO_ROOT, "common"))
+
+import utils
+from general_modules import quantize_linear_layers
+from kv_cache import load_shakespeare_tokenizer
+from transformer_modules import DecoderOnlyTransformer, TransformerConfig
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", help="checkpoint saved with t.save(model)")
+    parser.add_argument("--text", help="text file to evaluate on")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--seq-len", type=int, default=128)
+    args = parser.parse_args()
+
+    if args.model:
+        model = t.load(args.model, map_location="cpu", weights_only=False)
+    else:
+        config = TransformerConfig(num_layers=12, num_heads=8, vocab_size=34543, hidden_size=256, max_seq_len=128)
+        model = DecoderOnlyTransformer(config)
+    model.eval()
+
+    num_tokens = args.batch_size * args.seq_len
+    if args.text:
+        tokenizer = load_shakespeare_tokenizer(args.seq_len)
+        with open(args.text) as file:
+            ids = tokenizer.encode(file.read())[:num_tokens]
+        input_ids = t.tensor(ids).reshape(args.batch_size, args.seq_len)
+    else:
+        input_ids = t.randint(0, model.emb.weight.shape[0], (args.batch_size, args.seq_len))
+
+    quantized = quantize_linear_layers(model)
+    with t.inference_mode():
+        print(utils.quantization_report(model, quantized, input_ids).to_string(float_format="%.3f"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Load-tests a running inference_server with concurrent local clients and prints latency and
+throughput, followed by the server's own /metrics.
+
+    python common/inference_server.py --vocab-dir decoder_transformer &
+    python benchmarks/serve_load_test.py --requests 64 --concurrency 16
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import aiohttp
+
+PROMPTS = [
+    "turn down for what",
+    "shall I compare thee to a summer’s day",
+    "to be or not to be",
+    "now is the winter of our discontent",
+    "friends, Romans, countrymen, lend me your ears",
+]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def one_request(session, url, args, results):
+    body = {
+        "prompt": random.choice(PROMPTS),
+        "max_tokens": random.randint(args.min_tokens, args.max_tokens),
+        "temperature": 1.0,
+        "top_k": 10,
+        "stream": True,
+    }
+    if args.deadline:
+        body["deadline"] = args.deadline
+    start = time.perf_counter()
+    first_token = None
+    async with session.post(f"{url}/generate", json=body) as response:
+        if response.status != 200:
+            results.append({"status": response.status})
+            return
+        async for line in response.content:
+            message = json.loads(line)
+            if "text" in message and first_token is None:
+                first_token = time.perf_counter() - start
+            if "metrics" in message:
+                metrics = message["metrics"]
+    results.append(
+        {
+            "status": 200,
+            "latency": time.perf_counter() - start,
+            "client_ttft": first_token,
+            "tokens": metrics["generated_tokens"],
+        }
+    )
+
+
+async def main(args):
+    url = f"http://{args.host}:{args.port}"
+    results = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None)) as session:
+
+        async def limited():
+            async with semaphore:
+                await one_request(session, url, args, results)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[limited() for _ in range(args.requests)])
+        elapsed = time.perf_counter() - start
+
+        async with session.get(f"{url}/metrics") as response:
+            server_metrics = await response.json()
+
+    ok = [r for r in results if r["status"] == 200]
+    print(f"{len(ok)}/{len(results)} requests succeeded in {elapsed:.1f}s")
+    if ok:
+        print(f"throughput: {sum(r['tokens'] for r in ok) / elapsed:.1f} tokens/sec")
+        for name in ["latency", "client_ttft"]:
+            values = [r[name] for r in ok if r[name] is not None]
+            print(f"{name}: p50 {percentile(values, 0.5):.3f}s  p95 {percentile(values, 0.95):.3f}s")
+    print(json.dumps(server_metrics, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--min-tokens", type=int, default=10)
+    parser.add_argument("--max-tokens", type=int, default=50)
+    parser.add_argument("--deadline", type=float, help="per-request deadline in seconds")
+    asyncio.run(main(parser.parse_args()))
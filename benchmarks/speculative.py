@@ -0,0 +1,77 @@
+"""
+Acceptance rate and speedup of speculative_sample_tokens over sample_tokens, for several draft
+lengths k and draft model sizes.
+
+With random weights the draft and target models rarely agree, so pass trained checkpoints
+(saved with t.save(model)) to get meaningful acceptance rates:
+
+    python benchmarks/speculative.py --target transformer_shakespeare.pt --draft draft.pt --k 2 4 8
+
+Without --draft, randomly initialised drafts are built from the target's TransformerConfig with
+each of --draft-layers and --draft-hidden.
+"""
+import argparse
+import os
+import sys
+import time
+from dataclasses import replace
+
+import torch as t
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(REPO_ROOT, "common"))
+
+import sample_methods as s
+from kv_cache import load_shakespeare_tokenizer
+from transformer_modules import DecoderOnlyTransformer, TransformerConfig
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", help="checkpoint of the target model")
+    parser.add_argument("--draft", help="checkpoint of the draft model")
+    parser.add_argument("--draft-layers", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--draft-hidden", type=int, default=128)
+    parser.add_argument("--k", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--temperature", type=float, default=1.0)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--prompt", default="turn down for what")
+    args = parser.parse_args()
+
+    config = TransformerConfig(num_layers=12, num_heads=8, vocab_size=34543, hidden_size=256, max_seq_len=128)
+    if args.target:
+        model = t.load(args.target, map_location="cpu", weights_only=False)
+    else:
+        model = DecoderOnlyTransformer(config)
+    if args.draft:
+        drafts = {"checkpoint": t.load(args.draft, map_location="cpu", weights_only=False)}
+    else:
+        drafts = {
+            f"{layers} layers x {args.draft_hidden}": DecoderOnlyTransformer(
+                replace(config, num_layers=layers, hidden_size=args.draft_hidden)
+            )
+            for layers in args.draft_layers
+        }
+    tokenizer = load_shakespeare_tokenizer(config.max_seq_len)
+    sampling = dict(temperature=args.temperature, top_k=args.top_k)
+
+    start = time.perf_counter()
+    s.sample_tokens(model, tokenizer, args.prompt, max_tokens_generated=args.tokens, **sampling)
+    baseline = args.tokens / (time.perf_counter() - start)
+    print(f"target only: {baseline:.1f} tokens/sec")
+
+    print(f"{'draft':<20}{'k':>4}{'accept':>9}{'tok/fwd':>9}{'tok/sec':>10}{'speedup':>9}")
+    for name, draft in drafts.items():
+        for k in args.k:
+            _, stats = s.speculative_sample_tokens(
+                model, draft, tokenizer, args.prompt, args.tokens, num_speculative_tokens=k, **sampling
+            )
+            print(
+                f"{name:<20}{k:>4}{stats.acceptance_rate:>9.2f}{stats.tokens_per_target_forward:>9.2f}"
+                f"{stats.tokens_per_second:>10.1f}{stats.tokens_per_second / baseline:>8.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
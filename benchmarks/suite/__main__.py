@@ -0,0 +1,111 @@
+"""
+Reproducible CPU benchmark suite for DecoderOnlyTransformer, GPT and BERT.
+
+For every model family, TransformerConfig preset (presets.py), batch size and sequence length,
+measures forward and forward+backward throughput, and for the generative models time to first
+token and generation throughput, plus peak RSS. Each case runs in a fresh process with a fixed
+seed and thread count, and the results are written as JSON together with the environment
+(git commit, torch version, CPU, threads).
+
+    python benchmarks/suite run --suite quick --output baseline.json
+    python benchmarks/suite run --suite quick --output current.json --baseline baseline.json
+    python benchmarks/suite compare baseline.json current.json --threshold ttft_ms=0.2
+
+A comparison exits with status 1 if any metric got worse by more than its threshold (10% by
+default). Timings are only comparable between runs on the same machine and thread count.
+"""
+import argparse
+import itertools
+import json
+import sys
+
+import pandas as pd
+
+from compare import DEFAULT_THRESHOLDS, compare, environment_differences
+from presets import GENERATIVE_MODELS, MODELS, PRESETS, SUITES
+from runner import Case, environment, run_cases
+
+
+def parse_thresholds(values):
+    thresholds = {}
+    for value in values or []:
+        metric, _, threshold = value.partition("=")
+        if metric not in DEFAULT_THRESHOLDS:
+            raise SystemExit(f"Unknown metric {metric!r}; expected one of {list(DEFAULT_THRESHOLDS)}")
+        thresholds[metric] = float(threshold)
+    return thresholds
+
+
+def report(baseline: dict, current: dict, thresholds) -> bool:
+    '''
+    Prints the comparison; returns True if there are no regressions.
+    '''
+    for difference in environment_differences(baseline, current):
+        print(f"warning: environment differs from the baseline, {difference}")
+    comparison = compare(baseline, current, thresholds)
+    if comparison.empty:
+        print("No cases in common with the baseline")
+        return True
+    with pd.option_context("display.width", 200, "display.max_rows", None):
+        print(comparison.to_string(index=False, float_format=lambda x: f"{x:.4g}"))
+    regressions = comparison[comparison.regression]
+    print(f"{len(regressions)} regressions in {len(comparison)} comparisons")
+    return regressions.empty
+
+
+def run(args) -> bool:
+    suite = SUITES[args.suite]
+    cases = [
+        Case(model, preset, batch_size, seq_len, suite["new_tokens"] if model in GENERATIVE_MODELS else 0)
+        for model, preset, batch_size, seq_len in itertools.product(
+            args.models or suite["models"],
+            args.presets or suite["presets"],
+            suite["batch_sizes"],
+            suite["seq_lens"],
+        )
+    ]
+    results = {
+        "metadata": dict(environment(args.threads), suite=args.suite, repeats=args.repeats),
+        "results": run_cases(cases, args.repeats, args.threads),
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {len(cases)} cases to {args.output}")
+
+    if args.baseline is None:
+        return True
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    return report(baseline, results, parse_thresholds(args.threshold))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run a suite and write its results")
+    run_parser.add_argument("--suite", default="default", choices=list(SUITES))
+    run_parser.add_argument("--models", nargs="+", choices=list(MODELS), help="override the suite's model families")
+    run_parser.add_argument("--presets", nargs="+", choices=list(PRESETS), help="override the suite's presets")
+    run_parser.add_argument("--repeats", type=int, default=5)
+    run_parser.add_argument("--threads", type=int, default=1)
+    run_parser.add_argument("--output", default="benchmark_results.json")
+    run_parser.add_argument("--baseline", help="results of an earlier run to compare against")
+    run_parser.add_argument("--threshold", nargs="+", metavar="METRIC=FRACTION")
+
+    compare_parser = subparsers.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", nargs="+", metavar="METRIC=FRACTION")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        ok = run(args)
+    else:
+        with open(args.baseline) as f, open(args.current) as g:
+            ok = report(json.load(f), json.load(g), parse_thresholds(args.threshold))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Compares a benchmark run against a baseline run, metric by metric, and flags regressions that
+exceed per-metric thresholds.
+"""
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+# metric -> True if higher is better
+METRICS = {
+    "forward_tokens_per_sec": True,
+    "train_tokens_per_sec": True,
+    "generate_tokens_per_sec": True,
+    "ttft_ms": False,
+    "peak_rss_mb": False,
+}
+
+# largest tolerated relative change for the worse, e.g. 0.1 = 10% fewer tokens/sec or 10% more ms
+DEFAULT_THRESHOLDS = {
+    "forward_tokens_per_sec": 0.1,
+    "train_tokens_per_sec": 0.1,
+    "generate_tokens_per_sec": 0.1,
+    "ttft_ms": 0.1,
+    "peak_rss_mb": 0.1,
+}
+
+CASE_KEYS = ["model", "preset", "batch_size", "seq_len", "new_tokens"]
+
+# differences in these make timings incomparable
+ENVIRONMENT_KEYS = ["torch", "platform", "processor", "cpu_count", "threads"]
+
+
+def compare(baseline: dict, current: dict, thresholds: Optional[Dict[str, float]] = None) -> pd.DataFrame:
+    '''
+    baseline, current: results as written by `python benchmarks/suite run`
+
+    Return: one row per case and metric present in both runs, with the baseline and current
+        values, the relative change (positive = better) and whether it is a regression
+    '''
+    thresholds = {**DEFAULT_THRESHOLDS, **(thresholds or {})}
+    baseline_cases = {_key(result): result for result in baseline["results"] if "error" not in result}
+    rows = []
+    for result in current["results"]:
+        if "error" in result or _key(result) not in baseline_cases:
+            continue
+        reference = baseline_cases[_key(result)]
+        for metric, higher_is_better in METRICS.items():
+            if metric not in result or metric not in reference:
+                continue
+            change = result[metric] / reference[metric] - 1 if reference[metric] else 0.0
+            if not higher_is_better:
+                change = -change
+            rows.append(
+                dict(
+                    {key: result[key] for key in CASE_KEYS},
+                    metric=metric,
+                    baseline=reference[metric],
+                    current=result[metric],
+                    change=change,
+                    regression=change < -thresholds[metric],
+                )
+            )
+    return pd.DataFrame(rows, columns=CASE_KEYS + ["metric", "baseline", "current", "change", "regression"])
+
+
+def environment_differences(baseline: dict, current: dict) -> List[str]:
+    '''
+    Return: a description of every environment field that differs between the two runs
+    '''
+    return [
+        f"{key}: {baseline['metadata'].get(key)} -> {current['metadata'].get(key)}"
+        for key in ENVIRONMENT_KEYS
+        if baseline["metadata"].get(key) != current["metadata"].get(key)
+    ]
+
+
+def _key(result: dict) -> tuple:
+    return tuple(result[key] for key in CASE_KEYS)
@@ -0,0 +1,42 @@
+"""
+Model sizes and sweeps of the benchmark suite. Every model family is built from the same
+TransformerConfig preset, so numbers are comparable across families.
+"""
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(REPO_ROOT, "common"))
+
+from bert_modules import BERTLanguageModel
+from gpt_modules import GPT
+from transformer_modules import DecoderOnlyTransformer, TransformerConfig
+
+MODELS = {
+    "decoder": DecoderOnlyTransformer,
+    "gpt": GPT,
+    "bert": BERTLanguageModel,
+}
+
+# families that generate text, and so get generation and time-to-first-token measurements
+GENERATIVE_MODELS = ("decoder", "gpt")
+
+PRESETS = {
+    "tiny": dict(num_layers=2, num_heads=4, vocab_size=1000, hidden_size=64),
+    # the size of the Shakespeare transformer
+    "small": dict(num_layers=4, num_heads=8, vocab_size=34543, hidden_size=256),
+    # GPT-2 small / BERT base
+    "base": dict(num_layers=12, num_heads=12, vocab_size=50257, hidden_size=768),
+}
+
+SUITES = {
+    "quick": dict(models=list(MODELS), presets=["tiny"], batch_sizes=[1, 4], seq_lens=[32], new_tokens=8),
+    "default": dict(models=list(MODELS), presets=["tiny", "small"], batch_sizes=[1, 8], seq_lens=[64, 256], new_tokens=32),
+    "full": dict(
+        models=list(MODELS), presets=list(PRESETS), batch_sizes=[1, 8, 32], seq_lens=[128, 512], new_tokens=64
+    ),
+}
+
+
+def make_config(preset: str, max_seq_len: int, **kwargs) -> TransformerConfig:
+    return TransformerConfig(**PRESETS[preset], max_seq_len=max_seq_len, **kwargs)
@@ -0,0 +1,160 @@
+"""
+Runs one benchmark case (model family, preset, batch size, sequence length) and returns its
+measurements. Each case runs in a fresh spawned process, so that peak RSS covers only that case
+and no allocator or thread-pool state carries over between cases.
+"""
+import multiprocessing
+import platform
+import resource
+import statistics
+import subprocess
+import time
+from dataclasses import asdict, dataclass
+
+import torch as t
+
+import sample_methods as s
+from presets import GENERATIVE_MODELS, MODELS, REPO_ROOT, make_config
+
+
+@dataclass(frozen=True)
+class Case:
+    model: str
+    preset: str
+    batch_size: int
+    seq_len: int
+    new_tokens: int
+
+
+class IdTokenizer:
+    """Token ids as space-separated integers, so generation needs no trained tokenizer."""
+
+    def __init__(self, model_max_length):
+        self.model_max_length = model_max_length
+
+    def encode(self, text):
+        return [int(word) for word in text.split()]
+
+    def decode(self, ids):
+        return " ".join(str(id) for id in ids)
+
+
+def rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def median_time(fn, repeats: int) -> float:
+    fn()  # warmup
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def measure(case: Case, repeats: int) -> dict:
+    '''
+    Return: the case's fields plus
+        forward_tokens_per_sec   inference forward passes
+        train_tokens_per_sec     forward and backward passes of the training loss
+        ttft_ms                  prefill plus picking the first token of every row (generative models)
+        generate_tokens_per_sec  new tokens per second of sample_tokens_batch (generative models)
+        peak_rss_mb              peak RSS of the case's process, including the Python and torch runtime
+        params                   number of parameters
+    '''
+    t.manual_seed(0)
+    config = make_config(case.preset, max_seq_len=case.seq_len + case.new_tokens)
+    model = MODELS[case.model](config)
+    generative = case.model in GENERATIVE_MODELS
+    x = t.randint(0, config.vocab_size, (case.batch_size, case.seq_len + 1))
+    inputs, targets = x[:, :-1], x[:, 1:]
+    tokens = case.batch_size * case.seq_len
+
+    def forward():
+        with t.inference_mode():
+            model.eval()(inputs)
+
+    def train_step():
+        model.train()
+        if generative:
+            loss = model(inputs, targets=targets)
+        else:
+            loss = t.nn.functional.cross_entropy(model(inputs).flatten(0, 1), targets.flatten())
+        loss.backward()
+        model.zero_grad(set_to_none=True)
+
+    result = asdict(case)
+    result["params"] = sum(p.numel() for p in model.parameters())
+    result["forward_tokens_per_sec"] = tokens / median_time(forward, repeats)
+    result["train_tokens_per_sec"] = tokens / median_time(train_step, repeats)
+
+    if generative:
+        model.eval()
+
+        def first_token():
+            with t.inference_mode():
+                logits, _ = model(inputs, use_cache=True, only_last=True)
+                logits[:, -1].argmax(dim=-1)
+
+        tokenizer = IdTokenizer(model_max_length=case.seq_len + case.new_tokens)
+        prompts = [" ".join(str(id) for id in row) for row in inputs.tolist()]
+
+        def generate():
+            s.sample_tokens_batch(model, tokenizer, prompts, case.new_tokens, temperature=0)
+
+        result["ttft_ms"] = median_time(first_token, repeats) * 1e3
+        result["generate_tokens_per_sec"] = case.batch_size * case.new_tokens / median_time(generate, max(1, repeats // 2))
+
+    result["peak_rss_mb"] = rss_mb()
+    return result
+
+
+def _run(case: Case, repeats: int, threads: int, results) -> None:
+    t.set_num_threads(threads)
+    # random-init weights drive activations into denormals, which are very slow on CPU
+    t.set_flush_denormal(True)
+    results.append(measure(case, repeats))
+
+
+def run_cases(cases, repeats: int = 5, threads: int = 1, verbose: bool = True):
+    '''
+    Measures every case in its own process; a case that crashes (e.g. out of memory) is reported
+    with an "error" field instead of measurements.
+    '''
+    context = multiprocessing.get_context("spawn")
+    manager = context.Manager()
+    results = []
+    for case in cases:
+        shared = manager.list()
+        process = context.Process(target=_run, args=(case, repeats, threads, shared))
+        process.start()
+        process.join()
+        result = shared[0] if shared else dict(asdict(case), error=f"exit code {process.exitcode}")
+        results.append(result)
+        if verbose:
+            print(" ".join(f"{key}={_format(value)}" for key, value in result.items()), flush=True)
+    return results
+
+
+def environment(threads: int) -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "torch": t.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": multiprocessing.cpu_count(),
+        "threads": threads,
+    }
+
+
+def _format(value) -> str:
+    return f"{value:.4g}" if isinstance(value, float) else str(value)
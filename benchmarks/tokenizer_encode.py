@@ -0,0 +1,96 @@
+"""
+WordsTokenizer encoding throughput in MB/s of text: encode against encode_bulk in this process and
+in a process pool for a whole corpus, and encode per prompt against encode_batch for many short
+prompts. Every result is checked against encode.
+
+    python benchmarks/tokenizer_encode.py --corpus decoder_transformer/100-0.txt --workers 4
+
+Without --corpus the text is generated (a Shakespeare-sized 5.5 MB of words and punctuation).
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(REPO_ROOT, "common"))
+
+from nlp_modules import WordsTokenizer
+
+
+def synthetic_corpus(num_chars, seed=0):
+    rng = random.Random(seed)
+    words = [f"{rng.choice(['', 'Th', 'w', 'St'])}ord{i}" for i in range(30000)]
+    separators = [" ", " ", " ", ", ", ". ", ";\n", "'s ", "!\n\n"]
+    parts, length = [], 0
+    while length < num_chars:
+        part = rng.choice(words) + rng.choice(separators)
+        parts.append(part)
+        length += len(part)
+    return "".join(parts)
+
+
+def best_time(fn, repeats):
+    best, result = float("inf"), None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="text file to encode; default synthetic")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-chars", type=int, default=1 << 20)
+    parser.add_argument("--prompts", type=int, default=10000, help="number of short prompts for encode_batch")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.corpus:
+        with open(args.corpus) as f:
+            text = f.read()
+    else:
+        text = synthetic_corpus(5_500_000)
+    megabytes = len(text.encode()) / 1e6
+    tokenizer = WordsTokenizer(model_max_length=128)
+    tokenizer.build_dict(text)
+
+    baseline_seconds, expected = best_time(lambda: tokenizer.encode(text), args.repeats)
+    print(f"{megabytes:.1f} MB, {len(expected)} tokens, vocab {len(tokenizer.word_id_map)}, {os.cpu_count()} CPUs")
+    print(f"{'method':<32}{'seconds':>9}{'MB/s':>9}{'speedup':>9}")
+
+    def report(name, seconds, megabytes, baseline_seconds):
+        print(f"{name:<32}{seconds:>9.3f}{megabytes / seconds:>9.1f}{baseline_seconds / seconds:>8.2f}x")
+
+    report("encode", baseline_seconds, megabytes, baseline_seconds)
+    for workers in sorted({1, args.workers}):
+        seconds, encoded = best_time(
+            lambda: tokenizer.encode_bulk(text, num_workers=workers, chunk_chars=args.chunk_chars), args.repeats
+        )
+        assert encoded.tolist() == expected
+        report(f"encode_bulk, {workers} worker{'s' if workers > 1 else ''}", seconds, megabytes, baseline_seconds)
+
+    # prompts of 1 to 40 tokens cut from the corpus
+    rng = random.Random(0)
+    tokens = [tokenizer.id_word_map[id] for id in expected]
+    prompts = []
+    for _ in range(args.prompts):
+        start = rng.randrange(len(tokens) - 40)
+        prompts.append("".join(tokens[start:start + rng.randint(1, 40)]))
+    prompt_megabytes = sum(len(prompt.encode()) for prompt in prompts) / 1e6
+
+    baseline_seconds, expected = best_time(lambda: [tokenizer.encode(prompt) for prompt in prompts], args.repeats)
+    print(f"\n{args.prompts} prompts, {prompt_megabytes:.2f} MB")
+    report("encode per prompt", baseline_seconds, prompt_megabytes, baseline_seconds)
+    seconds, encoded = best_time(lambda: tokenizer.encode_batch(prompts), args.repeats)
+    assert encoded == expected
+    report("encode_batch", seconds, prompt_megabytes, baseline_seconds)
+    seconds, _ = best_time(lambda: tokenizer.encode_batch(prompts, return_tensors="np"), args.repeats)
+    report("encode_batch, numpy", seconds, prompt_megabytes, baseline_seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+WordsTokenizer vocabulary load time and Python heap: the word_id_map.pkl and id_word_map.pkl
+pickles against vocab.bin, both alone (enough to decode) and with the word -> id index encoding
+builds on first use.
+
+    python benchmarks/vocab_load.py --vocab-dir decoder_transformer
+"""
+import argparse
+import os
+import pickle
+import sys
+import time
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(REPO_ROOT, "common"))
+
+from nlp_modules import WordsTokenizer
+
+
+def load_pickles(vocab_dir):
+    tokenizer = WordsTokenizer(model_max_length=128)
+    with open(os.path.join(vocab_dir, "word_id_map.pkl"), "rb") as file:
+        tokenizer.word_id_map = pickle.load(file)
+    with open(os.path.join(vocab_dir, "id_word_map.pkl"), "rb") as file:
+        tokenizer.id_word_map = pickle.load(file)
+    return tokenizer
+
+
+def load_vocab(vocab_dir, build_index=False):
+    tokenizer = WordsTokenizer(model_max_length=128)
+    tokenizer.load_saved(vocab_dir)
+    if build_index:
+        tokenizer.word_id_map
+    return tokenizer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vocab-dir", default=os.path.join(REPO_ROOT, "decoder_transformer"))
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    sizes = {name: os.path.getsize(os.path.join(args.vocab_dir, name)) for name in ["word_id_map.pkl", "id_word_map.pkl", "vocab.bin"]}
+    print(f"pickles {(sizes['word_id_map.pkl'] + sizes['id_word_map.pkl']) / 1e3:.0f} KB, vocab.bin {sizes['vocab.bin'] / 1e3:.0f} KB")
+    print(f"{'load':<28}{'ms':>8}{'heap MiB':>10}")
+    for name, load in [
+        ("pickles", lambda: load_pickles(args.vocab_dir)),
+        ("vocab.bin", lambda: load_vocab(args.vocab_dir)),
+        ("vocab.bin, encode index", lambda: load_vocab(args.vocab_dir, build_index=True)),
+    ]:
+        best = float("inf")
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            load()
+            best = min(best, time.perf_counter() - start)
+        tracemalloc.start()
+        tokenizer = load()
+        heap, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del tokenizer
+        print(f"{name:<28}{best * 1e3:>8.2f}{heap / 2**20:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Attention backends shared by the decoder-only transformer, GPT and BERT attention modules.
+
+    reference   the original einsum computation: materializes the (batch, nheads, seq, kv_seq)
+                scores and runs softmax as a separate pass
+    sdpa        torch.nn.functional.scaled_dot_product_attention, which dispatches to a fused
+                kernel (flash / memory-efficient / math) for the device
+    tiled       pure-PyTorch online softmax over blocks of keys, one block of queries at a time,
+                so only (block_size, block_size) scores exist per head at once
+
+All backends compute the same function up to floating point error, with one exception: rows
+whose keys are all masked (e.g. the queries at left-padding positions) are garbage in every
+backend, but not the same garbage.
+"""
+import functools
+from typing import Optional
+
+import torch as t
+from torch import nn
+
+ATTENTION_BACKENDS = ("reference", "sdpa", "tiled")
+
+
+@functools.lru_cache(maxsize=64)
+def causal_mask(seq_len: int, kv_seq_len: int, device: t.device) -> t.Tensor:
+    """
+    Lower-left triangle of True, including the diagonal, shifted right by the number of cached
+    positions (kv_seq_len - seq_len). Cached, so each layer and decoding step reuses one tensor.
+
+    Return: shape (seq_len, kv_seq_len), bool
+    """
+    # a mask created under inference_mode couldn't later be saved for backward in training
+    with t.inference_mode(False), t.no_grad():
+        return _causal_mask(seq_len, kv_seq_len, device)
+
+
+def _causal_mask(seq_len: int, kv_seq_len: int, device: t.device) -> t.Tensor:
+    return t.ones(seq_len, kv_seq_len, dtype=t.bool, device=device).tril(diagonal=kv_seq_len - seq_len)
+
+
+def _get_causal_mask(seq_len: int, kv_seq_len: int, device: t.device) -> t.Tensor:
+    # torch.compile would trace through the cache, so compiled graphs build the mask themselves
+    if t.compiler.is_compiling():
+        return _causal_mask(seq_len, kv_seq_len, device)
+    return causal_mask(seq_len, kv_seq_len, device)
+
+
+def _mask_value(dtype: t.dtype) -> float:
+    # close to -inf, but finite so fully masked rows don't produce nan; -1e9 overflows float16
+    return max(-1e9, t.finfo(dtype).min)
+
+
+def reference_attention(
+    Q: t.Tensor,
+    K: t.Tensor,
+    V: t.Tensor,
+    causal: bool = True,
+    padding_mask: Optional[t.Tensor] = None,
+    additive_mask: Optional[t.Tensor] = None,
+    dropout: Optional[nn.Module] = None,
+) -> t.Tensor:
+    """
+    Q: shape (batch, nheads, seq, headsize)
+    K, V: shape (batch, nheads, kv_seq, headsize)
+    padding_mask: shape (batch, kv_seq) - 1 for real tokens, 0 for padding
+    additive_mask: broadcastable to (batch, nheads, seq, kv_seq) - added to the scores
+    dropout: applied to the attention probabilities
+
+    Return: shape (batch, nheads, seq, headsize)
+    """
+    # einsum("B nheads Qseq headsize, B nheads Kseq headsize -> B nheads Qseq Kseq", Q, K)
+    scores = Q @ K.transpose(-1, -2)
+    scores /= Q.shape[-1] ** 0.5
+
+    if causal:
+        scores = scores.masked_fill(~_get_causal_mask(Q.shape[2], K.shape[2], Q.device), _mask_value(scores.dtype))
+    if padding_mask is not None:
+        # no query may attend to a padding key
+        scores = scores.masked_fill(padding_mask[:, None, None, :] == 0, _mask_value(scores.dtype))
+    if additive_mask is not None:
+        scores = scores + additive_mask
+
+    scores = t.softmax(scores, dim=-1)
+    if dropout is not None:
+        scores = dropout(scores)
+    # einsum("B nheads Qseq Kseq, B nheads Kseq headsize -> B nheads Qseq headsize", scores, V)
+    return scores @ V
+
+
+def sdpa_attention(
+    Q: t.Tensor,
+    K: t.Tensor,
+    V: t.Tensor,
+    causal: bool = True,
+    padding_mask: Optional[t.Tensor] = None,
+    additive_mask: Optional[t.Tensor] = None,
+    dropout: Optional[nn.Module] = None,
+) -> t.Tensor:
+    """
+    Same arguments as reference_attention. Dropout uses the fused kernel's own random masks, with
+    dropout.p, rather than calling the dropout module.
+    """
+    dropout_p = dropout.p if dropout is not None and dropout.training else 0.0
+    seq_len, kv_seq_len = Q.shape[2], K.shape[2]
+    if padding_mask is None and additive_mask is None and (not causal or seq_len == kv_seq_len):
+        return t.nn.functional.scaled_dot_product_attention(Q, K, V, dropout_p=dropout_p, is_causal=causal)
+
+    # a float mask rather than a bool one: a row of all-False would give nan
+    mask = t.zeros(seq_len, kv_seq_len, dtype=Q.dtype, device=Q.device)
+    if causal:
+        mask = mask.masked_fill(~_get_causal_mask(seq_len, kv_seq_len, Q.device), _mask_value(Q.dtype))
+    if padding_mask is not None:
+        mask = mask.masked_fill(padding_mask[:, None, None, :] == 0, _mask_value(Q.dtype))
+    if additive_mask is not None:
+        mask = mask + additive_mask.to(Q.dtype)
+    return t.nn.functional.scaled_dot_product_attention(Q, K, V, attn_mask=mask, dropout_p=dropout_p)
+
+
+def tiled_attention(
+    Q: t.Tensor,
+    K: t.Tensor,
+    V: t.Tensor,
+    causal: bool = True,
+    padding_mask: Optional[t.Tensor] = None,
+    additive_mask: Optional[t.Tensor] = None,
+    dropout: Optional[nn.Module] = None,
+    block_size: int = 128,
+) -> t.Tensor:
+    """
+    Same arguments as reference_attention. Processes block_size queries at a time against
+    block_size keys at a time, keeping a running max and sum per query (online softmax) in float32,
+    and skips key blocks that lie entirely in the causally masked future.
+
+    Only the forward pass is memory-efficient: autograd keeps every block's scores for backward.
+    """
+    batch_size, nheads, seq_len, headsize = Q.shape
+    kv_seq_len = K.shape[2]
+    offset = kv_seq_len - seq_len
+    scale = headsize**-0.5
+    fill = _mask_value(t.float32)
+    if additive_mask is not None:
+        additive_mask = additive_mask.expand(batch_size, nheads, seq_len, kv_seq_len)
+
+    out = t.empty_like(Q)
+    for q_start in range(0, seq_len, block_size):
+        q_end = min(q_start + block_size, seq_len)
+        q = Q[:, :, q_start:q_end]
+        q_positions = t.arange(q_start + offset, q_end + offset, device=Q.device)[:, None]
+        running_max = t.full((batch_size, nheads, q_end - q_start, 1), fill, device=Q.device)
+        running_sum = t.zeros(batch_size, nheads, q_end - q_start, 1, device=Q.device)
+        acc = t.zeros(batch_size, nheads, q_end - q_start, headsize, device=Q.device)
+
+        kv_end = min(kv_seq_len, q_end + offset) if causal else kv_seq_len
+        for k_start in range(0, kv_end, block_size):
+            k_end = min(k_start + block_size, kv_end)
+            scores = (q @ K[:, :, k_start:k_end].transpose(-1, -2)).float() * scale
+            if causal and k_end - 1 > q_start + offset:
+                # the block crosses the diagonal
+                k_positions = t.arange(k_start, k_end, device=Q.device)
+                scores = scores.masked_fill(k_positions > q_positions, fill)
+            if padding_mask is not None:
+                scores = scores.masked_fill(padding_mask[:, None, None, k_start:k_end] == 0, fill)
+            if additive_mask is not None:
+                scores = scores + additive_mask[..., q_start:q_end, k_start:k_end]
+
+            new_max = t.maximum(running_max, scores.amax(dim=-1, keepdim=True))
+            probs = t.exp(scores - new_max)
+            correction = t.exp(running_max - new_max)
+            running_sum = running_sum * correction + probs.sum(dim=-1, keepdim=True)
+            if dropout is not None:
+                # dropping unnormalized probabilities is the same as dropping normalized ones
+                probs = dropout(probs)
+            acc = acc * correction + (probs.to(V.dtype) @ V[:, :, k_start:k_end]).float()
+            running_max = new_max
+
+        out[:, :, q_start:q_end] = (acc / running_sum).to(Q.dtype)
+    return out
+
+
+_BACKENDS = {"reference": reference_attention, "sdpa": sdpa_attention, "tiled": tiled_attention}
+
+
+def multihead_attention(
+    Q: t.Tensor,
+    K: t.Tensor,
+    V: t.Tensor,
+    num_heads: int,
+    backend: str = "reference",
+    causal: bool = True,
+    padding_mask: Optional[t.Tensor] = None,
+    additive_mask: Optional[t.Tensor] = None,
+    dropout: Optional[nn.Module] = None,
+) -> t.Tensor:
+    """
+    Splits Q, K and V into heads and runs the chosen backend.
+
+    Q: shape (batch, seq, nheads*headsize)
+    K, V: shape (batch, kv_seq, nheads*headsize) - kv_seq may be longer than seq when cached keys
+        and values are prepended, in which case the queries are the last seq positions
+
+    Return: shape (batch, seq, nheads*headsize)
+    """
+    if backend not in _BACKENDS:
+        raise ValueError(f"Unknown attention backend {backend!r}; expected one of {ATTENTION_BACKENDS}")
+    # rearrange(M, "B S (nheads headsize) -> B nheads S headsize"), resolved once here
+    Q, K, V = (M.unflatten(-1, (num_heads, -1)).transpose(1, 2) for M in (Q, K, V))
+    Z = _BACKENDS[backend](Q, K, V, causal, padding_mask, additive_mask, dropout)
+    return Z.transpose(1, 2).flatten(-2)
+
+
+def set_attention_backend(model: nn.Module, backend: str) -> nn.Module:
+    """
+    Switches every attention module in model (anything with a `backend` attribute) to backend,
+    e.g. for a model loaded from a checkpoint saved before backends existed.
+    """
+    if backend not in _BACKENDS:
+        raise ValueError(f"Unknown attention backend {backend!r}; expected one of {ATTENTION_BACKENDS}")
+    for module in model.modules():
+        if hasattr(module, "backend"):
+            module.backend = backend
+    return model
@@ -0,0 +1,65 @@
+import unittest
+
+import torch as t
+
+import attention
+from gpt_modules import GPT
+from transformer_modules import DecoderOnlyTransformer, TransformerConfig
+
+
+class TestAttentionBackends(unittest.TestCase):
+    def setUp(self):
+        t.manual_seed(0)
+        self.Q = t.randn(2, 3, 5, 8)
+        self.K = t.randn(2, 3, 9, 8)
+        self.V = t.randn(2, 3, 9, 8)
+
+    def assert_backends_match(self, Q, K, V, rows=slice(None), **kwargs):
+        expected = attention.reference_attention(Q, K, V, **kwargs)
+        for backend in ["sdpa", "tiled"]:
+            with self.subTest(backend=backend):
+                if backend == "tiled":
+                    actual = attention.tiled_attention(Q, K, V, **kwargs, block_size=4)
+                else:
+                    actual = attention.sdpa_attention(Q, K, V, **kwargs)
+                t.testing.assert_close(actual[rows], expected[rows], atol=1e-5, rtol=1e-4)
+
+    def test_causal(self):
+        self.assert_backends_match(self.K, self.K, self.V)
+
+    def test_causal_with_cached_keys(self):
+        self.assert_backends_match(self.Q, self.K, self.V)
+
+    def test_padding(self):
+        padding_mask = t.ones(2, 9, dtype=t.long)
+        padding_mask[1, :3] = 0
+        # rows whose keys are all padding are garbage in every backend; compare the rest
+        self.assert_backends_match(self.Q, self.K, self.V, padding_mask=padding_mask)
+        self.assert_backends_match(self.K, self.K, self.V, rows=(slice(None), slice(None), slice(3, None)), padding_mask=padding_mask)
+
+    def test_bidirectional_additive_mask(self):
+        additive_mask = t.zeros(2, 1, 1, 9)
+        additive_mask[0, ..., -2:] = -10000
+        self.assert_backends_match(self.Q, self.K, self.V, causal=False, additive_mask=additive_mask)
+
+    def test_models(self):
+        x = t.randint(0, 50, (2, 16))
+        for model_class in [DecoderOnlyTransformer, GPT]:
+            config = TransformerConfig(num_layers=2, num_heads=2, vocab_size=50, hidden_size=32, max_seq_len=16)
+            model = model_class(config).eval()
+            expected, presents = model(x[:, :12], use_cache=True)
+            expected_next = model(x[:, 12:], past_key_values=presents)
+            for backend in ["sdpa", "tiled"]:
+                attention.set_attention_backend(model, backend)
+                logits, presents = model(x[:, :12], use_cache=True)
+                t.testing.assert_close(logits, expected, atol=1e-4, rtol=1e-4)
+                t.testing.assert_close(model(x[:, 12:], past_key_values=presents), expected_next, atol=1e-4, rtol=1e-4)
+            attention.set_attention_backend(model, "reference")
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            attention.multihead_attention(self.Q, self.Q, self.Q, 1, backend="flash")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,175 @@
+from typing import Optional
+
+import torch as t
+from torch import nn
+
+import attention
+from general_modules import Linear
+from transformer_modules import Dropout, Embedding, GELU, LayerNorm, MLP, TransformerConfig, run_blocks
+
+
+class BertAttention(nn.Module):
+    # one of attention.ATTENTION_BACKENDS
+    backend = "reference"
+
+    def __init__(self, hidden_size: int, num_heads: int, backend: str = "reference", dtype: Optional[t.dtype] = None):
+        super().__init__()
+        self.num_heads = num_heads
+        self.backend = backend
+        self.query_size = int(hidden_size / num_heads)
+        self.W_Q = nn.Linear(hidden_size, hidden_size, dtype=dtype)
+        self.W_K = nn.Linear(hidden_size, hidden_size, dtype=dtype)
+        self.W_V = nn.Linear(hidden_size, hidden_size, dtype=dtype)
+        self.ff = Linear(hidden_size, hidden_size, dtype=dtype)
+
+    def multihead_masked_attention(
+        self, Q: t.Tensor, K: t.Tensor, V: t.Tensor, additive_attention_mask: Optional[t.Tensor], num_heads: int
+    ):
+        """
+        Implements bidirectional multihead attention on the matrices Q, K and V, using self.backend.
+
+        Q: shape (batch, seq, nheads*headsize)
+        K: shape (batch, seq, nheads*headsize)
+        V: shape (batch, seq, nheads*headsize)
+        additive_attention_mask: shape (batch, nheads=1, seqQ=1, seqK)
+
+        returns: shape (batch, seq, nheads*headsize)
+        """
+        return attention.multihead_attention(
+            Q, K, V, num_heads, self.backend, causal=False, additive_mask=additive_attention_mask
+        )
+
+    def forward(self, x: t.Tensor, additive_attention_mask: Optional[t.Tensor]) -> t.Tensor:
+        """
+        x: shape (batch, seq, hidden_size)
+
+        Return: shape (batch, seq, hidden_size)
+        """
+        Q = self.W_Q(x)
+        K = self.W_K(x)
+        V = self.W_V(x)
+
+        Z = self.multihead_masked_attention(Q, K, V, additive_attention_mask, self.num_heads)
+        out = self.ff(Z)
+        return out
+
+
+class BERTBlock(nn.Module):
+
+    def __init__(self, config: TransformerConfig):
+        super().__init__()
+        self.attn = BertAttention(
+            config.hidden_size, config.num_heads, backend=config.attention_backend, dtype=config.dtype
+        )
+        self.lnorm1 = LayerNorm(config.hidden_size, eps=config.layer_norm_epsilon, dtype=config.dtype)
+        self.mlp = MLP(config.hidden_size, config.dropout, dtype=config.dtype)
+        self.lnorm2 = LayerNorm(config.hidden_size, eps=config.layer_norm_epsilon, dtype=config.dtype)
+
+    def forward(self, x: t.Tensor, additive_attention_mask: Optional[t.Tensor] = None) -> t.Tensor:
+        '''
+        x: shape (batch, seq, hidden_size)
+        additive_attention_mask: shape (batch, nheads=1, seqQ=1, seqK)
+        '''
+        attn = self.attn(x, additive_attention_mask)
+        out = self.lnorm1(attn + x)
+        mlp = self.mlp(out)
+        out = self.lnorm2(mlp + out)
+        return out
+
+
+def make_additive_attention_mask(one_zero_attention_mask: t.Tensor, big_negative_number: float = -10000) -> t.Tensor:
+    '''
+    one_zero_attention_mask:
+        shape (batch, seq)
+        Contains 1 if this is a valid token and 0 if it is a padding token.
+
+    big_negative_number:
+        Any negative number large enough in magnitude that exp(big_negative_number) is 0.0 for the floating point precision used.
+
+    Out:
+        shape (batch, nheads=1, seqQ=1, seqK)
+        Contains 0 if attention is allowed, big_negative_number if not.
+    '''
+    mask = 1 - one_zero_attention_mask
+    mask = big_negative_number * mask
+    # repeat(mask, 'B S -> B 1 1 S')
+    return mask[:, None, None, :]
+
+
+class BertCommon(nn.Module):
+    # a class default so that models pickled before checkpointing existed still load
+    checkpoint_every = 0
+
+    def __init__(self, config: TransformerConfig):
+        super().__init__()
+        self.emb = Embedding(config.vocab_size, config.hidden_size, dtype=config.dtype)
+        self.pos_emb = Embedding(config.max_seq_len, config.hidden_size, dtype=config.dtype)
+        self.tkn_emb = Embedding(2, config.hidden_size, dtype=config.dtype)
+
+        self.lnorm = LayerNorm(config.hidden_size, dtype=config.dtype)
+        self.dropout = Dropout(p=config.dropout)
+
+        self.checkpoint_every = config.checkpoint_every
+        decoders = [BERTBlock(config) for l in range(config.num_layers)]
+        self.blocks = nn.ModuleList(decoders)
+
+    def forward(
+        self,
+        x: t.Tensor,
+        one_zero_attention_mask: Optional[t.Tensor] = None,
+        token_type_ids: Optional[t.Tensor] = None,
+    ) -> t.Tensor:
+        '''
+        input_ids: (batch, seq) - the token ids
+        one_zero_attention_mask: (batch, seq) - only used in training, passed to `make_additive_attention_mask` and used in the attention blocks.
+        token_type_ids: (batch, seq) - only used for NSP, passed to token type embedding.
+        '''
+        # Embeddings
+        pos = t.arange(x.shape[1], device=x.device)
+        if token_type_ids is None:
+            token_type_ids = t.zeros_like(x)
+
+        embedding = self.emb(x) + self.pos_emb(pos) + self.tkn_emb(token_type_ids)
+
+        # Norm & Dropout
+        out = self.lnorm(embedding)
+        out = self.dropout(out)
+
+        # Mask
+        if one_zero_attention_mask is not None:
+            mask = make_additive_attention_mask(one_zero_attention_mask)
+        else:
+            mask = None
+
+        out = run_blocks(self.blocks, out, mask, checkpoint_every=self.checkpoint_every)
+
+        return out
+
+
+class BERTLanguageModel(nn.Module):
+    def __init__(self, config: TransformerConfig):
+        super().__init__()
+        self.common = BertCommon(config)
+        self.linear = Linear(config.hidden_size, config.hidden_size, dtype=config.dtype)
+        self.gelu = GELU()
+        self.lnorm = LayerNorm(config.hidden_size, eps=config.layer_norm_epsilon, dtype=config.dtype)
+        self.tied_embed_bias = nn.Parameter(t.zeros(config.vocab_size, dtype=config.dtype))
+
+    def forward(
+        self,
+        x: t.Tensor,
+        one_zero_attention_mask: Optional[t.Tensor] = None,
+        token_type_ids: Optional[t.Tensor] = None,
+    ) -> t.Tensor:
+        '''
+        x: (batch, seq) - the token ids; the masks are passed on to BertCommon
+
+        Return: shape (batch, seq, vocab_size)
+        '''
+        out = self.common(x, one_zero_attention_mask, token_type_ids)
+        out = self.gelu(self.linear(out))
+        out = self.lnorm(out)
+        # einsum("B S E, V E -> B S V", out, self.common.emb.weight)
+        out = out @ self.common.emb.weight.T
+
+        return out
@@ -0,0 +1,209 @@
+"""
+A byte-level byte-pair-encoding tokenizer, for a vocabulary of a chosen size rather than one entry
+per distinct word. It has nlp_modules.WordsTokenizer's build_dict, save_vocab, load_saved, encode,
+encode_batch, decode and __call__, so WordsDataset and sample_methods take either; it has no
+word_id_map or id_word_map, so token_cache.pretokenize and ModelRegistry remain word-level only.
+
+    tokenizer = BPETokenizer(model_max_length=128, vocab_size=4096)
+    tokenizer.build_dict(text)
+    config = TransformerConfig(vocab_size=len(tokenizer.vocab), ...)
+
+Ids 0-255 are the bytes, so any text encodes, and each id after that merges two earlier ones. Text
+is first split into pieces, a word with the space before it, a run of punctuation or a run of
+whitespace, and merges never cross pieces.
+"""
+import heapq
+import itertools
+import json
+import os
+import re
+from collections import Counter, defaultdict
+from typing import Optional, Union
+
+import numpy as np
+import torch as t
+
+BPE_FILE = "bpe.json"
+FORMAT_VERSION = 1
+# a word or a run of punctuation, with the space before it, or whitespace (the whitespace before a
+# word is left to the word's piece)
+_PIECE = re.compile(r" ?\w+| ?[^\w\s]+|\s+(?!\S)|\s+")
+
+
+class BPETokenizer():
+    model_max_length: int
+
+    def __init__(self, model_max_length, vocab_size=4096, min_frequency=2, cache_size=1 << 16):
+        '''
+        vocab_size: vocabulary size build_dict aims for, including the 256 bytes; it stops
+            early if no pair of tokens appears min_frequency times
+        cache_size: words whose encodings are kept, cleared when full
+        '''
+        self.model_max_length = model_max_length
+        self.vocab_size = vocab_size
+        self.min_frequency = min_frequency
+        self.cache_size = cache_size
+        self._set_merges([])
+
+    def build_dict(self, initial_text, save=False):
+        '''
+        Learns merges from initial_text until the vocabulary reaches vocab_size, each merge the
+        most frequent adjacent pair (ties to the lowest ids). Pair counts are kept up to date
+        through each merge from only the words containing the pair, rather than recounted.
+
+        save: also write the merges to bpe.json in the current directory (see save_vocab)
+        '''
+        counts = Counter(_PIECE.findall(initial_text))
+        words = [list(word.encode()) for word in counts]
+        frequencies = list(counts.values())
+
+        pair_counts = defaultdict(int)
+        # the words each pair may appear in; words that merged it away are skipped when used
+        pair_words = defaultdict(set)
+        for i, word in enumerate(words):
+            for pair in zip(word, word[1:]):
+                pair_counts[pair] += frequencies[i]
+                pair_words[pair].add(i)
+        # (-count, pair), with stale entries skipped when their count no longer matches
+        heap = [(-count, pair) for pair, count in pair_counts.items()]
+        heapq.heapify(heap)
+
+        merges = []
+        while heap and 256 + len(merges) < self.vocab_size:
+            count, pair = heapq.heappop(heap)
+            if -count != pair_counts.get(pair):
+                continue
+            if -count < self.min_frequency:
+                break
+            new_id = 256 + len(merges)
+            merges.append(pair)
+
+            changed = set()
+            for i in pair_words.pop(pair):
+                word = words[i]
+                merged = _merge(word, pair, new_id)
+                if len(merged) == len(word):
+                    continue
+                for old_pair in zip(word, word[1:]):
+                    pair_counts[old_pair] -= frequencies[i]
+                for new_pair in zip(merged, merged[1:]):
+                    pair_counts[new_pair] += frequencies[i]
+                    pair_words[new_pair].add(i)
+                changed.update(zip(word, word[1:]), zip(merged, merged[1:]))
+                words[i] = merged
+            del pair_counts[pair]
+            changed.discard(pair)
+
+            for changed_pair in changed:
+                count = pair_counts[changed_pair]
+                if count > 0:
+                    heapq.heappush(heap, (-count, changed_pair))
+                else:
+                    del pair_counts[changed_pair]
+                    pair_words.pop(changed_pair, None)
+
+        self._set_merges(merges)
+        if save:
+            self.save_vocab()
+
+    def save_vocab(self, directory="."):
+        '''
+        Writes the merges to directory/bpe.json, which load_saved reads.
+        '''
+        with open(os.path.join(directory, BPE_FILE), "w") as file:
+            json.dump({"format_version": FORMAT_VERSION, "merges": self.merges}, file)
+
+    def load_saved(self, directory="."):
+        with open(os.path.join(directory, BPE_FILE)) as file:
+            saved = json.load(file)
+        if saved["format_version"] != FORMAT_VERSION:
+            raise ValueError(f"{BPE_FILE} has format version {saved['format_version']}, expected {FORMAT_VERSION}")
+        self._set_merges([tuple(pair) for pair in saved["merges"]])
+
+    def encode(self, text: str, return_tensors: Optional[str] = None) -> Union[list, t.Tensor]:
+        '''
+        Tokenizes text, then returns the token ids.
+
+        Return type is list by default, but if return_tensors="pt" then it is returned as a tensor.
+        '''
+        cache = self._cache
+        encoded = []
+        for word in _PIECE.findall(text):
+            ids = cache.get(word)
+            if ids is None:
+                if len(cache) >= self.cache_size:
+                    cache.clear()
+                ids = cache[word] = self._encode_word(word)
+            encoded.extend(ids)
+
+        if return_tensors == "pt":
+            encoded = t.tensor(encoded)
+        elif return_tensors == "np":
+            encoded = np.array(encoded)
+
+        return encoded
+
+    def encode_batch(self, texts: list, return_tensors: Optional[str] = None) -> list:
+        '''
+        encode for each of many texts.
+
+        Return: a list with an encoding per text, each a list, or a numpy array (return_tensors="np")
+        or tensor (return_tensors="pt") that is a view into one shared buffer
+        '''
+        encodings = [self.encode(text) for text in texts]
+        if return_tensors is None:
+            return encodings
+        lengths = [len(ids) for ids in encodings]
+        encoded = np.fromiter(itertools.chain.from_iterable(encodings), dtype=np.int64, count=sum(lengths))
+        if return_tensors == "pt":
+            return list(t.from_numpy(encoded).split(lengths))
+        return np.split(encoded, np.cumsum(lengths)[:-1]) if texts else []
+
+    def decode(self, list_of_ids: Union[t.Tensor, list]) -> str:
+        '''
+        Joins the ids' bytes and decodes them; bytes that don't form valid UTF-8 (e.g. a
+        generated sequence stopping mid-character) become U+FFFD.
+        '''
+        return b"".join(self.vocab[id] for id in list_of_ids).decode(errors="replace")
+
+    def __call__(self, initial_text: str, return_tensors: Optional[str] = None) -> Union[list, t.Tensor]:
+        '''
+        Returns results of self.encode.
+        '''
+        return self.encode(initial_text, return_tensors)
+
+    def _set_merges(self, merges):
+        self.merges = merges
+        # a pair's rank is its merge's position, and it merges into id 256 + rank
+        self.ranks = {pair: rank for rank, pair in enumerate(merges)}
+        self.vocab = [bytes([byte]) for byte in range(256)]
+        for first, second in merges:
+            self.vocab.append(self.vocab[first] + self.vocab[second])
+        self._cache = {}
+
+    def _encode_word(self, word):
+        ids = list(word.encode())
+        ranks = self.ranks
+        while len(ids) > 1:
+            # apply the earliest-learned merge among the adjacent pairs, everywhere in the word
+            rank = min((ranks.get(pair, len(ranks)) for pair in zip(ids, ids[1:])))
+            if rank == len(ranks):
+                break
+            ids = _merge(ids, self.merges[rank], 256 + rank)
+        return ids
+
+
+def _merge(ids, pair, new_id):
+    '''
+    Return: ids with each non-overlapping occurrence of pair, from the left, replaced by new_id
+    '''
+    merged = []
+    i = 0
+    while i < len(ids):
+        if i + 1 < len(ids) and ids[i] == pair[0] and ids[i + 1] == pair[1]:
+            merged.append(new_id)
+            i += 2
+        else:
+            merged.append(ids[i])
+            i += 1
+    return merged
@@ -0,0 +1,147 @@
+import os
+import random
+import tempfile
+import unittest
+from collections import Counter
+
+import torch as t
+
+import sample_methods as s
+from bpe_tokenizer import BPETokenizer, _merge, _PIECE
+from nlp_modules import WordsDataset
+from token_cache import pretokenize
+
+WORDS = ["the", "then", "there", "these", "thee", "thou", "though", "heart", "hearth", "art", "éclair", "naïve"]
+
+
+def sample_text(seed=0, length=3000):
+    rng = random.Random(seed)
+    parts = []
+    for _ in range(length):
+        parts.append(rng.choice(WORDS))
+        parts.append(rng.choice([" ", " ", " ", ", ", ". ", "!\n", "  ", "\n\n"]))
+    return "".join(parts)
+
+
+def reference_merges(text, vocab_size, min_frequency=2):
+    '''
+    BPE recounting every pair before each merge.
+    '''
+    counts = Counter(_PIECE.findall(text))
+    words = {word: list(word.encode()) for word in counts}
+    merges = []
+    while 256 + len(merges) < vocab_size:
+        pair_counts = Counter()
+        for word, ids in words.items():
+            for pair in zip(ids, ids[1:]):
+                pair_counts[pair] += counts[word]
+        if not pair_counts:
+            break
+        pair, count = min(pair_counts.items(), key=lambda item: (-item[1], item[0]))
+        if count < min_frequency:
+            break
+        merges.append(pair)
+        words = {word: _merge(ids, pair, 256 + len(merges) - 1) for word, ids in words.items()}
+    return merges
+
+
+class ScriptedModel(t.nn.Module):
+    '''
+    Puts all probability on continuation[i] after a prompt of prompt_len tokens and i generated ones.
+    '''
+
+    def __init__(self, prompt_len, continuation, vocab_size):
+        super().__init__()
+        self.prompt_len, self.continuation, self.vocab_size = prompt_len, continuation, vocab_size
+
+    def forward(self, x):
+        logits = t.zeros(x.shape[0], x.shape[1], self.vocab_size)
+        logits[:, -1, self.continuation[x.shape[1] - self.prompt_len]] = 1
+        return logits
+
+
+class TestBPETokenizer(unittest.TestCase):
+    def setUp(self):
+        self.text = sample_text()
+        self.tokenizer = BPETokenizer(model_max_length=16, vocab_size=290)
+        self.tokenizer.build_dict(self.text)
+
+    def test_same_merges_as_recounting(self):
+        self.assertEqual(len(self.tokenizer.vocab), 290)
+        self.assertEqual(self.tokenizer.merges, reference_merges(self.text, 290))
+        # stops early once no pair repeats
+        tokenizer = BPETokenizer(model_max_length=16, vocab_size=100000)
+        tokenizer.build_dict(self.text)
+        self.assertEqual(tokenizer.merges, reference_merges(self.text, 100000))
+        self.assertLess(len(tokenizer.vocab), 100000)
+
+    def test_round_trip(self):
+        unseen = "Unseen wörds — 123 \t tabs, emoji 🙂 and\r\nnewlines  "
+        for text in (self.text, unseen, ""):
+            ids = self.tokenizer.encode(text)
+            self.assertTrue(all(0 <= id < len(self.tokenizer.vocab) for id in ids))
+            self.assertEqual(self.tokenizer.decode(ids), text)
+        self.assertLess(len(self.tokenizer.encode(self.text)), len(self.text.encode()) / 2)
+        t.testing.assert_close(self.tokenizer(unseen, return_tensors="pt"), t.tensor(self.tokenizer.encode(unseen)))
+
+    def test_encode_applies_merges_in_order(self):
+        merges = self.tokenizer.merges
+        for word in set(_PIECE.findall(self.text)):
+            ids = list(word.encode())
+            for rank, pair in enumerate(merges):
+                ids = _merge(ids, pair, 256 + rank)
+            self.assertEqual(self.tokenizer.encode(word), ids)
+
+    def test_encode_batch(self):
+        texts = ["the heart", "", "Unseen 🙂", self.text[:200]]
+        expected = [self.tokenizer.encode(text) for text in texts]
+        self.assertEqual(self.tokenizer.encode_batch(texts), expected)
+        for return_tensors in ("np", "pt"):
+            with self.subTest(return_tensors=return_tensors):
+                encoded = self.tokenizer.encode_batch(texts, return_tensors=return_tensors)
+                self.assertEqual([ids.tolist() for ids in encoded], expected)
+        self.assertEqual(self.tokenizer.encode_batch([]), [])
+
+    def test_stream_tokens_completes_characters(self):
+        tokenizer = BPETokenizer(model_max_length=64, vocab_size=290)
+        tokenizer.build_dict(self.text)
+        text = " naïve éclair 🙂, ça"
+        continuation = tokenizer.encode(text)
+        model = ScriptedModel(len(tokenizer.encode("the")), continuation, len(tokenizer.vocab))
+        pieces = list(s.stream_tokens(model, tokenizer, "the", len(continuation), temperature=0))
+        self.assertEqual("".join(pieces), text)
+        self.assertFalse(any("\ufffd" in piece for piece in pieces))
+        # the emoji and ç are split across byte tokens
+        self.assertLess(len(pieces), len(continuation))
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.tokenizer.save_vocab(directory)
+            loaded = BPETokenizer(model_max_length=16)
+            loaded.load_saved(directory)
+        self.assertEqual(loaded.vocab, self.tokenizer.vocab)
+        self.assertEqual(loaded.encode(self.text), self.tokenizer.encode(self.text))
+
+    def test_words_dataset(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "corpus.txt")
+            with open(filename, "w") as f:
+                f.write(self.text)
+            tokenizer = BPETokenizer(model_max_length=16, vocab_size=280)
+            dataset = WordsDataset(16, filename, tokenizer)
+        x, y = dataset[5]
+        self.assertTrue((x < 280).all())
+        t.testing.assert_close(x[1:], y[:-1])
+        self.assertEqual(tokenizer.decode(dataset.tokens.tolist()), self.text)
+
+    def test_pretokenize_rejects_bpe(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "corpus.txt")
+            with open(filename, "w") as f:
+                f.write(self.text)
+            with self.assertRaisesRegex(TypeError, "BPETokenizer"):
+                pretokenize(filename, self.tokenizer)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+import torch as t
+
+from gpt_modules import GPT
+from transformer_modules import DecoderOnlyTransformer, TransformerConfig
+
+
+class TestActivationCheckpointing(unittest.TestCase):
+    def test_same_loss_and_gradients_with_dropout(self):
+        x = t.randint(0, 50, (2, 17))
+        for model_class in [DecoderOnlyTransformer, GPT]:
+            gradients = []
+            for checkpoint_every in [0, 1, 2]:
+                config = TransformerConfig(
+                    num_layers=3, num_heads=2, vocab_size=50, hidden_size=32, max_seq_len=16,
+                    dropout=0.3, checkpoint_every=checkpoint_every,
+                )
+                t.manual_seed(0)
+                model = model_class(config).train()
+                loss = model.loss(x[:, :-1], x[:, 1:])
+                loss.backward()
+                gradients.append([parameter.grad for parameter in model.parameters()])
+            for checkpointed in gradients[1:]:
+                for grad, expected in zip(checkpointed, gradients[0]):
+                    t.testing.assert_close(grad, expected)
+
+    def test_recomputes_in_backward(self):
+        # segments of two blocks: [0, 1], [2]
+        config = TransformerConfig(num_layers=3, num_heads=2, vocab_size=50, hidden_size=32, max_seq_len=16, checkpoint_every=2)
+        model = DecoderOnlyTransformer(config)
+        calls = []
+        for i, decoder in enumerate(model.decoders):
+            decoder.register_forward_pre_hook(lambda *_, i=i: calls.append(i))
+        model(t.randint(0, 50, (1, 8))).sum().backward()
+        self.assertEqual(sorted(calls), [0, 0, 1, 1, 2, 2])
+        calls.clear()
+        with t.no_grad():
+            model(t.randint(0, 50, (1, 8)))
+        self.assertEqual(calls, [0, 1, 2])
+
+    def test_longer_segments_save_less(self):
+        x = t.randint(0, 50, (2, 16))
+        saved_bytes = []
+        for checkpoint_every in [0, 1, 2, 4]:
+            config = TransformerConfig(
+                num_layers=4, num_heads=2, vocab_size=50, hidden_size=32, max_seq_len=16, checkpoint_every=checkpoint_every
+            )
+            model = DecoderOnlyTransformer(config)
+            storages = {}
+
+            def pack(tensor):
+                storages[tensor.untyped_storage().data_ptr()] = tensor.untyped_storage().nbytes()
+                return tensor
+
+            with t.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+                model(x)
+            saved_bytes.append(sum(storages.values()))
+        # each segment keeps only its input, so fewer, longer segments keep less
+        self.assertEqual(saved_bytes, sorted(saved_bytes, reverse=True))
+        self.assertEqual(len(set(saved_bytes)), 4)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+
+import torch as t
+
+from gpt_modules import GPT
+from transformer_modules import DecoderOnlyTransformer, TransformerConfig, chunked_cross_entropy
+
+
+class TestChunkedCrossEntropy(unittest.TestCase):
+    def test_matches_full_logits(self):
+        t.manual_seed(0)
+        hidden = t.randn(3, 7, 16, requires_grad=True)
+        weight = t.randn(40, 16, requires_grad=True)
+        targets = t.randint(0, 40, (3, 7))
+        targets[0, :3] = -100
+
+        full = t.nn.functional.cross_entropy((hidden @ weight.T).flatten(0, 1), targets.flatten())
+        full_grads = t.autograd.grad(full, [hidden, weight])
+        chunked = chunked_cross_entropy(hidden, weight, targets, chunk_size=4)
+        chunked_grads = t.autograd.grad(chunked, [hidden, weight])
+
+        t.testing.assert_close(chunked, full)
+        for chunked_grad, full_grad in zip(chunked_grads, full_grads):
+            t.testing.assert_close(chunked_grad, full_grad)
+
+    def test_model_loss(self):
+        config = TransformerConfig(num_layers=2, num_heads=2, vocab_size=50, hidden_size=32, max_seq_len=16, dropout=0.0)
+        x = t.randint(0, 50, (2, 17))
+        for model_class in [DecoderOnlyTransformer, GPT]:
+            model = model_class(config)
+            expected = t.nn.functional.cross_entropy(model(x[:, :-1]).flatten(0, 1), x[:, 1:].flatten())
+            expected_grad = t.autograd.grad(expected, model.emb.weight)[0]
+            loss = model.loss(x[:, :-1], x[:, 1:], chunk_size=5)
+            t.testing.assert_close(loss, expected)
+            t.testing.assert_close(t.autograd.grad(loss, model.emb.weight)[0], expected_grad)
+
+
+if __name__ == "__main__":
+    unittest.main()
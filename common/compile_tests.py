@@ -0,0 +1,46 @@
+import unittest
+
+import torch as t
+
+from general_modules import compile_model
+from gpt_modules import GPT
+from transformer_modules import DecoderOnlyTransformer, TransformerConfig
+
+
+class TestCompile(unittest.TestCase):
+    def setUp(self):
+        t._dynamo.reset()
+
+    def test_compiles_without_graph_breaks(self):
+        # aot_eager traces forward and backward like inductor, without the C++ codegen time;
+        # fullgraph=True turns any graph break into an error
+        x = t.randint(0, 50, (2, 17))
+        for model_class, backend in [(DecoderOnlyTransformer, "reference"), (GPT, "sdpa"), (DecoderOnlyTransformer, "tiled")]:
+            config = TransformerConfig(
+                num_layers=2, num_heads=2, vocab_size=50, hidden_size=32, max_seq_len=16,
+                dropout=0.0, attention_backend=backend,
+            )
+            model = model_class(config)
+            expected_logits = model(x[:, :-1])
+            expected_loss = model.loss(x[:, :-1], x[:, 1:])
+            compile_model(model, backend="aot_eager")
+            t.testing.assert_close(model(x[:, :-1]), expected_logits)
+            loss = model.loss(x[:, :-1], x[:, 1:])
+            t.testing.assert_close(loss, expected_loss)
+            loss.backward()
+
+    def test_inductor_with_kv_cache(self):
+        config = TransformerConfig(num_layers=1, num_heads=2, vocab_size=50, hidden_size=32, max_seq_len=16)
+        model = DecoderOnlyTransformer(config).eval()
+        x = t.randint(0, 50, (1, 12))
+        with t.inference_mode():
+            expected, presents = model(x[:, :8], use_cache=True)
+            expected_next = model(x[:, 8:9], past_key_values=presents)
+            compile_model(model, dynamic=True)
+            logits, presents = model(x[:, :8], use_cache=True)
+            t.testing.assert_close(logits, expected, atol=1e-4, rtol=1e-4)
+            t.testing.assert_close(model(x[:, 8:9], past_key_values=presents), expected_next, atol=1e-4, rtol=1e-4)
+
+
+if __name__ == "__main__":
+    unittest.main()
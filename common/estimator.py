@@ -0,0 +1,198 @@
+"""
+Analytical memory and FLOP estimates for DecoderOnlyTransformer and GPT, from a TransformerConfig
+alone, so a job can be sized before anything is allocated.
+
+    estimate = estimate_resources(config, batch_size=16, seq_len=256, mode="train")
+    print(estimate.summary())
+
+The counts follow the modules as written: the attention's fused qkv projection, the 4x MLP, the
+output head tied to the embedding matrix (no extra parameters), the fused LayerNorm/GELU/Dropout
+functions, the reference attention backend, and the chunked cross-entropy of `model(x, targets=y)`
+in training. AdamW keeps two states per parameter in the parameter dtype.
+"""
+import math
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+import pandas as pd
+import torch as t
+
+MODES = ("train", "infer", "generate")
+MODELS = ("decoder", "gpt")
+
+
+@dataclass(frozen=True)
+class ResourceEstimate:
+    '''
+    All sizes in bytes. activation_bytes_per_block is what one block saves for backward in
+    train mode, and the block's largest transient working set otherwise.
+    '''
+
+    params: int
+    param_bytes: int
+    buffer_bytes: int
+    grad_bytes: int
+    optimizer_bytes: int
+    activation_bytes_per_block: int
+    activation_bytes: int
+    attention_score_bytes: int
+    logits_bytes: int
+    kv_cache_bytes: int
+    flops_per_token: int
+
+    @property
+    def total_bytes(self) -> int:
+        return (
+            self.param_bytes + self.buffer_bytes + self.grad_bytes + self.optimizer_bytes
+            + self.activation_bytes + self.logits_bytes + self.kv_cache_bytes
+        )
+
+    def summary(self) -> pd.Series:
+        '''
+        Return: every field and total_bytes, with sizes in MiB
+        '''
+        values = dict(asdict(self), total_bytes=self.total_bytes)
+        return pd.Series({
+            name.replace("_bytes", "_mb"): value / 2**20 if name.endswith("_bytes") else value
+            for name, value in values.items()
+        })
+
+
+def count_params(config, model: str = "decoder") -> int:
+    '''
+    Parameters of DecoderOnlyTransformer ("decoder") or GPT ("gpt") built from config.
+    '''
+    H = config.hidden_size
+    # qkv (H x 3H) and output (H x H) projections, MLP (H x 4H and 4H x H), all with biases, and
+    # two LayerNorms
+    block = (3 * H * H + 3 * H) + (H * H + H) + (4 * H * H + 4 * H) + (4 * H * H + H) + 2 * 2 * H
+    # the output head is the embedding matrix
+    embeddings = config.vocab_size * H + (config.max_seq_len * H if model == "gpt" else 0)
+    return config.num_layers * block + embeddings + 2 * H
+
+
+def block_activation_bytes(
+    config, batch_size: int, seq_len: int, dtype: t.dtype, model: str = "decoder", train: bool = True
+) -> int:
+    '''
+    Bytes one block saves for backward (train) or its peak transient working set (not train),
+    for a (batch_size, seq_len) input with the reference attention backend.
+    '''
+    element = _element_size(dtype)
+    N, H = batch_size * seq_len, config.hidden_size
+    scores = batch_size * config.num_heads * seq_len * seq_len
+    dropout = config.dropout > 0
+
+    if not train:
+        # attention: input, qkv, contiguous copies of Q and K, and the scores before and after
+        # masking; MLP: input and the 4x hidden layer before and after GELU
+        return max(6 * N * H * element + 2 * scores * element, 9 * N * H * element)
+
+    # both models save 16 (N, H)-sized tensors per block: the inputs of the four Linears (the 4x
+    # GELU output for linear2), the contiguous copies of Q, K and V made by the attention
+    # matmuls, GELU's 4x input and both LayerNorms' inputs; plus one rstd per row per LayerNorm
+    nbytes = 16 * N * H * element + 2 * N * element
+    # the softmax output, and the inverted causal mask built for masked_fill
+    nbytes += scores * element + seq_len * seq_len
+    if dropout:
+        # the boolean keep-mask of the MLP's dropout
+        nbytes += N * H
+        if model == "gpt":
+            # GPT also drops the attention probabilities (keep-mask and output) and its output
+            # projection
+            nbytes += scores * (element + 1) + N * H
+    return nbytes
+
+
+def flops_per_token(config, context_len: int, mode: str = "infer", checkpoint_every: Optional[int] = None) -> int:
+    '''
+    Matmul FLOPs (2 per multiply-add) per token at a context of context_len positions.
+
+    infer/generate: one forward pass; generate projects only the new token onto the vocabulary
+    train: forward and backward, where backward is twice the forward, the chunked loss recomputes
+        the logits, and with checkpointing every block runs its forward twice
+    '''
+    H, V, L = config.hidden_size, config.vocab_size, config.num_layers
+    # qkv 6H^2, output projection 2H^2, MLP 16H^2, plus Q.K and probs.V over the whole context:
+    # the reference backend computes the masked half too
+    block = 24 * H * H + 4 * context_len * H
+    if mode != "train":
+        return L * block + 2 * H * V
+    checkpoint_every = config.checkpoint_every if checkpoint_every is None else checkpoint_every
+    recomputed = L if checkpoint_every else 0
+    return (3 * L + recomputed) * block + 8 * H * V
+
+
+def estimate_resources(
+    config,
+    batch_size: int,
+    seq_len: int,
+    dtype: Optional[t.dtype] = None,
+    mode: str = "train",
+    model: str = "decoder",
+    chunk_size: int = 1024,
+) -> ResourceEstimate:
+    '''
+    Predicts memory and compute of DecoderOnlyTransformer ("decoder") or GPT ("gpt").
+
+    seq_len: the training/inference sequence length, or for generate the total length (prompt
+        plus generated tokens) the KV cache grows to
+    dtype: parameter and activation dtype; default config.dtype
+    mode:
+        train     model(x, targets=y).backward() and an AdamW step; config.checkpoint_every is
+                  honoured
+        infer     model(x) in inference mode, returning logits for every position
+        generate  decoding with the KV cache: a full cache of seq_len positions, logits for the
+                  last position, and flops_per_token of one decoding step at that length
+    '''
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode {mode!r}; expected one of {MODES}")
+    if model not in MODELS:
+        raise ValueError(f"Unknown model {model!r}; expected one of {MODELS}")
+    dtype = dtype or config.dtype
+    element = _element_size(dtype)
+    H, V, L = config.hidden_size, config.vocab_size, config.num_layers
+    N = batch_size * seq_len
+    train = mode == "train"
+
+    params = count_params(config, model)
+    # the decoder's sinusoidal positional encoding is a buffer
+    buffer_bytes = config.max_seq_len * H * element if model == "decoder" else 0
+    per_block = block_activation_bytes(config, batch_size, seq_len, dtype, model, train)
+    attention_score_bytes = batch_size * config.num_heads * seq_len * seq_len * element
+
+    if train:
+        if config.checkpoint_every:
+            # a checkpointed segment keeps only its input, and backward rebuilds one segment of
+            # checkpoint_every blocks at a time
+            segments = math.ceil(L / config.checkpoint_every)
+            activation_bytes = segments * N * H * element + min(config.checkpoint_every, L) * per_block
+        else:
+            activation_bytes = L * per_block
+        # embedding dropout's keep-mask, and post_norm's input, rstd and output for the loss
+        activation_bytes += (N * H if config.dropout > 0 else 0) + 2 * N * H * element + N * element
+        # a float32 chunk of logits, its logsumexp per row, and the loss's float32 weight gradient
+        logits_bytes = min(chunk_size, N) * V * 4 + N * 4 + V * H * 4
+        kv_cache_bytes = 0
+    else:
+        activation_bytes = per_block
+        logits_bytes = (batch_size if mode == "generate" else N) * V * element
+        kv_cache_bytes = 2 * L * N * H * element if mode == "generate" else 0
+
+    return ResourceEstimate(
+        params=params,
+        param_bytes=params * element,
+        buffer_bytes=buffer_bytes,
+        grad_bytes=params * element if train else 0,
+        optimizer_bytes=2 * params * element if train else 0,
+        activation_bytes_per_block=per_block,
+        activation_bytes=activation_bytes,
+        attention_score_bytes=attention_score_bytes,
+        logits_bytes=logits_bytes,
+        kv_cache_bytes=kv_cache_bytes,
+        flops_per_token=flops_per_token(config, seq_len, mode),
+    )
+
+
+def _element_size(dtype: t.dtype) -> int:
+    return t.empty((), dtype=dtype).element_size()
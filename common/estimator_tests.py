@@ -0,0 +1,104 @@
+import unittest
+
+import torch as t
+from torch.utils.flop_counter import FlopCounterMode
+
+from estimator import block_activation_bytes, estimate_resources
+from general_modules import module_nbytes
+from gpt_modules import GPT, GPTDecoder
+from transformer_modules import DecoderBlock, DecoderOnlyTransformer, TransformerConfig
+
+MODELS = {"decoder": (DecoderOnlyTransformer, DecoderBlock), "gpt": (GPT, GPTDecoder)}
+
+
+def saved_activation_bytes(module, fn) -> int:
+    '''
+    Bytes of the distinct storages autograd saves for backward while running fn, other than
+    module's parameters.
+    '''
+    parameters = {p.untyped_storage().data_ptr() for p in module.parameters()}
+    storages = {}
+
+    def pack(tensor):
+        storage = tensor.untyped_storage()
+        if storage.data_ptr() not in parameters:
+            storages[storage.data_ptr()] = storage.nbytes()
+        return tensor
+
+    with t.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        fn()
+    return sum(storages.values())
+
+
+class TestEstimator(unittest.TestCase):
+    def setUp(self):
+        t.manual_seed(0)
+        self.config = TransformerConfig(num_layers=3, num_heads=4, vocab_size=300, hidden_size=64, max_seq_len=48)
+
+    def test_params_and_buffers(self):
+        for name, (model_class, _) in MODELS.items():
+            with self.subTest(model=name):
+                model = model_class(self.config)
+                estimate = estimate_resources(self.config, 2, 16, model=name)
+                self.assertEqual(estimate.params, sum(p.numel() for p in model.parameters()))
+                self.assertEqual(estimate.param_bytes + estimate.buffer_bytes, module_nbytes(model))
+
+    def test_block_activations(self):
+        for dropout in (0.0, 0.1):
+            config = TransformerConfig(
+                num_layers=1, num_heads=4, vocab_size=300, hidden_size=64, max_seq_len=48, dropout=dropout
+            )
+            for name, (_, block_class) in MODELS.items():
+                with self.subTest(model=name, dropout=dropout):
+                    block = block_class(config).train()
+                    x = t.randn(3, 20, 64, requires_grad=True)
+                    measured = saved_activation_bytes(block, lambda: block(x))
+                    self.assertEqual(block_activation_bytes(config, 3, 20, t.float32, name), measured)
+
+    def test_model_activations(self):
+        for name, (model_class, _) in MODELS.items():
+            for checkpoint_every in (0, 2):
+                config = TransformerConfig(**{**self.config.__dict__, "checkpoint_every": checkpoint_every})
+                with self.subTest(model=name, checkpoint_every=checkpoint_every):
+                    model = model_class(config).train()
+                    x = t.randint(0, 300, (2, 33))
+                    measured = saved_activation_bytes(model, lambda: model(x[:, :-1], targets=x[:, 1:]))
+                    estimate = estimate_resources(config, 2, 32, model=name)
+                    # the checkpointed estimate adds the segment rebuilt during backward, which
+                    # isn't saved in forward
+                    rebuilt = min(checkpoint_every, config.num_layers) * estimate.activation_bytes_per_block
+                    expected = estimate.activation_bytes - rebuilt
+                    self.assertAlmostEqual(expected / measured, 1, delta=0.05)
+
+    def test_kv_cache_and_logits(self):
+        for name, (model_class, _) in MODELS.items():
+            with self.subTest(model=name), t.inference_mode():
+                model = model_class(self.config).eval()
+                logits, presents = model(t.randint(0, 300, (2, 24)), use_cache=True, only_last=True)
+                estimate = estimate_resources(self.config, 2, 24, mode="generate", model=name)
+                self.assertEqual(estimate.kv_cache_bytes, sum(K.nbytes + V.nbytes for K, V in presents))
+                self.assertEqual(estimate.logits_bytes, logits.nbytes)
+
+    def test_flops(self):
+        x = t.randint(0, 300, (2, 17))
+        for name, (model_class, _) in MODELS.items():
+            model = model_class(self.config)
+            for mode in ("infer", "train"):
+                with self.subTest(model=name, mode=mode):
+                    counter = FlopCounterMode(display=False)
+                    with counter:
+                        if mode == "train":
+                            model(x[:, :-1], targets=x[:, 1:]).backward()
+                        else:
+                            model(x[:, :-1])
+                    estimate = estimate_resources(self.config, 2, 16, mode=mode, model=name)
+                    self.assertEqual(estimate.flops_per_token * 2 * 16, counter.get_total_flops())
+
+    def test_summary(self):
+        summary = estimate_resources(self.config, 2, 16).summary()
+        self.assertIn("total_mb", summary.index)
+        self.assertAlmostEqual(summary["param_mb"], summary["params"] * 4 / 2**20)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+import torch as t
+import torch.nn.functional as F
+
+from transformer_modules import GELU, Dropout, DropoutFunction, GELUFunction, LayerNorm, LayerNormFunction
+
+
+class TestFusedLayers(unittest.TestCase):
+    def setUp(self):
+        t.manual_seed(0)
+        self.x = t.randn(3, 5, 16, dtype=t.float64, requires_grad=True)
+
+    def test_gradients(self):
+        weight = t.randn(5, 16, dtype=t.float64, requires_grad=True)
+        bias = t.randn(5, 16, dtype=t.float64, requires_grad=True)
+        self.assertTrue(t.autograd.gradcheck(GELUFunction.apply, (self.x,)))
+        self.assertTrue(t.autograd.gradcheck(lambda x, w, b: LayerNormFunction.apply(x, w, b, (1, 2), 1e-5), (self.x, weight, bias)))
+        self.assertTrue(t.autograd.gradcheck(lambda x: LayerNormFunction.apply(x, None, None, (2,), 1e-5), (self.x,)))
+        self.assertTrue(t.autograd.gradcheck(lambda x: (t.manual_seed(0), DropoutFunction.apply(x, 0.5))[1], (self.x,)))
+
+    def test_match_torch(self):
+        x = self.x.detach().float()
+        layer_norm = LayerNorm(16)
+        t.testing.assert_close(layer_norm(x), F.layer_norm(x, (16,), layer_norm.weight, layer_norm.bias))
+        t.testing.assert_close(GELU()(x), F.gelu(x, approximate="tanh"))
+
+    def test_dropout(self):
+        dropout = Dropout(0.25)
+        x = t.ones(200, 100)
+        out = dropout(x)
+        t.testing.assert_close(out.unique(), t.tensor([0.0, 1 / 0.75]))
+        self.assertAlmostEqual((out == 0).float().mean().item(), 0.25, delta=0.02)
+        self.assertIs(dropout.eval()(x), x)
+
+    def test_layer_norm_keeps_no_activations(self):
+        layer_norm = LayerNorm(16)
+        layer_norm(t.randn(2, 16))
+        self.assertFalse(hasattr(layer_norm, "mean") or hasattr(layer_norm, "var"))
+
+
+if __name__ == "__main__":
+    unittest.main()
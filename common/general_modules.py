@@ -3,7 +3,9 @@ from fancy_einsum import einsum
 from einops import reduce, rearrange, repeat
 from typing import Union, Optional, Callable
 import torch as t
+import copy
 import functools
+import warnings
 from torch import nn
 
 
@@ -35,17 +37,17 @@ class Flatten(nn.Module):
 
 
 class Linear(nn.Module):
-    def __init__(self, in_features: int, out_features: int, bias=True):
+    def __init__(self, in_features: int, out_features: int, bias=True, dtype: Optional[t.dtype] = None):
         """A simple linear (technically, affine) transformation.
         """
         super().__init__()
         k = 1 / np.sqrt(in_features)
 
         self.weight = nn.Parameter(
-            t.zeros(out_features, in_features).uniform_(-k, to=k)
+            t.zeros(out_features, in_features, dtype=dtype).uniform_(-k, to=k)
         )
         self.bias = (
-            None if not bias else nn.Parameter(t.zeros(out_features).uniform_(-k, to=k))
+            None if not bias else nn.Parameter(t.zeros(out_features, dtype=dtype).uniform_(-k, to=k))
         )
 
     def forward(self, x: t.Tensor) -> t.Tensor:
@@ -53,11 +55,122 @@ class Linear(nn.Module):
         x: shape (*, in_features)
         Return: shape (*, out_features)
         """
-        out = einsum("... in_f, out_f in_f -> ... out_f", x, self.weight)
-        if self.bias != None:
-            out += self.bias
-
-        return out
+        # einsum("... in_f, out_f in_f -> ... out_f", x, self.weight) + self.bias, as a single
+        # pre-resolved op (no pattern parsing per call, and no graph break under torch.compile)
+        return t.nn.functional.linear(x, self.weight, self.bias)
 
     def extra_repr(self) -> str:
         pass
+
+
+class QuantizedLinear(nn.Module):
+    def __init__(self, in_features: int, out_features: int, bias=True):
+        """Inference-only replacement for Linear, with the same forward API.
+
+        The weight is stored as int8 with one scale per output channel, and activations are
+        quantized to int8 on the fly (dynamic quantization). Where PyTorch's quantized CPU kernels
+        are available the matmul runs in int8 through them; otherwise the same quantized values
+        are multiplied in floating point.
+        """
+        super().__init__()
+        self.in_features = in_features
+        self.out_features = out_features
+        self.register_buffer("weight_int8", t.zeros(out_features, in_features, dtype=t.int8))
+        self.register_buffer("weight_scale", t.ones(out_features))
+        self.register_buffer("bias", t.zeros(out_features) if bias else None)
+        self._packed = None
+
+    @classmethod
+    def from_float(cls, linear: nn.Module) -> "QuantizedLinear":
+        """Quantizes a trained Linear (or nn.Linear) symmetrically, per output channel."""
+        out_features, in_features = linear.weight.shape
+        quantized = cls(in_features, out_features, bias=linear.bias is not None)
+        weight = linear.weight.detach().float()
+        scale = weight.abs().amax(dim=1).clamp(min=1e-8) / 127
+        quantized.weight_int8.copy_(t.round(weight / scale[:, None]).clamp(-127, 127).to(t.int8))
+        quantized.weight_scale.copy_(scale)
+        if linear.bias is not None:
+            quantized.bias.copy_(linear.bias.detach())
+        return quantized.to(linear.weight.device)
+
+    def _pack(self):
+        try:
+            with warnings.catch_warnings():
+                # quantized tensor creation is deprecated, but it is the only way into the int8 kernels
+                warnings.simplefilter("ignore", UserWarning)
+                weight = t.quantize_per_channel(
+                    self.weight_int8.float() * self.weight_scale[:, None],
+                    self.weight_scale.double(),
+                    t.zeros(self.out_features, dtype=t.int64),
+                    0,
+                    t.qint8,
+                )
+            self._packed = t.ops.quantized.linear_prepack(weight, self.bias)
+        except (RuntimeError, AttributeError):
+            # no quantized CPU engine in this build
+            self._packed = False
+
+    def forward(self, x: t.Tensor) -> t.Tensor:
+        """
+        x: shape (*, in_features)
+        Return: shape (*, out_features)
+        """
+        if self._packed is None:
+            self._pack()
+        x_2d = x.reshape(-1, self.in_features).float()
+        if self._packed is not False and x.device.type == "cpu":
+            out = t.ops.quantized.linear_dynamic(x_2d, self._packed)
+        else:
+            x_scale = x_2d.abs().amax().clamp(min=1e-8) / 127
+            x_int8 = t.round(x_2d / x_scale).clamp(-127, 127)
+            out = (x_int8 @ self.weight_int8.float().T) * (x_scale * self.weight_scale)
+            if self.bias is not None:
+                out += self.bias
+        return out.reshape(*x.shape[:-1], self.out_features).to(x.dtype)
+
+    def _load_from_state_dict(self, *args, **kwargs):
+        super()._load_from_state_dict(*args, **kwargs)
+        self._packed = None
+
+    def __getstate__(self):
+        # packed kernel weights are rebuilt from the buffers after unpickling
+        state = self.__dict__.copy()
+        state["_packed"] = None
+        return state
+
+    def extra_repr(self) -> str:
+        return f"in_features={self.in_features}, out_features={self.out_features}, bias={self.bias is not None}, dtype=int8"
+
+
+def module_nbytes(model: nn.Module) -> int:
+    """Bytes held by a module's parameters and buffers."""
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+
+def quantize_linear_layers(model: nn.Module, inplace: bool = False) -> nn.Module:
+    """Replaces every Linear and nn.Linear in model with a QuantizedLinear, for CPU inference.
+
+    Embeddings (and so the tied output projection) stay in floating point.
+    """
+    if not inplace:
+        model = copy.deepcopy(model)
+    for name, module in list(model.named_modules()):
+        for child_name, child in list(module.named_children()):
+            if isinstance(child, (Linear, nn.Linear)):
+                setattr(module, child_name, QuantizedLinear.from_float(child))
+    return model.eval()
+
+
+def compile_model(
+    model: nn.Module, dynamic: Optional[bool] = None, mode: Optional[str] = None, backend: str = "inductor"
+) -> nn.Module:
+    """Compiles model's forward in place with torch.compile, for training or inference.
+
+    fullgraph=True makes any graph break an error rather than a silent fallback to eager. The
+    model keeps its class, state_dict keys and picklability. Pass dynamic=True when the input
+    length changes from call to call (e.g. generation with a KV cache) to avoid recompiling for
+    every new length.
+    """
+    model.compile(fullgraph=True, dynamic=dynamic, mode=mode, backend=backend)
+    return model
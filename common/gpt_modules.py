@@ -5,11 +5,17 @@ from torch.utils.data import Dataset
 import numpy as np
 from fancy_einsum import einsum
 from dataclasses import dataclass
+from typing import List, Optional
 import functools
 
 
 from einops import rearrange, reduce, repeat
 
+import attention
+from general_modules import Linear
+from nlp_modules import WordsDataset  # noqa: F401 - shared with the decoder-only transformer
+from transformer_modules import Dropout, LayerNorm, MLP, Embedding, KVCache, chunked_cross_entropy, run_blocks
+
 @dataclass(frozen=True)
 class TransformerConfig:
     '''Constants used throughout the decoder-only transformer model.'''
@@ -21,33 +27,211 @@ class TransformerConfig:
     max_seq_len: int
     dropout: float = 0.1
     layer_norm_epsilon: float = 1e-05
+    dtype: t.dtype = t.float32
+    attention_backend: str = "reference"
+    # checkpoint segments of checkpoint_every blocks, recomputing them during backward; 0 disables
+    checkpoint_every: int = 0
 
-class WordsDataset(Dataset):
-    def __init__(self, seq_len, filename, tokenizer, truncate=None):
-        self.seq_len = seq_len
-        self.filename = filename
-        
-        with open(filename, 'r') as textfile:
-            text = textfile.read()
-        
-        tokenizer.build_dict(text)
-        self.tokens = tokenizer.encode(text)
+
+class GPTAttention(nn.Module):
+    W_QKV: nn.Linear
+    W_O: nn.Linear
+    # one of attention.ATTENTION_BACKENDS; a class default so that models pickled before
+    # backends existed load with the reference implementation
+    backend = "reference"
+
+    def __init__(
+        self,
+        hidden_size: int,
+        num_heads: int,
+        dropout: float,
+        dtype: Optional[t.dtype] = None,
+        backend: str = "reference",
+    ):
+        super().__init__()
+        self.num_heads = num_heads
+        self.backend = backend
+        self.query_size = int(hidden_size / num_heads)
         
-        word_count = len(self.tokens)
+        self.qkv = Linear(hidden_size, 3 * hidden_size, dtype=dtype)
+        self.ff = Linear(hidden_size, hidden_size, dtype=dtype)
+
+        self.dropout1 = Dropout(p=dropout)
+        self.dropout2 = Dropout(p=dropout)
+
+    def multihead_masked_attention(
+        self,
+        Q: t.Tensor,
+        K: t.Tensor,
+        V: t.Tensor,
+        num_heads: int,
+        padding_mask: Optional[t.Tensor] = None,
+    ):
+        """
+        Implements multihead masked attention on the matrices Q, K and V, using self.backend.
+
+        Q: shape (batch, seq, nheads*headsize)
+        K: shape (batch, kv_seq, nheads*headsize)
+        V: shape (batch, kv_seq, nheads*headsize)
+        padding_mask: shape (batch, kv_seq) - 1 for real tokens, 0 for padding
+
+        returns: shape (batch, seq, nheads*headsize)
+        """
+        return attention.multihead_attention(
+            Q, K, V, num_heads, self.backend, padding_mask=padding_mask, dropout=self.dropout1
+        )
+
+    def forward(
+        self,
+        x: t.Tensor,
+        past_key_value: Optional[KVCache] = None,
+        use_cache: bool = False,
+        padding_mask: Optional[t.Tensor] = None,
+    ):
+        """
+        x: shape (batch, seq, hidden_size)
+
+        Return: shape (batch, seq, hidden_size), plus the updated KVCache if use_cache
+        """
+        out = self.qkv(x)
+        Q, K, V = t.tensor_split(out, 3, dim=-1)
+
+        if past_key_value is not None:
+            past_K, past_V = past_key_value
+            K = t.cat([past_K, K], dim=1)
+            V = t.cat([past_V, V], dim=1)
+
+        Z = self.multihead_masked_attention(Q, K, V, self.num_heads, padding_mask)
+        out = self.ff(Z)
+        out = self.dropout2(out)
+
+        if use_cache:
+            return out, (K, V)
+        return out
+
 
-        if truncate:
-            word_count = int(word_count * truncate)
+class GPTDecoder(nn.Module):
 
-        self.x_seqs, self.y_seqs = [], []
+    def __init__(self, config):
+        super().__init__()
+        self.lnorm1 = LayerNorm(config.hidden_size, eps=config.layer_norm_epsilon, dtype=config.dtype)
+        self.attn = GPTAttention(
+            config.hidden_size, config.num_heads, config.dropout, dtype=config.dtype, backend=config.attention_backend
+        )
+        self.lnorm2 = LayerNorm(config.hidden_size, eps=config.layer_norm_epsilon, dtype=config.dtype)
+        self.mlp = MLP(config.hidden_size, config.dropout, dtype=config.dtype)
+
+    def forward(
+        self,
+        x: t.Tensor,
+        past_key_value: Optional[KVCache] = None,
+        use_cache: bool = False,
+        padding_mask: Optional[t.Tensor] = None,
+    ):
+        attn = self.attn(self.lnorm1(x), past_key_value, use_cache, padding_mask)
+        if use_cache:
+            attn, present = attn
+        out = attn + x
+        mlp = self.mlp(self.lnorm2(out))
+        out = mlp + out
+
+        if use_cache:
+            return out, present
+        return out
+
+
+class GPT(nn.Module):
+    # a class default so that models pickled before checkpointing existed still load
+    checkpoint_every = 0
+
+    def __init__(self, config):
+        super().__init__()
+        self.emb = Embedding(config.vocab_size, config.hidden_size, dtype=config.dtype)
+        self.pos_emb = Embedding(config.max_seq_len, config.hidden_size, dtype=config.dtype)
+        self.dropout = Dropout(p=config.dropout)
+
+        self.checkpoint_every = config.checkpoint_every
+        decoders = [GPTDecoder(config) for l in range(config.num_layers)]
+        self.decoders = nn.Sequential(*decoders)
         
-        for pos in range(0, word_count - seq_len - 1):
-            self.x_seqs.append(t.tensor(self.tokens[pos:pos+self.seq_len]))
-            self.y_seqs.append(t.tensor(self.tokens[pos+1:pos+self.seq_len+1]))
-        self.x_seqs = t.stack(self.x_seqs)
-        self.y_seqs = t.stack(self.y_seqs)
+        self.post_norm = LayerNorm(config.hidden_size, dtype=config.dtype)
+
+    def forward(
+        self,
+        x: t.Tensor,
+        past_key_values: Optional[List[KVCache]] = None,
+        use_cache: bool = False,
+        only_last: bool = False,
+        padding_mask: Optional[t.Tensor] = None,
+        targets: Optional[t.Tensor] = None,
+        chunk_size: int = 1024,
+        ignore_index: int = -100,
+    ):
+        """
+        x: shape (batch, seq) - token ids; only the new tokens when past_key_values is given
+        past_key_values: one KVCache per decoder block, as returned by a previous call
+        use_cache: if True, return (logits, past_key_values) instead of just the logits
+        only_last: if True, only project the last position onto the vocabulary
+        padding_mask: shape (batch, past_seq + seq) - 1 for real tokens, 0 for (left) padding;
+            positions are counted from each row's first real token
+        targets: shape (batch, seq) - if given, return the mean next-token cross-entropy against
+            them instead of the logits, computed chunk_size rows at a time by chunked_cross_entropy
+        """
+        out, presents = self._decode(x, past_key_values, use_cache, padding_mask)
+        if targets is not None:
+            return chunked_cross_entropy(self.post_norm(out), self.emb.weight, targets, chunk_size, ignore_index)
+
+        if only_last:
+            out = out[:, -1:]
+        out = self.post_norm(out)
+
+        # einsum("B S E, V E -> B S V", out, self.emb.weight)
+        out = out @ self.emb.weight.T
+
+        if use_cache:
+            return out, presents
+        return out
+
+    def _decode(
+        self,
+        x: t.Tensor,
+        past_key_values: Optional[List[KVCache]] = None,
+        use_cache: bool = False,
+        padding_mask: Optional[t.Tensor] = None,
+    ):
+        """
+        Runs the embedding and decoder blocks.
+
+        Return: (hidden states of shape (batch, seq, hidden_size) before post_norm, presents)
+        """
+        offset = 0 if past_key_values is None else past_key_values[0][0].shape[1]
+
+        if padding_mask is not None:
+            pos = (padding_mask.cumsum(dim=-1) - 1).clamp(min=0)[:, -x.shape[1] :]
+        else:
+            pos = t.arange(offset, offset + x.shape[1], device=x.device)
+        embedding = self.emb(x) + self.pos_emb(pos)
+        embedding = self.dropout(embedding)
+
+        if past_key_values is None and not use_cache and padding_mask is None:
+            out = run_blocks(self.decoders, embedding, checkpoint_every=self.checkpoint_every)
+            presents = None
+        else:
+            if past_key_values is None:
+                past_key_values = [None] * len(self.decoders)
+            out, presents = embedding, []
+            for block, past_key_value in zip(self.decoders, past_key_values):
+                out, present = block(out, past_key_value, use_cache=True, padding_mask=padding_mask)
+                presents.append(present)
+
+        return out, presents
 
-    def __len__(self):
-        return len(self.x_seqs)
+    def loss(self, x: t.Tensor, targets: t.Tensor, chunk_size: int = 1024, ignore_index: int = -100) -> t.Tensor:
+        """
+        Mean next-token cross-entropy, equal to cross_entropy(self(x).flatten(0, 1), targets.flatten())
+        but without ever holding the (batch, seq, vocab_size) logits; see chunked_cross_entropy.
 
-    def __getitem__(self, idx):
-        return self.x_seqs[idx], self.y_seqs[idx]
\ No newline at end of file
+        x: shape (batch, seq) - token ids
+        targets: shape (batch, seq) - the token following each position of x
+        """
+        return self(x, targets=targets, chunk_size=chunk_size, ignore_index=ignore_index)
@@ -0,0 +1,498 @@
+"""
+A local HTTP server that keeps one loaded DecoderOnlyTransformer and serves generation requests
+with continuous batching: new requests join the running decode batch at token boundaries, and
+finished sequences leave it without stalling the others.
+
+    python inference_server.py --model ../decoder_transformer/transformer_shakespeare.pt \
+        --vocab-dir ../decoder_transformer --port 8000
+
+    POST /generate  {"prompt": "turn down for what", "max_tokens": 100, "top_k": 10, "stream": false}
+    GET  /metrics
+
+Everything runs locally; benchmarks/serve_load_test.py is a matching load-testing client.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Deque, List, Optional, Tuple
+
+import torch as t
+import torch.nn.functional as F
+
+import sample_methods as s
+from model_registry import default_registry
+from nlp_modules import WordsTokenizer
+from transformer_modules import DecoderOnlyTransformer, TransformerConfig
+
+
+class QueueFullError(Exception):
+    pass
+
+
+# the GenerationRequest fields a client may set, and their types
+REQUEST_FIELDS = {
+    "prompt": (str,),
+    "max_tokens": (int,),
+    "temperature": (int, float),
+    "freq_penalty": (int, float),
+    "top_k": (int,),
+    "top_p": (int, float),
+    "deadline": (int, float, type(None)),
+}
+
+
+@dataclass
+class GenerationRequest:
+    '''
+    One generation request, along with the timestamps and output filled in by the scheduler.
+
+    deadline: seconds after submission by which the request must finish; a request still queued
+        at its deadline is dropped, and a running one stops with the tokens generated so far
+    '''
+    prompt: str
+    max_tokens: int = 30
+    temperature: float = 1.0
+    freq_penalty: float = 0.0
+    top_k: int = 0
+    top_p: float = 0.0
+    deadline: Optional[float] = None
+
+    input_ids: list = field(default_factory=list)
+    generated: list = field(default_factory=list)
+    status: str = "queued"
+    cancelled: bool = False
+    submitted_at: float = 0.0
+    started_at: Optional[float] = None
+    first_token_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    pieces: Optional[asyncio.Queue] = None
+    done: Optional[asyncio.Future] = None
+
+    def validate(self) -> None:
+        '''
+        Raises ValueError, naming the field, if a field a client sets has the wrong type or is
+        out of range.
+        '''
+        for name, kinds in REQUEST_FIELDS.items():
+            value = getattr(self, name)
+            # bool is an int, but never a valid value here
+            if isinstance(value, bool) or not isinstance(value, kinds):
+                raise ValueError(f"{name} must be of type {' or '.join(kind.__name__ for kind in kinds)}")
+            if isinstance(value, float) and not math.isfinite(value):
+                raise ValueError(f"{name} must be finite")
+        for valid, message in [
+            (self.prompt != "", "prompt must not be empty"),
+            (self.max_tokens >= 1, "max_tokens must be at least 1"),
+            (self.temperature >= 0, "temperature must be non-negative"),
+            (self.top_k >= 0, "top_k must be non-negative"),
+            (0 <= self.top_p <= 1, "top_p must be between 0 and 1"),
+            (self.deadline is None or self.deadline >= 0, "deadline must be non-negative"),
+        ]:
+            if not valid:
+                raise ValueError(message)
+
+    def expired(self, now: float) -> bool:
+        return self.deadline is not None and now - self.submitted_at > self.deadline
+
+    def metrics(self) -> dict:
+        end = self.finished_at or time.perf_counter()
+        decode_time = end - self.first_token_at if self.first_token_at else 0.0
+        return {
+            "status": self.status,
+            "prompt_tokens": len(self.input_ids),
+            "generated_tokens": len(self.generated),
+            "queue_wait": (self.started_at or end) - self.submitted_at,
+            "time_to_first_token": self.first_token_at - self.submitted_at if self.first_token_at else None,
+            "total_time": end - self.submitted_at,
+            # tokens after the first, over the time spent producing them
+            "tokens_per_sec": (len(self.generated) - 1) / decode_time if decode_time > 0 else None,
+        }
+
+
+def parse_generation_request(body) -> GenerationRequest:
+    '''
+    Builds a GenerationRequest from a client's JSON body. Only the fields in REQUEST_FIELDS are
+    accepted, so clients can't set the scheduler's own fields.
+
+    Raises ValueError, naming the field, for anything unknown, missing, mistyped or out of range.
+    '''
+    if not isinstance(body, dict):
+        raise ValueError("request body must be a JSON object")
+    unknown = sorted(set(body) - set(REQUEST_FIELDS))
+    if unknown:
+        raise ValueError(f"unknown fields {unknown}; expected some of {list(REQUEST_FIELDS)}")
+    if "prompt" not in body:
+        raise ValueError("prompt is required")
+    request = GenerationRequest(**body)
+    request.validate()
+    return request
+
+
+def _left_pad_cache(past_key_values, padding_mask: t.Tensor, length: int):
+    '''
+    Left-pads a batch's cached keys/values and padding mask to `length` positions.
+    '''
+    pad = length - padding_mask.shape[1]
+    if pad == 0:
+        return past_key_values, padding_mask
+    padding_mask = F.pad(padding_mask, (pad, 0))
+    past_key_values = [(F.pad(K, (0, 0, pad, 0)), F.pad(V, (0, 0, pad, 0))) for K, V in past_key_values]
+    return past_key_values, padding_mask
+
+
+class ContinuousBatchingScheduler:
+    '''
+    Queues GenerationRequests and decodes all running requests together, one token per step.
+
+    Between steps, queued requests are admitted up to max_batch_size: they are prefilled as a
+    batch, and their KV caches are left-padded and concatenated onto the running batch's. Rows
+    whose requests finish (eos, max_tokens, deadline or client disconnect) are removed along with
+    their cache entries and sampling state. The model runs on a single worker thread, so the
+    event loop stays free to accept requests while a step is in progress.
+    '''
+
+    def __init__(self, model, tokenizer, max_batch_size: int = 8, max_queue_depth: int = 64, history: int = 1000):
+        self.model = model.eval()
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.max_queue_depth = max_queue_depth
+        self.device = s.model_device(model)
+        self.eos_token_id = getattr(tokenizer, "eos_token_id", None)
+
+        self.waiting: Deque[GenerationRequest] = collections.deque()
+        self.running: List[GenerationRequest] = []
+        self.past_key_values = None
+        self.padding_mask = None
+        self.processors = None
+
+        self.finished: Deque[dict] = collections.deque(maxlen=history)
+        self.rejected = 0
+        self.expired_in_queue = 0
+        self.steps = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def submit(self, request: GenerationRequest) -> GenerationRequest:
+        '''
+        Queues a request; raises ValueError if it's invalid (see GenerationRequest.validate) or its
+        prompt encodes to no tokens, and QueueFullError if max_queue_depth requests are already
+        waiting.
+        '''
+        request.validate()
+        input_ids = self.tokenizer.encode(request.prompt)
+        if len(input_ids) == 0:
+            # a row of only padding has no position to sample from
+            raise ValueError("prompt must encode to at least one token")
+        if len(self.waiting) >= self.max_queue_depth:
+            self.rejected += 1
+            raise QueueFullError(f"{len(self.waiting)} requests already queued")
+        loop = asyncio.get_running_loop()
+        request.submitted_at = time.perf_counter()
+        request.input_ids = input_ids
+        request.pieces = asyncio.Queue()
+        request.done = loop.create_future()
+        self.waiting.append(request)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return request
+
+    def close(self) -> None:
+        '''
+        Shuts down the model's worker thread, after any step in progress; call once run has stopped.
+        '''
+        self._executor.shutdown(wait=True)
+
+    async def run(self) -> None:
+        '''
+        The scheduling loop; run it as a task on the server's event loop.
+        '''
+        self._wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        while True:
+            now = time.perf_counter()
+            for request in [r for r in self.waiting if r.expired(now) or r.cancelled]:
+                self.waiting.remove(request)
+                self.expired_in_queue += not request.cancelled
+                self._finish(request, "cancelled" if request.cancelled else "deadline")
+
+            if not self.waiting and not self.running:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            joining = []
+            while self.waiting and len(self.running) + len(joining) < self.max_batch_size:
+                request = self.waiting.popleft()
+                request.started_at = time.perf_counter()
+                request.status = "running"
+                joining.append(request)
+
+            try:
+                outputs = await loop.run_in_executor(self._executor, self._step, joining)
+            except Exception as e:
+                # _step already drops joining requests that fail on their own, so this is the running
+                # batch failing: end those requests rather than the loop
+                outputs = self._fail_batch(joining, e)
+            self.steps += 1
+            for request, new_token, status in outputs:
+                if new_token is not None:
+                    if request.first_token_at is None:
+                        request.first_token_at = time.perf_counter()
+                    request.pieces.put_nowait(self.tokenizer.decode([new_token]))
+                if status is not None:
+                    self._finish(request, status)
+
+    def _finish(self, request: GenerationRequest, status: str) -> None:
+        request.status = status
+        request.finished_at = time.perf_counter()
+        request.pieces.put_nowait(None)
+        if not request.done.done():
+            request.done.set_result(request)
+        self.finished.append(request.metrics())
+
+    def _step(self, joining: List[GenerationRequest]) -> List[Tuple[GenerationRequest, int, Optional[str]]]:
+        '''
+        Samples one token for every running and joining request (on the worker thread).
+
+        Return: (request, new token, status if the request has now finished else None) for each row,
+            and (request, None, "error") for each joining request that failed to start
+        '''
+        with t.inference_mode():
+            new_tokens, failed = [], []
+            if self.running:
+                new_tokens += self._decode_running()
+            if joining:
+                try:
+                    new_tokens += self._admit(joining)
+                except Exception:
+                    # admit them one at a time, so that only the requests that fail are dropped
+                    for request in joining:
+                        try:
+                            new_tokens += self._admit([request])
+                        except Exception as e:
+                            request.error = f"{type(e).__name__}: {e}"
+                            failed.append((request, None, "error"))
+
+            outputs, keep = failed, []
+            now = time.perf_counter()
+            for row, (request, new_token) in enumerate(zip(self.running, new_tokens)):
+                request.generated.append(new_token)
+                status = None
+                if request.cancelled:
+                    status = "cancelled"
+                elif new_token == self.eos_token_id or len(request.generated) >= request.max_tokens:
+                    status = "done"
+                elif request.expired(now):
+                    status = "deadline"
+                outputs.append((request, new_token, status))
+                if status is None:
+                    keep.append(row)
+
+            if len(keep) < len(self.running):
+                self._select_rows(keep)
+            return outputs
+
+    def _decode_running(self) -> List[int]:
+        max_len = self.tokenizer.model_max_length
+        if self.past_key_values[0][0].shape[1] >= max_len:
+            # rebuild the cache from each row's most recent window of tokens
+            windows = [(r.input_ids + r.generated)[-max_len:] for r in self.running]
+            input_ids, self.padding_mask = s.left_pad(windows, device=self.device)
+            self.past_key_values = None
+        else:
+            input_ids = t.tensor([[r.generated[-1]] for r in self.running], dtype=t.int64, device=self.device)
+            self.padding_mask = t.cat([self.padding_mask, t.ones_like(self.padding_mask[:, :1])], dim=1)
+
+        logits, self.past_key_values = self.model(
+            input_ids,
+            past_key_values=self.past_key_values,
+            use_cache=True,
+            only_last=True,
+            padding_mask=self.padding_mask,
+        )
+        return s.sample_next_tokens(logits[:, -1], self.processors).tolist()
+
+    def _admit(self, joining: List[GenerationRequest]) -> List[int]:
+        new_tokens = self._prefill(joining)
+        self.running += joining
+        return new_tokens
+
+    def _fail_batch(self, joining: List[GenerationRequest], error: Exception):
+        '''
+        Ends every running and joining request with status "error" and clears the batch.
+        '''
+        requests = self.running + [request for request in joining if request not in self.running]
+        self.running = []
+        self.past_key_values, self.padding_mask, self.processors = None, None, None
+        for request in requests:
+            request.error = f"{type(error).__name__}: {error}"
+        return [(request, None, "error") for request in requests]
+
+    def _prefill(self, joining: List[GenerationRequest]) -> List[int]:
+        windows = [r.input_ids[-self.tokenizer.model_max_length:] for r in joining]
+        input_ids, padding_mask = s.left_pad(windows, device=self.device)
+        logits, past_key_values = self.model(
+            input_ids, use_cache=True, only_last=True, padding_mask=padding_mask
+        )
+        processors = s.make_logits_processors(
+            [r.input_ids for r in joining],
+            logits.shape[-1],
+            temperature=[r.temperature for r in joining],
+            freq_penalty=[r.freq_penalty for r in joining],
+            top_k=[r.top_k for r in joining],
+            top_p=[r.top_p for r in joining],
+            device=self.device,
+            all_processors=True,
+        )
+        new_tokens = s.sample_next_tokens(logits[:, -1], processors).tolist()
+
+        if not self.running:
+            self.past_key_values, self.padding_mask, self.processors = past_key_values, padding_mask, processors
+            return new_tokens
+
+        length = max(self.padding_mask.shape[1], padding_mask.shape[1])
+        running_past, running_mask = _left_pad_cache(self.past_key_values, self.padding_mask, length)
+        past_key_values, padding_mask = _left_pad_cache(past_key_values, padding_mask, length)
+        self.past_key_values = [
+            (t.cat([K1, K2]), t.cat([V1, V2])) for (K1, V1), (K2, V2) in zip(running_past, past_key_values)
+        ]
+        self.padding_mask = t.cat([running_mask, padding_mask])
+        self.processors.extend_rows(processors)
+        return new_tokens
+
+    def _select_rows(self, keep: List[int]) -> None:
+        self.running = [self.running[row] for row in keep]
+        if not self.running:
+            self.past_key_values, self.padding_mask, self.processors = None, None, None
+            return
+        rows = t.tensor(keep, device=self.device)
+        self.processors.select_rows(rows)
+        padding_mask = self.padding_mask[rows]
+        # drop leading columns that are now padding in every row
+        start = int(padding_mask.any(dim=0).int().argmax())
+        self.padding_mask = padding_mask[:, start:]
+        self.past_key_values = [(K[rows, start:], V[rows, start:]) for K, V in self.past_key_values]
+
+    def metrics(self) -> dict:
+        '''
+        Aggregate queue wait, time-to-first-token and tokens/sec over recently finished requests.
+        '''
+        summary = {
+            "queued": len(self.waiting),
+            "running": len(self.running),
+            "steps": self.steps,
+            "finished": len(self.finished),
+            "rejected_queue_full": self.rejected,
+            "expired_in_queue": self.expired_in_queue,
+        }
+        for name in ["queue_wait", "time_to_first_token", "tokens_per_sec", "total_time"]:
+            values = sorted(m[name] for m in self.finished if m[name] is not None)
+            if values:
+                summary[name] = {
+                    "mean": sum(values) / len(values),
+                    "p50": values[len(values) // 2],
+                    "p95": values[min(len(values) - 1, int(0.95 * len(values)))],
+                }
+        return summary
+
+
+def make_app(scheduler: ContinuousBatchingScheduler):
+    '''
+    Builds the aiohttp application exposing POST /generate and GET /metrics.
+    '''
+    from aiohttp import web
+
+    async def generate(http_request):
+        try:
+            body = await http_request.json()
+            stream = body.pop("stream", False) if isinstance(body, dict) else False
+            if not isinstance(stream, bool):
+                raise ValueError("stream must be of type bool")
+            request = scheduler.submit(parse_generation_request(body))
+        except QueueFullError as e:
+            return web.json_response({"error": str(e)}, status=429)
+        except KeyError as e:
+            # a prompt word the tokenizer doesn't know
+            return web.json_response({"error": f"unknown token {e}"}, status=400)
+        except ValueError as e:
+            # includes json.JSONDecodeError
+            return web.json_response({"error": str(e)}, status=400)
+
+        try:
+            if not stream:
+                await request.done
+                if request.status == "error":
+                    return web.json_response({"error": request.error, "metrics": request.metrics()}, status=500)
+                text = scheduler.tokenizer.decode(request.input_ids + request.generated)
+                return web.json_response({"text": text, "metrics": request.metrics()})
+
+            response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+            await response.prepare(http_request)
+            while True:
+                piece = await request.pieces.get()
+                if piece is None:
+                    break
+                await response.write((json.dumps({"text": piece}) + "\n").encode())
+            await response.write((json.dumps({"metrics": request.metrics()}) + "\n").encode())
+            await response.write_eof()
+            return response
+        finally:
+            # the client went away (or we are done): let the scheduler drop the row
+            request.cancelled = request.cancelled or not request.done.done()
+
+    async def metrics(http_request):
+        return web.json_response(scheduler.metrics())
+
+    async def start_scheduler(app):
+        app["scheduler_task"] = asyncio.create_task(scheduler.run())
+
+    async def stop_scheduler(app):
+        app["scheduler_task"].cancel()
+        try:
+            await app["scheduler_task"]
+        except asyncio.CancelledError:
+            pass
+        scheduler.close()
+
+    app = web.Application()
+    app.add_routes([web.post("/generate", generate), web.get("/metrics", metrics)])
+    app.on_startup.append(start_scheduler)
+    app.on_cleanup.append(stop_scheduler)
+    return app
+
+
+def main():
+    from aiohttp import web
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", help="checkpoint saved with t.save(model); random weights if omitted")
+    parser.add_argument("--vocab-dir", default=".", help="directory containing vocab.bin (or word_id_map.pkl and id_word_map.pkl)")
+    parser.add_argument("--max-len", type=int, default=128, help="tokenizer.model_max_length")
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-queue-depth", type=int, default=64)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    if args.model:
+        model, tokenizer = default_registry.get(args.model, args.vocab_dir, args.max_len)
+    else:
+        tokenizer = WordsTokenizer(args.max_len)
+        tokenizer.load_saved(args.vocab_dir)
+        config = TransformerConfig(
+            num_layers=12, num_heads=8, vocab_size=len(tokenizer.id_word_map), hidden_size=256, max_seq_len=128
+        )
+        model = DecoderOnlyTransformer(config)
+
+    scheduler = ContinuousBatchingScheduler(model, tokenizer, args.max_batch_size, args.max_queue_depth)
+    web.run_app(make_app(scheduler), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
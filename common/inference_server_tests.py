@@ -0,0 +1,113 @@
+import asyncio
+import unittest
+
+import torch as t
+from aiohttp.test_utils import TestClient, TestServer
+
+import sample_methods as s
+from inference_server import ContinuousBatchingScheduler, GenerationRequest, QueueFullError, make_app
+from kv_cache_tests import IdTokenizer
+from transformer_modules import DecoderOnlyTransformer, TransformerConfig
+
+
+class TestContinuousBatchingScheduler(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        t.manual_seed(0)
+        config = TransformerConfig(
+            num_layers=2, num_heads=4, vocab_size=50, hidden_size=32, max_seq_len=24, dropout=0.1
+        )
+        self.model = DecoderOnlyTransformer(config)
+        self.tokenizer = IdTokenizer(model_max_length=8)
+
+    def expected(self, prompt, max_tokens):
+        return s.sample_tokens(self.model, self.tokenizer, prompt, max_tokens_generated=max_tokens, temperature=0)
+
+    async def test_requests_joining_mid_decode_match_sample_tokens(self):
+        scheduler = ContinuousBatchingScheduler(self.model, self.tokenizer, max_batch_size=3)
+        task = asyncio.create_task(scheduler.run())
+        try:
+            first = scheduler.submit(GenerationRequest("1 2 3 4 5", max_tokens=12, temperature=0))
+            while len(first.generated) < 4:
+                await asyncio.sleep(0)
+            later = [
+                scheduler.submit(GenerationRequest(prompt, max_tokens=n, temperature=0))
+                for prompt, n in [("6", 3), ("7 8 9", 9), ("10 11", 5)]
+            ]
+            for request in [first] + later:
+                await request.done
+                self.assertEqual(request.status, "done")
+                self.assertEqual(
+                    self.tokenizer.decode(request.input_ids + request.generated),
+                    self.expected(request.prompt, request.max_tokens),
+                )
+            metrics = scheduler.metrics()
+            self.assertEqual(metrics["finished"], 4)
+            self.assertIn("time_to_first_token", metrics)
+        finally:
+            task.cancel()
+
+    async def test_queue_depth_and_deadline(self):
+        scheduler = ContinuousBatchingScheduler(self.model, self.tokenizer, max_batch_size=1, max_queue_depth=2)
+        scheduler.submit(GenerationRequest("1", max_tokens=5))
+        expiring = scheduler.submit(GenerationRequest("2", max_tokens=5, deadline=0.0))
+        with self.assertRaises(QueueFullError):
+            scheduler.submit(GenerationRequest("3"))
+        task = asyncio.create_task(scheduler.run())
+        try:
+            await expiring.done
+            self.assertEqual(expiring.status, "deadline")
+        finally:
+            task.cancel()
+
+    async def test_failing_request_only_fails_itself(self):
+        scheduler = ContinuousBatchingScheduler(self.model, self.tokenizer, max_batch_size=4)
+        with self.assertRaises(ValueError):
+            scheduler.submit(GenerationRequest("1", max_tokens="3"))
+        # id 99 is past the embedding, so only this request's prefill fails
+        bad = scheduler.submit(GenerationRequest("1 99", max_tokens=3, temperature=0))
+        good = scheduler.submit(GenerationRequest("1 2", max_tokens=3, temperature=0))
+        task = asyncio.create_task(scheduler.run())
+        try:
+            await asyncio.wait_for(asyncio.gather(bad.done, good.done), timeout=30)
+            self.assertEqual(bad.status, "error")
+            self.assertIn("IndexError", bad.error)
+            self.assertEqual(good.status, "done")
+            self.assertEqual(self.tokenizer.decode(good.input_ids + good.generated), self.expected("1 2", 3))
+
+            later = scheduler.submit(GenerationRequest("3", max_tokens=2, temperature=0))
+            await asyncio.wait_for(later.done, timeout=30)
+            self.assertEqual(later.status, "done")
+        finally:
+            task.cancel()
+
+    async def test_http_validation(self):
+        scheduler = ContinuousBatchingScheduler(self.model, self.tokenizer)
+        async with TestClient(TestServer(make_app(scheduler))) as client:
+            for body in [
+                {"prompt": "a b", "max_tokens": "3"},
+                {"prompt": "1", "max_tokens": 0},
+                {"prompt": ""},
+                {"prompt": "   "},
+                {"prompt": "1", "top_p": 1.5},
+                {"prompt": "1", "temperature": True},
+                {"prompt": "1", "generated": [1, 2]},
+                {"prompt": "1", "stream": "yes"},
+                {"max_tokens": 3},
+                ["1"],
+            ]:
+                with self.subTest(body=body):
+                    response = await client.post("/generate", json=body)
+                    self.assertEqual(response.status, 400)
+                    self.assertIn("error", await response.json())
+            response = await client.post("/generate", data="{not json")
+            self.assertEqual(response.status, 400)
+
+            response = await client.post("/generate", json={"prompt": "1 2", "max_tokens": 3, "temperature": 0})
+            self.assertEqual(response.status, 200)
+            self.assertEqual((await response.json())["text"], self.expected("1 2", 3))
+        # stopping the app stops the scheduler's worker thread
+        self.assertTrue(scheduler._executor._shutdown)
+
+
+if __name__ == "__main__":
+    unittest.main()
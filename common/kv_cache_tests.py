@@ -0,0 +1,61 @@
+import unittest
+
+import torch as t
+
+import sample_methods as s
+from gpt_modules import GPT
+from transformer_modules import DecoderOnlyTransformer, TransformerConfig
+
+
+class IdTokenizer:
+    """Treats a space-separated string of integers as token ids."""
+
+    def __init__(self, model_max_length):
+        self.model_max_length = model_max_length
+
+    def encode(self, text):
+        return [int(word) for word in text.split()]
+
+    def decode(self, ids):
+        return " ".join(str(id) for id in ids)
+
+
+class TestKVCache(unittest.TestCase):
+    def setUp(self):
+        t.manual_seed(0)
+        self.config = TransformerConfig(
+            num_layers=2, num_heads=4, vocab_size=50, hidden_size=32, max_seq_len=24, dropout=0.1
+        )
+
+    def check_incremental_matches_full(self, model):
+        model.eval()
+        x = t.randint(0, self.config.vocab_size, (2, 10))
+        expected = model(x)
+
+        logits, past = model(x[:, :6], use_cache=True)
+        t.testing.assert_close(logits, expected[:, :6])
+        for pos in range(6, 10):
+            logits, past = model(x[:, pos : pos + 1], past_key_values=past, use_cache=True, only_last=True)
+            t.testing.assert_close(logits[:, 0], expected[:, pos])
+        self.assertEqual(past[0][0].shape, (2, 10, self.config.hidden_size))
+
+    def test_decoder_only_transformer(self):
+        self.check_incremental_matches_full(DecoderOnlyTransformer(self.config))
+
+    def test_gpt(self):
+        self.check_incremental_matches_full(GPT(self.config))
+
+    def test_sample_tokens_cache_matches_recompute(self):
+        model = DecoderOnlyTransformer(self.config)
+        # window smaller than the generated length, so the sliding-window path is exercised
+        tokenizer = IdTokenizer(model_max_length=8)
+        for kwargs in [dict(temperature=0), dict(temperature=1.0, top_k=5)]:
+            t.manual_seed(1)
+            cached = s.sample_tokens(model, tokenizer, "1 2 3", max_tokens_generated=12, **kwargs)
+            t.manual_seed(1)
+            uncached = s.sample_tokens(model, tokenizer, "1 2 3", max_tokens_generated=12, use_cache=False, **kwargs)
+            self.assertEqual(cached, uncached)
+
+
+if __name__ == "__main__":
+    unittest.main()
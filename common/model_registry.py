@@ -0,0 +1,157 @@
+"""
+A process-wide registry of loaded models and tokenizers, so that serving code deserializes each
+checkpoint and vocabulary once instead of on every request.
+
+    registry = ModelRegistry(memory_budget=2 * 1024**3)
+    registry.preload([("transformer_shakespeare.pt", ".", 16)])
+    model, tokenizer = registry.get("transformer_shakespeare.pt", ".", 16)
+"""
+import os
+import sys
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+import torch as t
+from torch import nn
+
+from general_modules import module_nbytes
+from nlp_modules import Vocabulary, WordsTokenizer
+
+RegistryKey = Tuple[str, str, int]
+
+
+def tokenizer_nbytes(tokenizer: WordsTokenizer) -> int:
+    '''
+    Approximate bytes held by a WordsTokenizer's vocabulary: id_word_map, either a dict or the
+    memory-mapped words of a Vocabulary, and the word_id_map dict and its words. A Vocabulary's
+    word_id_map is only built on first use, so its size is estimated from the vocabulary instead
+    of building it here.
+    '''
+    id_word_map = tokenizer.id_word_map
+    if not isinstance(id_word_map, Vocabulary):
+        words = sum(sys.getsizeof(word) for word in tokenizer.word_id_map)
+        return sys.getsizeof(tokenizer.word_id_map) + sys.getsizeof(id_word_map) + words
+    num_words = len(id_word_map)
+    # a str per word of about its UTF-8 length (exactly, for ASCII), and a dict with as many str
+    # keys (str-keyed dicts are smaller than others)
+    words = num_words * sys.getsizeof("") + id_word_map.words.nbytes
+    return id_word_map.nbytes + sys.getsizeof(dict.fromkeys(map(str, range(num_words)))) + words
+
+
+@dataclass
+class RegistryEntry:
+    model: nn.Module
+    tokenizer: WordsTokenizer
+    nbytes: int
+
+
+class ModelRegistry:
+    '''
+    Loads each (checkpoint, vocabulary directory, model_max_length) combination once and hands
+    out the same model and tokenizer to every caller.
+
+    Models are put in eval mode with gradients disabled, and their forward passes write no state
+    to the modules (model_registry_tests checks this), so they can be shared by several threads
+    running inference at once; callers must not train or modify them. When memory_budget (bytes)
+    is set, the least recently used entries are evicted once the total exceeds it. Evicted models
+    stay alive for as long as a caller still holds them.
+    '''
+
+    def __init__(self, memory_budget: Optional[int] = None, map_location="cpu"):
+        self.memory_budget = memory_budget
+        self.map_location = map_location
+        self._entries: "OrderedDict[RegistryKey, RegistryEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks: Dict[RegistryKey, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(checkpoint: str, vocab_dir: str = ".", model_max_length: int = 128) -> RegistryKey:
+        return (os.path.realpath(checkpoint), os.path.realpath(vocab_dir), model_max_length)
+
+    def get(self, checkpoint: str, vocab_dir: str = ".", model_max_length: int = 128) -> Tuple[nn.Module, WordsTokenizer]:
+        '''
+        Returns the shared (model, tokenizer) pair, loading it first if it is not in the registry.
+        '''
+        key = self.key(checkpoint, vocab_dir, model_max_length)
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                return entry.model, entry.tokenizer
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # only one thread loads a given key; others wait for it rather than loading a second copy
+        with key_lock:
+            with self._lock:
+                entry = self._lookup(key)
+                if entry is not None:
+                    return entry.model, entry.tokenizer
+                self.misses += 1
+
+            entry = self._load(*key)
+
+            with self._lock:
+                self._entries[key] = entry
+                self._evict()
+                return entry.model, entry.tokenizer
+
+    def preload(self, specs: Iterable[Tuple[str, str, int]]) -> None:
+        '''
+        Loads (checkpoint, vocab_dir, model_max_length) combinations ahead of the first request.
+        '''
+        for checkpoint, vocab_dir, model_max_length in specs:
+            self.get(checkpoint, vocab_dir, model_max_length)
+
+    def _lookup(self, key: RegistryKey) -> Optional[RegistryEntry]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return entry
+
+    def _load(self, checkpoint: str, vocab_dir: str, model_max_length: int) -> RegistryEntry:
+        model = t.load(checkpoint, map_location=self.map_location, weights_only=False)
+        model.eval()
+        model.requires_grad_(False)
+
+        tokenizer = WordsTokenizer(model_max_length)
+        tokenizer.load_saved(vocab_dir)
+        return RegistryEntry(model, tokenizer, module_nbytes(model) + tokenizer_nbytes(tokenizer))
+
+    def _evict(self) -> None:
+        if self.memory_budget is None:
+            return
+        # always keep the most recently used entry, even if it alone exceeds the budget
+        while len(self._entries) > 1 and self.nbytes > self.memory_budget:
+            key, _ = self._entries.popitem(last=False)
+            self._key_locks.pop(key, None)
+            self.evictions += 1
+
+    @property
+    def nbytes(self) -> int:
+        return sum(entry.nbytes for entry in self._entries.values())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": [key[0] for key in self._entries],
+                "nbytes": self.nbytes,
+                "memory_budget": self.memory_budget,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+default_registry = ModelRegistry()
+
+
+def get_model(checkpoint: str, vocab_dir: str = ".", model_max_length: int = 128) -> Tuple[nn.Module, WordsTokenizer]:
+    '''
+    Returns the (model, tokenizer) pair from the process-wide default registry.
+    '''
+    return default_registry.get(checkpoint, vocab_dir, model_max_length)
@@ -0,0 +1,118 @@
+import os
+import pickle
+import sys
+import tempfile
+import threading
+import unittest
+
+import torch as t
+
+from general_modules import module_nbytes
+from gpt_modules import GPT
+from model_registry import ModelRegistry, tokenizer_nbytes
+from nlp_modules import WordsTokenizer
+from transformer_modules import DecoderOnlyTransformer, TransformerConfig
+
+
+class TestModelRegistry(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        config = TransformerConfig(num_layers=1, num_heads=2, vocab_size=3, hidden_size=8, max_seq_len=8)
+        self.checkpoints = []
+        for i in range(3):
+            path = os.path.join(self.dir.name, f"model_{i}.pt")
+            t.save(DecoderOnlyTransformer(config), path)
+            self.checkpoints.append(path)
+        self.model_bytes = module_nbytes(DecoderOnlyTransformer(config))
+        for name, vocab in [("word_id_map.pkl", {"a": 0, " ": 1, "b": 2}), ("id_word_map.pkl", {0: "a", 1: " ", 2: "b"})]:
+            with open(os.path.join(self.dir.name, name), "wb") as file:
+                pickle.dump(vocab, file)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_loads_once_and_shares(self):
+        registry = ModelRegistry()
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(registry.get(self.checkpoints[0], self.dir.name, 8)))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(registry.misses, 1)
+        self.assertTrue(all(model is results[0][0] for model, _ in results))
+        model, tokenizer = results[0]
+        self.assertFalse(model.training)
+        self.assertEqual(tokenizer.encode("a b"), [0, 1, 2])
+
+    def test_lru_eviction_under_budget(self):
+        # room for two entries (the tokenizer is much smaller than a model)
+        registry = ModelRegistry(memory_budget=int(2.5 * self.model_bytes))
+        registry.preload([(self.checkpoints[0], self.dir.name, 8), (self.checkpoints[1], self.dir.name, 8)])
+        registry.get(self.checkpoints[0], self.dir.name, 8)
+        registry.get(self.checkpoints[2], self.dir.name, 8)
+        entries = registry.stats()["entries"]
+        self.assertEqual(entries, [os.path.realpath(self.checkpoints[i]) for i in (0, 2)])
+        self.assertEqual(registry.evictions, 1)
+
+    def test_inference_writes_no_module_state(self):
+        # what makes sharing one model between threads safe
+        config = TransformerConfig(num_layers=2, num_heads=2, vocab_size=20, hidden_size=16, max_seq_len=16)
+        for model_class in (DecoderOnlyTransformer, GPT):
+            with self.subTest(model=model_class.__name__):
+                model = model_class(config).eval().requires_grad_(False)
+                before = {name: dict(vars(module)) for name, module in model.named_modules()}
+                with t.inference_mode():
+                    model(t.randint(0, 20, (2, 6)))
+                    model(t.randint(0, 20, (2, 6)), use_cache=True, only_last=True)
+                after = {name: dict(vars(module)) for name, module in model.named_modules()}
+                for name in before:
+                    self.assertEqual(before[name].keys(), after[name].keys(), name)
+                    for attribute, value in before[name].items():
+                        self.assertIs(after[name][attribute], value, f"{name}.{attribute}")
+
+    def test_tokenizer_nbytes_keeps_word_id_map_lazy(self):
+        words = ["the", " ", "thee", "\n", "naïve", ",", "Romeo"] + [f"w{i}" for i in range(2000)]
+        tokenizer = WordsTokenizer(model_max_length=8)
+        tokenizer.id_word_map = dict(enumerate(words))
+        # vocab.bin takes precedence over setUp's pickles
+        tokenizer.save_vocab(self.dir.name)
+
+        _, tokenizer = ModelRegistry().get(self.checkpoints[0], self.dir.name, 8)
+        self.assertIsNone(tokenizer._word_id_map)
+        estimate = tokenizer_nbytes(tokenizer)
+        self.assertIsNone(tokenizer._word_id_map)
+        tokenizer.word_id_map
+        actual = (
+            tokenizer.id_word_map.nbytes + sys.getsizeof(tokenizer.word_id_map)
+            + sum(sys.getsizeof(word) for word in tokenizer.word_id_map)
+        )
+        self.assertAlmostEqual(estimate / actual, 1, delta=0.05)
+
+    def test_threads_share_a_model(self):
+        registry = ModelRegistry()
+        model, _ = registry.get(self.checkpoints[0], self.dir.name, 8)
+        inputs = [t.randint(0, 3, (2, 8)) for _ in range(8)]
+        with t.inference_mode():
+            expected = [model(x) for x in inputs]
+        results = [None] * len(inputs)
+
+        def run(i):
+            with t.inference_mode():
+                for _ in range(5):
+                    results[i] = model(inputs[i])
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(len(inputs))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for result, reference in zip(results, expected):
+            t.testing.assert_close(result, reference)
+
+
+if __name__ == "__main__":
+    unittest.main()
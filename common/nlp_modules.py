@@ -3,43 +3,240 @@ from torch.utils.data import Dataset
 import numpy as np
 import pickle
 
-class WordsDataset(Dataset):
-    def __init__(self, seq_len, filename, tokenizer, truncate=None):
+class TokenWindowDataset(Dataset):
+    '''
+    Next-token windows over a 1-D sequence of num_tokens token ids: item i is (x, y), where x is
+    seq_len tokens starting at position offset + i * stride and y is x shifted by one token.
+    Subclasses provide _window(pos), returning (x, y) for the window starting at pos.
+
+    stride: distance between the starts of consecutive windows; 1 gives every window
+    random_offset: shift all windows by a random offset in [0, stride) chosen per epoch (see
+        set_epoch), so that with stride > 1 different epochs see different windows
+    '''
+
+    def __init__(self, seq_len, num_tokens, stride=1, random_offset=False, seed=0):
         self.seq_len = seq_len
+        self.stride = stride
+        self.random_offset = random_offset
+        self.seed = seed
+
+        # windows may start at 0 .. num_tokens - seq_len - 2
+        self.num_starts = max(num_tokens - seq_len - 1, 0)
+        max_offset = stride - 1 if random_offset else 0
+        self.num_windows = max((self.num_starts - 1 - max_offset) // stride + 1, 0)
+        self.set_epoch(0)
+
+    def set_epoch(self, epoch: int):
+        '''
+        Picks the window offset for epoch (only with random_offset). Call before iterating a
+        DataLoader for that epoch; workers that persist between epochs keep their old offset.
+        '''
+        self.epoch = epoch
+        if self.random_offset:
+            generator = t.Generator().manual_seed(self.seed + epoch)
+            self.offset = int(t.randint(0, self.stride, (1,), generator=generator))
+        else:
+            self.offset = 0
+
+    def __len__(self):
+        return self.num_windows
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self.num_windows
+        if not 0 <= idx < self.num_windows:
+            raise IndexError(f"index {idx} out of range for {self.num_windows} windows")
+        return self._window(self.offset + idx * self.stride)
+
+    def _window(self, pos):
+        raise NotImplementedError
+
+
+class WordsDataset(TokenWindowDataset):
+    '''
+    TokenWindowDataset over a text file, tokenized (after tokenizer.build_dict) on construction.
+
+    The corpus is held once, as a single 1-D tensor, and every window is a view into it, so memory
+    is O(corpus) whatever seq_len and stride are, and DataLoader workers share the one copy.
+    '''
+
+    def __init__(self, seq_len, filename, tokenizer, truncate=None, stride=1, random_offset=False, seed=0):
         self.filename = filename
-        
+
         with open(filename, 'r') as textfile:
             text = textfile.read()
-        
+
         tokenizer.build_dict(text)
-        self.tokens = tokenizer.encode(text)
-        
+        # in shared memory, so that DataLoader workers started with spawn or forkserver receive a
+        # handle to it rather than a pickled copy
+        self.tokens = t.tensor(tokenizer.encode(text), dtype=t.int64).share_memory_()
+
         word_count = len(self.tokens)
 
         if truncate:
             word_count = int(word_count * truncate)
 
-        self.x_seqs, self.y_seqs = [], []
-        
-        for pos in range(0, word_count - seq_len - 1):
-            self.x_seqs.append(t.tensor(self.tokens[pos:pos+self.seq_len]))
-            self.y_seqs.append(t.tensor(self.tokens[pos+1:pos+self.seq_len+1]))
-        self.x_seqs = t.stack(self.x_seqs)
-        self.y_seqs = t.stack(self.y_seqs)
+        super().__init__(seq_len, word_count, stride, random_offset, seed)
 
-    def __len__(self):
-        return len(self.x_seqs)
+    @property
+    def x_seqs(self):
+        return self._windows(0)
 
-    def __getitem__(self, idx):
-        return self.x_seqs[idx], self.y_seqs[idx]
+    @property
+    def y_seqs(self):
+        return self._windows(1)
+
+    def _windows(self, shift):
+        # (num_windows, seq_len) view of self.tokens
+        start = self.offset + shift
+        length = (self.num_windows - 1) * self.stride + self.seq_len if self.num_windows else 0
+        return self.tokens[start:start + length].unfold(0, self.seq_len, self.stride)
+
+    def _window(self, pos):
+        return self.tokens[pos:pos+self.seq_len], self.tokens[pos+1:pos+self.seq_len+1]
 
 
 from typing import Optional, Union
 import re
 
 from typing import Optional, Union
+import os
 import re
 import pickle
+import itertools
+import operator
+import struct
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+# the tokens of re.split(r"\b", text) without the empty strings: maximal runs of word or of
+# non-word characters
+_TOKEN = re.compile(r"\W+|\w+")
+_WORD = re.compile(r"\w")
+_BOUNDARY = re.compile(r"\b")
+
+
+def last_word_boundary(text: str, start: int = 0, end: Optional[int] = None) -> int:
+    '''
+    Return: the last index start < i < end with a word boundary between text[i-1] and text[i],
+    or start if there is none. Text split at such indices tokenizes the same piece by piece as
+    whole.
+    '''
+    end = len(text) if end is None else end
+    is_word = _WORD.fullmatch
+    for i in range(end - 1, start, -1):
+        if bool(is_word(text[i - 1])) != bool(is_word(text[i])):
+            return i
+    return start
+
+
+def split_at_word_boundaries(text: str, chunk_chars: int):
+    '''
+    Yields text in consecutive pieces of about chunk_chars characters, cut only at word
+    boundaries (a piece is longer if a single token is).
+    '''
+    start = 0
+    while len(text) - start > chunk_chars:
+        cut = last_word_boundary(text, start, start + chunk_chars)
+        if cut == start:
+            match = _BOUNDARY.search(text, start + chunk_chars)
+            cut = match.start() if match else len(text)
+        yield text[start:cut]
+        start = cut
+    if start < len(text):
+        yield text[start:]
+
+
+def _encode_ids(word_id_map: dict, text: str) -> np.ndarray:
+    tokens = _TOKEN.findall(text)
+    return np.fromiter(map(word_id_map.__getitem__, tokens), dtype=np.int64, count=len(tokens))
+
+
+# the vocabulary of an encode_bulk worker process, sent once when the worker starts
+_worker_word_id_map = None
+
+
+def _init_worker(word_id_map):
+    global _worker_word_id_map
+    _worker_word_id_map = word_id_map
+
+
+def _encode_in_worker(text):
+    return _encode_ids(_worker_word_id_map, text)
+
+
+VOCAB_FILE = "vocab.bin"
+VOCAB_VERSION = 1
+# magic, format version, reserved, number of words; then number of words + 1 uint32 byte offsets
+# into the UTF-8 words that follow them, all little-endian
+_VOCAB_HEADER = struct.Struct("<8sIIQ")
+_VOCAB_MAGIC = b"WORDVOCB"
+
+
+def write_vocab(path: str, words: list):
+    '''
+    Writes a vocabulary file: words[id] for every id, in id order.
+    '''
+    encoded = [word.encode() for word in words]
+    lengths = np.array([len(word) for word in encoded], dtype=np.int64)
+    if lengths.sum() > np.iinfo(np.uint32).max:
+        raise ValueError("vocabulary too large for 32-bit offsets")
+    offsets = np.zeros(len(encoded) + 1, dtype="<u4")
+    offsets[1:] = np.cumsum(lengths)
+    with open(path, "wb") as file:
+        file.write(_VOCAB_HEADER.pack(_VOCAB_MAGIC, VOCAB_VERSION, 0, len(encoded)))
+        file.write(offsets.tobytes())
+        file.write(b"".join(encoded))
+
+
+class Vocabulary:
+    '''
+    The id -> word direction of a vocabulary file, read through np.memmap, so loading costs no
+    more than opening the file and the words stay in the page cache, shared between processes.
+    Indexes like the id_word_map dict: vocabulary[id] is a word, and unknown ids raise KeyError.
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        data = np.memmap(path, dtype=np.uint8, mode="r")
+        magic, version, _, size = _VOCAB_HEADER.unpack(data[:_VOCAB_HEADER.size].tobytes())
+        if magic != _VOCAB_MAGIC:
+            raise ValueError(f"{path} is not a vocabulary file")
+        if version != VOCAB_VERSION:
+            raise ValueError(f"{path} has vocabulary version {version}, expected {VOCAB_VERSION}")
+        words_start = _VOCAB_HEADER.size + 4 * (size + 1)
+        self.offsets = data[_VOCAB_HEADER.size:words_start].view("<u4")
+        self.words = data[words_start:]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, id):
+        id = operator.index(id)
+        if not 0 <= id < len(self):
+            raise KeyError(id)
+        return self.words[self.offsets[id]:self.offsets[id + 1]].tobytes().decode()
+
+    def __iter__(self):
+        '''
+        Yields the ids, like iterating a dict.
+        '''
+        return iter(range(len(self)))
+
+    def items(self):
+        words = self.words.tobytes()
+        offsets = self.offsets.tolist()
+        for id in range(len(self)):
+            yield id, words[offsets[id]:offsets[id + 1]].decode()
+
+    @property
+    def nbytes(self) -> int:
+        return self.offsets.nbytes + self.words.nbytes
+
+    def __reduce__(self):
+        # reopen the file rather than pickling the words
+        return Vocabulary, (self.path,)
+
 
 class WordsTokenizer():
     model_max_length: int
@@ -49,30 +246,60 @@ class WordsTokenizer():
         self.id_word_map = dict()
         self.model_max_length = model_max_length
 
+    @property
+    def word_id_map(self) -> dict:
+        # after load_saved, built from id_word_map on first use
+        if self._word_id_map is None:
+            self._word_id_map = {word: id for id, word in self.id_word_map.items()}
+        return self._word_id_map
+
+    @word_id_map.setter
+    def word_id_map(self, word_id_map: dict):
+        self._word_id_map = word_id_map
+
     def build_dict(self, initial_text, save=False):
+        '''
+        Builds the vocabulary of initial_text, numbering words from most to least frequent (ties
+        in order of first appearance), so the same text always gives the same ids.
 
+        save: also write it to vocab.bin in the current directory (see save_vocab)
+        '''
         split_text = re.split(r"\b", initial_text)
 
-        # create token id mapping
-        unique_tokens = set(split_text)
-        self.word_id_map = {word:id for id, word in enumerate(unique_tokens)}
-        self.id_word_map = {id:word for word, id in self.word_id_map.items()}
+        # without the empty strings re.split leaves at the ends of the text, which encode drops
+        counts = Counter(filter(None, split_text))
+        words = [word for word, _ in sorted(counts.items(), key=lambda item: -item[1])]
+
+        self.word_id_map = {word: id for id, word in enumerate(words)}
+        self.id_word_map = dict(enumerate(words))
 
         if save:
-            file = open("word_id_map.pkl", "wb")
-            pickle.dump(self.word_id_map, file)
-            file.close()
+            self.save_vocab()
+
+    def save_vocab(self, directory="."):
+        '''
+        Writes the vocabulary to directory/vocab.bin, which load_saved reads.
+        '''
+        words = [self.id_word_map[id] for id in range(len(self.id_word_map))]
+        write_vocab(os.path.join(directory, VOCAB_FILE), words)
 
-            file = open("id_word_map.pkl", "wb")
-            pickle.dump(self.id_word_map, file)
-            file.close()
+    def load_saved(self, directory="."):
+        '''
+        Loads the vocabulary saved in directory: vocab.bin, or if there isn't one the
+        word_id_map.pkl and id_word_map.pkl of earlier versions. word_id_map, which only
+        encoding needs, is built from vocab.bin on first use.
+        '''
+        path = os.path.join(directory, VOCAB_FILE)
+        if os.path.exists(path):
+            self.id_word_map = Vocabulary(path)
+            self._word_id_map = None
+            return
 
-    def load_saved(self):
-        file = open("word_id_map.pkl", "rb")
-        self.word_id_map = pickle.load(file)
+        with open(os.path.join(directory, "word_id_map.pkl"), "rb") as file:
+            self.word_id_map = pickle.load(file)
 
-        file = open("id_word_map.pkl", "rb")
-        self.id_word_map = pickle.load(file)
+        with open(os.path.join(directory, "id_word_map.pkl"), "rb") as file:
+            self.id_word_map = pickle.load(file)
 
     def encode(self, text: str, return_tensors: Optional[str] = None) -> Union[list, t.Tensor]:
         '''
@@ -92,6 +319,49 @@ class WordsTokenizer():
         
         return encoded 
 
+    def encode_bulk(
+        self, text: str, return_tensors: str = "np", num_workers: Optional[int] = None, chunk_chars: int = 1 << 20
+    ) -> Union[np.ndarray, t.Tensor]:
+        '''
+        Same ids as encode, for large texts: the text is split at word boundaries into pieces of
+        about chunk_chars characters, encoded by num_workers processes (default one per CPU;
+        1 encodes in this process), and written straight into one int64 array.
+
+        Return type is a numpy array by default, or a tensor if return_tensors="pt".
+        '''
+        num_workers = num_workers or os.cpu_count()
+        chunks = list(split_at_word_boundaries(text, chunk_chars))
+        if num_workers > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(
+                min(num_workers, len(chunks)), initializer=_init_worker, initargs=(self.word_id_map,)
+            ) as pool:
+                pieces = list(pool.map(_encode_in_worker, chunks))
+        else:
+            pieces = [_encode_ids(self.word_id_map, chunk) for chunk in chunks]
+
+        encoded = np.concatenate(pieces) if pieces else np.empty(0, dtype=np.int64)
+        return t.from_numpy(encoded) if return_tensors == "pt" else encoded
+
+    def encode_batch(self, texts: list, return_tensors: Optional[str] = None) -> list:
+        '''
+        encode for each of many (typically short) texts, with all lookups done in one pass.
+
+        Return: a list with an encoding per text, each a list, or a numpy array (return_tensors="np")
+        or tensor (return_tensors="pt") that is a view into one shared buffer
+        '''
+        tokens = [_TOKEN.findall(text) for text in texts]
+        lengths = [len(text_tokens) for text_tokens in tokens]
+        encoded = np.fromiter(
+            map(self.word_id_map.__getitem__, itertools.chain.from_iterable(tokens)), dtype=np.int64, count=sum(lengths)
+        )
+        if return_tensors == "pt":
+            encoded = t.from_numpy(encoded)
+            return list(encoded.split(lengths))
+        pieces = np.split(encoded, np.cumsum(lengths)[:-1]) if texts else []
+        if return_tensors == "np":
+            return pieces
+        return [piece.tolist() for piece in pieces]
+
     def decode(self, list_of_ids: Union[t.Tensor, list]) -> str:
         '''
         Converts ids to a list of tokens, then joins them into a single string.
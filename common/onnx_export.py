@@ -0,0 +1,158 @@
+"""
+Exports DecoderOnlyTransformer and GPT to ONNX, and serves the exported graphs with onnxruntime's
+CPU provider behind the models' own forward API, so that sample_methods can generate with them
+without the training stack.
+
+    export_onnx(model, "transformer_shakespeare.onnx")
+    onnx_model = OnnxModel("transformer_shakespeare.onnx")
+    s.sample_tokens(onnx_model, tokenizer, "turn down for what", temperature=1.0, top_k=10)
+"""
+import os
+from typing import List, Optional
+
+import numpy as np
+import onnxruntime as ort
+import torch as t
+from torch import nn
+from torch.export import Dim
+
+from transformer_modules import KVCache
+
+_NUMPY_DTYPES = {"tensor(float)": np.float32, "tensor(float16)": np.float16, "tensor(double)": np.float64}
+
+
+class _ExportWrapper(nn.Module):
+    '''
+    Flattens the model's KV cache into separate inputs and outputs, which ONNX needs.
+    '''
+
+    def __init__(self, model: nn.Module, with_past: bool, only_last: bool):
+        super().__init__()
+        self.model = model
+        self.with_past = with_past
+        self.only_last = only_last
+
+    def forward(self, input_ids, attention_mask, *past):
+        if not self.with_past:
+            return self.model(input_ids, only_last=self.only_last, padding_mask=attention_mask)
+        past_key_values = [(past[2 * i], past[2 * i + 1]) for i in range(len(past) // 2)]
+        logits, presents = self.model(
+            input_ids,
+            past_key_values=past_key_values,
+            use_cache=True,
+            only_last=self.only_last,
+            padding_mask=attention_mask,
+        )
+        return (logits,) + tuple(tensor for key_value in presents for tensor in key_value)
+
+
+def export_onnx(model: nn.Module, path: str, with_past: bool = True, only_last: bool = False) -> str:
+    '''
+    Exports model (DecoderOnlyTransformer or GPT) to path, with dynamic batch and sequence axes.
+
+    Inputs are input_ids (batch, seq) and attention_mask (batch, past_seq + seq), which is the
+    models' padding_mask; with_past adds past_key_i/past_value_i (batch, past_seq, hidden_size)
+    for every layer (past_seq may be 0) and the matching present_key_i/present_value_i outputs.
+    With only_last the logits output only covers the last position, which is all generation needs.
+
+    Return: path
+    '''
+    model = model.eval()
+    num_layers = len(model.decoders)
+    hidden_size = model.emb.weight.shape[1]
+    dtype = model.emb.weight.dtype
+
+    # example sizes > 1, since torch.export specializes dimensions of size 0 and 1
+    batch, seq, past_seq = 2, 3, 4 if with_past else 0
+    input_ids = t.randint(0, model.emb.weight.shape[0], (batch, seq))
+    attention_mask = t.ones(batch, past_seq + seq, dtype=t.long)
+    past = [t.zeros(batch, past_seq, hidden_size, dtype=dtype) for _ in range(2 * num_layers if with_past else 0)]
+
+    batch_dim, seq_dim, total_dim = Dim("batch"), Dim("seq"), Dim("total_seq")
+    past_dim = Dim("past_seq", min=0)
+    dynamic_shapes = {
+        "input_ids": {0: batch_dim, 1: seq_dim},
+        "attention_mask": {0: batch_dim, 1: total_dim if with_past else seq_dim},
+    }
+    if with_past:
+        dynamic_shapes["past"] = tuple({0: batch_dim, 1: past_dim} for _ in past)
+    past_names = [f"past_{kind}_{i}" for i in range(num_layers) for kind in ("key", "value")] if with_past else []
+    present_names = [name.replace("past", "present") for name in past_names]
+
+    t.onnx.export(
+        _ExportWrapper(model, with_past, only_last).eval(),
+        (input_ids, attention_mask, *past),
+        path,
+        input_names=["input_ids", "attention_mask"] + past_names,
+        output_names=["logits"] + present_names,
+        dynamic_shapes=dynamic_shapes,
+        dynamo=True,
+        verbose=False,
+    )
+    return path
+
+
+class OnnxModel(nn.Module):
+    '''
+    Runs a graph written by export_onnx on onnxruntime's CPU provider, with the forward signature
+    of DecoderOnlyTransformer/GPT, so it can be passed to sample_tokens, stream_tokens,
+    sample_tokens_batch and beam_search in place of the PyTorch model. Inputs and outputs are
+    torch tensors on the CPU; KV caches stay onnxruntime-owned numpy arrays viewed as tensors.
+    '''
+
+    def __init__(self, path: str, num_threads: Optional[int] = None):
+        super().__init__()
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        self.path = os.path.abspath(path)
+        self.session = ort.InferenceSession(self.path, options, providers=["CPUExecutionProvider"])
+
+        inputs = {node.name: node for node in self.session.get_inputs()}
+        self.past_names = [name for name in inputs if name.startswith("past_")]
+        self.with_past = bool(self.past_names)
+        self.only_last = self.session.get_outputs()[0].shape[1] == 1
+        if self.with_past:
+            first_past = inputs[self.past_names[0]]
+            self.hidden_size = first_past.shape[-1]
+            self.past_dtype = _NUMPY_DTYPES[first_past.type]
+
+    def forward(
+        self,
+        x: t.Tensor,
+        past_key_values: Optional[List[KVCache]] = None,
+        use_cache: bool = False,
+        only_last: bool = False,
+        padding_mask: Optional[t.Tensor] = None,
+    ):
+        '''
+        Same arguments and return values as DecoderOnlyTransformer.forward.
+        '''
+        if (use_cache or past_key_values is not None) and not self.with_past:
+            raise ValueError(f"{self.path} was exported without past key values; export with with_past=True")
+        if not only_last and self.only_last:
+            raise ValueError(f"{self.path} was exported with only_last=True and can't return every position")
+
+        batch, seq = x.shape
+        past_seq = 0 if past_key_values is None else past_key_values[0][0].shape[1]
+        if padding_mask is None:
+            padding_mask = t.ones(batch, past_seq + seq, dtype=t.long)
+        feed = {"input_ids": x.long().numpy(), "attention_mask": padding_mask.long().numpy()}
+        if self.with_past:
+            if past_key_values is None:
+                empty = np.zeros((batch, 0, self.hidden_size), dtype=self.past_dtype)
+                feed.update((name, empty) for name in self.past_names)
+            else:
+                tensors = [tensor for key_value in past_key_values for tensor in key_value]
+                feed.update((name, tensor.numpy()) for name, tensor in zip(self.past_names, tensors))
+
+        logits, *presents = (t.from_numpy(output) for output in self.session.run(None, feed))
+        if only_last and not self.only_last:
+            logits = logits[:, -1:]
+        if use_cache:
+            return logits, [(presents[2 * i], presents[2 * i + 1]) for i in range(len(presents) // 2)]
+        return logits
+
+    def extra_repr(self) -> str:
+        return f"{self.path}, with_past={self.with_past}, only_last={self.only_last}"
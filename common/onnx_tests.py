@@ -0,0 +1,93 @@
+import os
+import tempfile
+import unittest
+
+import torch as t
+
+import sample_methods as s
+from gpt_modules import GPT
+from kv_cache_tests import IdTokenizer
+from onnx_export import OnnxModel, export_onnx
+from transformer_modules import DecoderOnlyTransformer, TransformerConfig
+
+TOLERANCE = dict(atol=1e-4, rtol=1e-4)
+
+
+class TestOnnxExport(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        t.manual_seed(0)
+        cls.directory = tempfile.TemporaryDirectory()
+        config = TransformerConfig(num_layers=2, num_heads=2, vocab_size=50, hidden_size=32, max_seq_len=16)
+        cls.models, cls.onnx_models = {}, {}
+        for model_class in (DecoderOnlyTransformer, GPT):
+            name = model_class.__name__
+            cls.models[name] = model_class(config).eval()
+            path = export_onnx(cls.models[name], os.path.join(cls.directory.name, f"{name}.onnx"))
+            cls.onnx_models[name] = OnnxModel(path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_parity_with_cache(self):
+        x = t.randint(0, 50, (3, 12))
+        for name, model in self.models.items():
+            with self.subTest(model=name), t.inference_mode():
+                onnx_model = self.onnx_models[name]
+                expected, expected_presents = model(x[:, :8], use_cache=True)
+                logits, presents = onnx_model(x[:, :8], use_cache=True)
+                t.testing.assert_close(logits, expected, **TOLERANCE)
+                t.testing.assert_close(presents, expected_presents, **TOLERANCE)
+                t.testing.assert_close(
+                    onnx_model(x[:, 8:], past_key_values=presents, only_last=True),
+                    model(x[:, 8:], past_key_values=expected_presents, only_last=True),
+                    **TOLERANCE,
+                )
+
+    def test_parity_with_padding(self):
+        input_ids, padding_mask = s.left_pad([[1, 2, 3, 4, 5], [6, 7]])
+        for name, model in self.models.items():
+            with self.subTest(model=name), t.inference_mode():
+                expected = model(input_ids, padding_mask=padding_mask)
+                logits = self.onnx_models[name](input_ids, padding_mask=padding_mask)
+                # queries at padding positions attend to nothing, so only compare real tokens
+                real = padding_mask.bool()
+                t.testing.assert_close(logits[real], expected[real], **TOLERANCE)
+
+    def test_greedy_sampling_matches(self):
+        tokenizer = IdTokenizer(model_max_length=8)
+        for name, model in self.models.items():
+            with self.subTest(model=name):
+                # the window slides past model_max_length, so the cache is rebuilt as well
+                expected = s.sample_tokens(model, tokenizer, "1 2 3", max_tokens_generated=10, temperature=0)
+                self.assertEqual(
+                    s.sample_tokens(self.onnx_models[name], tokenizer, "1 2 3", max_tokens_generated=10, temperature=0),
+                    expected,
+                )
+
+    def test_without_past(self):
+        model = self.models["DecoderOnlyTransformer"]
+        path = export_onnx(model, os.path.join(self.directory.name, "no_past.onnx"), with_past=False, only_last=True)
+        onnx_model = OnnxModel(path)
+        self.assertFalse(onnx_model.with_past)
+        x = t.randint(0, 50, (2, 6))
+        with t.inference_mode():
+            t.testing.assert_close(onnx_model(x, only_last=True), model(x, only_last=True), **TOLERANCE)
+        with self.assertRaises(ValueError):
+            onnx_model(x, use_cache=True)
+
+        # generation falls back to recomputing the window at each step
+        self.assertFalse(s.supports_kv_cache(onnx_model))
+        tokenizer = IdTokenizer(model_max_length=8)
+        self.assertEqual(
+            s.sample_tokens(onnx_model, tokenizer, "1 2 3", max_tokens_generated=10, temperature=0),
+            s.sample_tokens(model, tokenizer, "1 2 3", max_tokens_generated=10, temperature=0),
+        )
+        self.assertEqual(
+            s.beam_search(onnx_model, tokenizer, "1 2 3", max_new_tokens=4),
+            s.beam_search(model, tokenizer, "1 2 3", max_new_tokens=4),
+        )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+
+import torch as t
+
+from gpt_modules import GPT
+from transformer_modules import DecoderOnlyTransformer, PositionalEncoding, TransformerConfig
+
+
+class TestComputeDtype(unittest.TestCase):
+    def config(self, **kwargs):
+        return TransformerConfig(num_layers=2, num_heads=2, vocab_size=50, hidden_size=32, max_seq_len=16, **kwargs)
+
+    def test_no_upcasts(self):
+        x = t.randint(0, 50, (2, 16))
+        for model_class in [DecoderOnlyTransformer, GPT]:
+            for dtype in [t.float32, t.bfloat16, t.float16]:
+                model = model_class(self.config(dtype=dtype)).train()
+                self.assertEqual({tensor.dtype for tensor in model.state_dict().values()}, {dtype})
+                logits, presents = model(x, use_cache=True)
+                self.assertEqual(logits.dtype, dtype)
+                self.assertEqual(presents[0][0].dtype, dtype)
+                self.assertTrue(logits.isfinite().all())
+
+    def test_bf16_close_to_fp32(self):
+        t.manual_seed(0)
+        model = DecoderOnlyTransformer(self.config(dropout=0.0)).eval()
+        bf16_model = DecoderOnlyTransformer(self.config(dropout=0.0, dtype=t.bfloat16)).eval()
+        bf16_model.load_state_dict(model.state_dict())
+        x = t.randint(0, 50, (2, 16))
+        logits = model(x)
+        t.testing.assert_close(bf16_model(x).float(), logits, atol=0.05 * logits.abs().max().item(), rtol=0)
+
+    def test_mixed_precision_keeps_fp32_master_weights(self):
+        model = DecoderOnlyTransformer(self.config())
+        x = t.randint(0, 50, (2, 17))
+        with t.autocast("cpu", dtype=t.bfloat16):
+            logits = model(x[:, :-1])
+        self.assertEqual(logits.dtype, t.bfloat16)
+        t.nn.functional.cross_entropy(logits.flatten(0, 1), x[:, 1:].flatten()).backward()
+        for parameter in model.parameters():
+            self.assertEqual(parameter.dtype, t.float32)
+            self.assertEqual(parameter.grad.dtype, t.float32)
+
+    def test_float64_buffer_from_old_checkpoints(self):
+        encoding = PositionalEncoding(16, 32)
+        encoding.pos_enc = encoding.pos_enc.double()
+        self.assertEqual(encoding(t.zeros(1, 4, 32)).dtype, t.float32)
+
+
+if __name__ == "__main__":
+    unittest.main()
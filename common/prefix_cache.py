@@ -0,0 +1,164 @@
+"""
+A cache of per-layer keys and values for token-id prefixes shared between generation requests,
+stored as a radix tree so that a new prompt reuses the longest prefix already computed.
+"""
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import torch as t
+
+from transformer_modules import KVCache
+
+
+class RadixNode:
+    '''
+    A node of the prefix tree. The edge into the node is labelled with `tokens`, and `segment`
+    holds the keys and values of exactly those positions for every layer.
+    '''
+
+    def __init__(self, tokens: Tuple[int, ...] = (), segment: Optional[List[KVCache]] = None, parent=None):
+        self.tokens = tokens
+        self.segment = segment
+        self.parent = parent
+        self.children: Dict[int, "RadixNode"] = {}
+        self.last_access = time.monotonic()
+
+    @property
+    def nbytes(self) -> int:
+        if self.segment is None:
+            return 0
+        return sum(K.numel() * K.element_size() + V.numel() * V.element_size() for K, V in self.segment)
+
+    def split(self, at: int) -> "RadixNode":
+        '''
+        Splits the edge after its first `at` tokens; returns the new intermediate node.
+        '''
+        head = RadixNode(
+            self.tokens[:at],
+            [(K[:, :at].clone(), V[:, :at].clone()) for K, V in self.segment],
+            self.parent,
+        )
+        head.last_access = self.last_access
+        self.parent.children[self.tokens[0]] = head
+        self.tokens = self.tokens[at:]
+        self.segment = [(K[:, at:].clone(), V[:, at:].clone()) for K, V in self.segment]
+        self.parent = head
+        head.children[self.tokens[0]] = self
+        return head
+
+
+class PrefixCache:
+    '''
+    Maps token-id prefixes to the KV caches (as returned by DecoderOnlyTransformer or GPT with
+    use_cache=True) computed for them, for a single batch row.
+
+    A cache must only be used with the model that filled it, and only for prefixes that start at
+    position 0. When byte_budget is set, the least recently used leaves are evicted until the
+    stored keys and values fit in it.
+    '''
+
+    def __init__(self, byte_budget: Optional[int] = None):
+        self.byte_budget = byte_budget
+        self.root = RadixNode()
+        self.nbytes = 0
+        self.lookups = 0
+        self.hits = 0
+        self.requested_tokens = 0
+        self.matched_tokens = 0
+        self.evictions = 0
+
+    def match(self, token_ids: Sequence[int]) -> Tuple[int, Optional[List[KVCache]]]:
+        '''
+        Finds the longest cached prefix of token_ids.
+
+        Return: (number of matched tokens, their KV cache), or (0, None) if nothing matches
+        '''
+        self.lookups += 1
+        self.requested_tokens += len(token_ids)
+        node, matched, segments = self.root, 0, []
+        now = time.monotonic()
+        while matched < len(token_ids) and token_ids[matched] in node.children:
+            child = node.children[token_ids[matched]]
+            common = _common_length(child.tokens, token_ids[matched:])
+            child.last_access = now
+            if common < len(child.tokens):
+                segments.append([(K[:, :common], V[:, :common]) for K, V in child.segment])
+            else:
+                segments.append(child.segment)
+            matched += common
+            if common < len(child.tokens):
+                break
+            node = child
+
+        if matched == 0:
+            return 0, None
+        self.hits += 1
+        self.matched_tokens += matched
+        past_key_values = [
+            (t.cat([segment[layer][0] for segment in segments], dim=1), t.cat([segment[layer][1] for segment in segments], dim=1))
+            for layer in range(len(segments[0]))
+        ]
+        return matched, past_key_values
+
+    def insert(self, token_ids: Sequence[int], past_key_values: List[KVCache]) -> None:
+        '''
+        Stores the keys and values of token_ids; past_key_values must cover exactly those positions
+        (batch size 1).
+        '''
+        assert past_key_values[0][0].shape[:2] == (1, len(token_ids)), "Cache must match token_ids"
+        node, matched = self.root, 0
+        now = time.monotonic()
+        while matched < len(token_ids):
+            child = node.children.get(token_ids[matched])
+            if child is None:
+                segment = [(K[:, matched:].clone(), V[:, matched:].clone()) for K, V in past_key_values]
+                leaf = RadixNode(tuple(token_ids[matched:]), segment, node)
+                node.children[leaf.tokens[0]] = leaf
+                self.nbytes += leaf.nbytes
+                break
+            common = _common_length(child.tokens, token_ids[matched:])
+            if common < len(child.tokens):
+                child = child.split(common)
+            child.last_access = now
+            node = child
+            matched += common
+        self._evict()
+
+    def _evict(self) -> None:
+        if self.byte_budget is None:
+            return
+        while self.nbytes > self.byte_budget:
+            leaves = [node for node in self._nodes() if not node.children and node is not self.root]
+            if not leaves:
+                return
+            oldest = min(leaves, key=lambda node: node.last_access)
+            del oldest.parent.children[oldest.tokens[0]]
+            self.nbytes -= oldest.nbytes
+            self.evictions += 1
+
+    def _nodes(self):
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(node.children.values())
+
+    def stats(self) -> dict:
+        return {
+            "nodes": sum(1 for _ in self._nodes()) - 1,
+            "nbytes": self.nbytes,
+            "byte_budget": self.byte_budget,
+            "lookups": self.lookups,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            "token_hit_rate": self.matched_tokens / self.requested_tokens if self.requested_tokens else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+def _common_length(a: Sequence[int], b: Sequence[int]) -> int:
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
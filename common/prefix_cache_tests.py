@@ -0,0 +1,63 @@
+import unittest
+
+import torch as t
+
+import sample_methods as s
+from gpt_modules import GPT
+from kv_cache_tests import IdTokenizer
+from prefix_cache import PrefixCache
+from transformer_modules import DecoderOnlyTransformer, TransformerConfig
+
+
+class TestPrefixCache(unittest.TestCase):
+    def setUp(self):
+        t.manual_seed(0)
+        self.config = TransformerConfig(
+            num_layers=2, num_heads=4, vocab_size=50, hidden_size=32, max_seq_len=24, dropout=0.1
+        )
+
+    def kv(self, model, ids):
+        with t.inference_mode():
+            return model(t.tensor([ids]), use_cache=True)[1]
+
+    def test_longest_prefix_match(self):
+        for model in [DecoderOnlyTransformer(self.config).eval(), GPT(self.config).eval()]:
+            cache = PrefixCache()
+            cache.insert([1, 2, 3, 4], self.kv(model, [1, 2, 3, 4]))
+            cache.insert([1, 2, 5], self.kv(model, [1, 2, 5]))  # splits the first edge after [1, 2]
+
+            matched, past = cache.match([1, 2, 3, 9])
+            self.assertEqual(matched, 3)
+            expected = self.kv(model, [1, 2, 3])
+            for (K, V), (K_expected, V_expected) in zip(past, expected):
+                t.testing.assert_close(K, K_expected)
+                t.testing.assert_close(V, V_expected)
+            self.assertEqual(cache.match([1, 2, 5, 6])[0], 3)
+            self.assertEqual(cache.match([7])[0], 0)
+            self.assertEqual(cache.stats()["nodes"], 3)
+
+    def test_lru_eviction(self):
+        model = DecoderOnlyTransformer(self.config).eval()
+        cache = PrefixCache()
+        cache.insert([1, 2], self.kv(model, [1, 2]))
+        two_tokens = cache.nbytes
+        cache.byte_budget = 2 * two_tokens
+        cache.insert([3, 4], self.kv(model, [3, 4]))
+        cache.match([1, 2])
+        cache.insert([5, 6], self.kv(model, [5, 6]))
+        self.assertEqual(cache.match([3, 4])[0], 0)
+        self.assertEqual(cache.match([1, 2])[0], 2)
+        self.assertLessEqual(cache.nbytes, cache.byte_budget)
+
+    def test_sample_tokens_with_prefix_cache(self):
+        model = DecoderOnlyTransformer(self.config)
+        tokenizer = IdTokenizer(model_max_length=16)
+        cache = PrefixCache()
+        for prompt in ["1 2 3 4 5", "1 2 3 4 6", "1 2 3 4 6"]:
+            expected = s.sample_tokens(model, tokenizer, prompt, 8, temperature=0)
+            self.assertEqual(s.sample_tokens(model, tokenizer, prompt, 8, prefix_cache=cache, temperature=0), expected)
+        self.assertAlmostEqual(cache.stats()["hit_rate"], 2 / 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
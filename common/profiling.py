@@ -0,0 +1,278 @@
+"""
+Per-module profiling: wall time, call counts, FLOPs and allocated bytes for every submodule of a
+model, forward and backward, reported as a DataFrame or a Chrome trace (chrome://tracing or
+https://ui.perfetto.dev).
+
+    with ModuleProfiler(model, include=["decoders.*.attn", "decoders.*.mlp"]) as profiler:
+        model(x, targets=y).backward()
+    profiler.report()
+    profiler.export_chrome_trace("trace.json")
+
+Hooks only exist inside the `with` block, so a model that isn't being profiled runs exactly as
+before. Counting FLOPs and bytes intercepts every aten op, which inflates the times of small
+modules; pass count_ops=False for cleaner timings.
+"""
+import fnmatch
+import json
+import time
+import warnings
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence
+
+import pandas as pd
+import torch as t
+from torch import nn
+from torch.utils._python_dispatch import TorchDispatchMode
+from torch.utils._pytree import tree_flatten
+from torch.utils.flop_counter import flop_registry
+
+COLUMNS = [
+    "type", "calls", "forward_ms", "backward_calls", "backward_ms", "total_ms", "self_ms", "percent",
+    "gflops", "gflops_per_sec", "allocated_mb",
+]
+
+
+class _OpCounter(TorchDispatchMode):
+    '''
+    Attributes the FLOPs and newly allocated output bytes of every aten op to the modules
+    currently running.
+    '''
+
+    def __init__(self, profiler: "ModuleProfiler"):
+        super().__init__()
+        self.profiler = profiler
+
+    def __torch_dispatch__(self, func, types, args=(), kwargs=None):
+        kwargs = kwargs or {}
+        out = func(*args, **kwargs)
+        if self.profiler.recording:
+            flops = 0
+            if func.overloadpacket in flop_registry:
+                flops = flop_registry[func.overloadpacket](*args, **kwargs, out_val=out)
+            # outputs that alias an input (views, in-place ops) allocate nothing
+            outputs = [] if any(r.alias_info is not None for r in func._schema.returns) else tree_flatten(out)[0]
+            nbytes = sum(o.untyped_storage().nbytes() for o in outputs if isinstance(o, t.Tensor))
+            # the model itself is credited with everything, including the loss's backward, which
+            # runs after its own backward hooks have fired
+            for name in set(self.profiler.active) | {self.profiler.root_name}:
+                self.profiler.flops[name] += flops
+                self.profiler.allocated[name] += nbytes
+        return out
+
+
+class ModuleProfiler:
+    '''
+    Records, for each selected submodule of model (named as in model.named_modules(), the model
+    itself as its class name):
+
+        calls, forward_ms           forward calls and their total wall time
+        backward_calls, backward_ms the same for the module's backward, between its full backward
+                                    hooks (the weight gradients of modules whose inputs don't
+                                    require grad, e.g. embeddings, fall outside it)
+        self_ms                     total time minus the time of selected submodules
+        gflops, allocated_mb        aten-op FLOPs (matmuls and convolutions, as counted by
+                                    torch.utils.flop_counter) and bytes of newly allocated tensors,
+                                    forward and backward, if count_ops
+
+    Times, FLOPs and bytes are inclusive of submodules.
+
+    include: fnmatch patterns of module names to profile, e.g. ["decoders.*.attn"]; the model
+        itself is always included so percentages have a total. Default: every module
+    enabled: if False, the profiler attaches nothing and records nothing
+    '''
+
+    def __init__(
+        self,
+        model: nn.Module,
+        include: Optional[Sequence[str]] = None,
+        count_ops: bool = True,
+        enabled: bool = True,
+    ):
+        self.model = model
+        self.root_name = type(model).__name__
+        self.modules = {
+            name or self.root_name: module
+            for name, module in model.named_modules()
+            if not name or include is None or any(fnmatch.fnmatchcase(name, pattern) for pattern in include)
+        }
+        self.count_ops = count_ops
+        self.enabled = enabled
+        self.synchronize = any(p.is_cuda for p in model.parameters())
+
+        self.flops: Dict[str, int] = defaultdict(int)
+        self.allocated: Dict[str, int] = defaultdict(int)
+        # Chrome trace events: (name, phase, start, end)
+        self.events: List[tuple] = []
+        # names of the modules running now, in the order they started
+        self.active: List[str] = []
+        self._starts: Dict[tuple, List[float]] = defaultdict(list)
+        self.recording = False
+        self._handles = []
+        self._op_counter = None
+        self._warnings = None
+        self._origin = None
+
+    def __enter__(self):
+        if not self.enabled:
+            return self
+        self._origin = self._origin or time.perf_counter()
+        self.recording = True
+        # expected for modules whose inputs don't require grad, e.g. the model itself
+        self._warnings = warnings.catch_warnings()
+        self._warnings.__enter__()
+        warnings.filterwarnings("ignore", message="Full backward hook is firing")
+        for name, module in self.modules.items():
+            self._handles += [
+                module.register_forward_pre_hook(self._start_hook(name, "forward")),
+                module.register_forward_hook(self._end_hook(name, "forward")),
+                module.register_full_backward_pre_hook(self._start_hook(name, "backward")),
+                module.register_full_backward_hook(self._end_hook(name, "backward")),
+            ]
+        if self.count_ops:
+            self._op_counter = _OpCounter(self)
+            self._op_counter.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        if not self.recording:
+            return
+        self.recording = False
+        if self._op_counter is not None:
+            self._op_counter.__exit__(*exc_info)
+            self._op_counter = None
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+        self.active = []
+        self._starts.clear()
+        self._warnings.__exit__(*exc_info)
+
+    def _now(self) -> float:
+        if self.synchronize:
+            t.cuda.synchronize()
+        return time.perf_counter()
+
+    def _start_hook(self, name: str, phase: str):
+        def hook(*_):
+            self.active.append(name)
+            self._starts[name, phase].append(self._now())
+
+        return hook
+
+    def _end_hook(self, name: str, phase: str):
+        def hook(*_):
+            end = self._now()
+            starts = self._starts[name, phase]
+            if not starts:
+                return
+            start = starts.pop()
+            # backward hooks don't always nest, so remove by name rather than popping
+            if name in self.active:
+                del self.active[len(self.active) - 1 - self.active[::-1].index(name)]
+            self.events.append((name, phase, start, end))
+
+        return hook
+
+    def spans(self) -> List[tuple]:
+        '''
+        Return: (name, phase, start, end) of every recorded module call. A backward span is
+        extended to the end of the last backward span of its submodules that started within it,
+        since a module's full backward hook can fire before its submodules' backward has run
+        (always, for modules whose inputs don't require grad).
+        '''
+        spans = sorted(self.events, key=lambda event: event[2])
+        backward = [span for span in spans if span[1] == "backward"]
+        extended = []
+        for name, phase, start, end in spans:
+            if phase == "backward":
+                prefix = "" if name == self.root_name else name + "."
+                next_start = min((s for n, _, s, _ in backward if n == name and s > start), default=float("inf"))
+                end = max(
+                    [end] + [e for n, _, s, e in backward if n != name and n.startswith(prefix) and start <= s < next_start]
+                )
+            extended.append((name, phase, start, end))
+        return extended
+
+    def report(self, sort_by: str = "total_ms", display_df: bool = False) -> Optional[pd.DataFrame]:
+        '''
+        display_df: bool
+            If true, displays a styled dataframe sorted by sort_by, shaded by total_ms
+            If false, returns the dataframe
+        '''
+        calls = {phase: defaultdict(int) for phase in ("forward", "backward")}
+        seconds = {phase: defaultdict(float) for phase in ("forward", "backward")}
+        for name, phase, start, end in self.spans():
+            calls[phase][name] += 1
+            seconds[phase][name] += end - start
+        names = [name for name in self.modules if calls["forward"][name] or calls["backward"][name]]
+
+        rows = []
+        for name in names:
+            total = seconds["forward"][name] + seconds["backward"][name]
+            rows.append({
+                "name": name,
+                "type": type(self.modules[name]).__name__,
+                "calls": calls["forward"][name],
+                "forward_ms": seconds["forward"][name] * 1e3,
+                "backward_calls": calls["backward"][name],
+                "backward_ms": seconds["backward"][name] * 1e3,
+                "total_ms": total * 1e3,
+                "gflops": self.flops[name] / 1e9,
+                "gflops_per_sec": self.flops[name] / 1e9 / total if total else 0.0,
+                "allocated_mb": self.allocated[name] / 2**20,
+            })
+        df = pd.DataFrame(rows, columns=["name"] + [c for c in COLUMNS if c not in ("self_ms", "percent")])
+        df = df.set_index("name")
+        children_ms = dict.fromkeys(names, 0.0)
+        for name in names:
+            parent = self._parent(name, names)
+            if parent is not None:
+                children_ms[parent] += df.loc[name, "total_ms"]
+        df["self_ms"] = [df.loc[name, "total_ms"] - children_ms[name] for name in names]
+        root_ms = df.loc[self.root_name, "total_ms"] if self.root_name in df.index else df["total_ms"].max()
+        df["percent"] = 100 * df["total_ms"] / root_ms if root_ms else 0.0
+        df = df[COLUMNS].sort_values(sort_by, ascending=False)
+        if not self.count_ops:
+            df = df.drop(columns=["gflops", "gflops_per_sec", "allocated_mb"])
+
+        if display_df:
+            from IPython.display import display
+
+            with pd.option_context("display.max_rows", 1000):
+                display(df.style.background_gradient(cmap="viridis", subset=["total_ms"]))
+        else:
+            return df
+
+    def _parent(self, name: str, names: List[str]) -> Optional[str]:
+        '''
+        The closest selected ancestor of name
+        '''
+        if name == self.root_name:
+            return None
+        parts = name.split(".")
+        for i in range(len(parts) - 1, 0, -1):
+            candidate = ".".join(parts[:i])
+            if candidate in names:
+                return candidate
+        return self.root_name if self.root_name in names else None
+
+    def export_chrome_trace(self, path: str) -> None:
+        '''
+        Writes one complete event per module call (forward and backward) in the Chrome trace
+        event format.
+        '''
+        events = [
+            {
+                "name": name,
+                "cat": phase,
+                "ph": "X",
+                "ts": (start - self._origin) * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": 0,
+                "tid": phase,
+                "args": {"type": type(self.modules[name]).__name__},
+            }
+            for name, phase, start, end in self.spans()
+        ]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
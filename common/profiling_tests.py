@@ -0,0 +1,77 @@
+import json
+import os
+import tempfile
+import unittest
+
+import torch as t
+from torch.utils.flop_counter import FlopCounterMode
+
+from profiling import ModuleProfiler
+from transformer_modules import DecoderOnlyTransformer, TransformerConfig
+
+
+class TestModuleProfiler(unittest.TestCase):
+    def setUp(self):
+        t.manual_seed(0)
+        config = TransformerConfig(num_layers=2, num_heads=2, vocab_size=50, hidden_size=32, max_seq_len=16)
+        self.model = DecoderOnlyTransformer(config)
+        x = t.randint(0, 50, (2, 9))
+        self.inputs, self.targets = x[:, :-1], x[:, 1:]
+
+    def train_step(self):
+        self.model(self.inputs, targets=self.targets).backward()
+
+    def test_report(self):
+        with ModuleProfiler(self.model, include=["decoders.*.attn", "decoders.*.mlp"]) as profiler:
+            self.train_step()
+            self.train_step()
+        report = profiler.report()
+        self.assertEqual(
+            set(report.index),
+            {"DecoderOnlyTransformer", "decoders.0.attn", "decoders.1.attn", "decoders.0.mlp", "decoders.1.mlp"},
+        )
+        self.assertTrue((report["calls"] == 2).all())
+        self.assertTrue((report["backward_calls"] == 2).all())
+        self.assertEqual(report.index[0], "DecoderOnlyTransformer")
+        self.assertTrue(report["total_ms"].is_monotonic_decreasing)
+        self.assertEqual(report.loc["decoders.0.attn", "type"], "MultiheadMaskedAttention")
+
+        flop_counter = FlopCounterMode(display=False)
+        with flop_counter:
+            self.train_step()
+        self.assertAlmostEqual(report.loc["DecoderOnlyTransformer", "gflops"], 2 * flop_counter.get_total_flops() / 1e9)
+        # the two MLP matmuls, forward and backward
+        mlp_flops = 3 * 2 * (2 * 8 * 32 * 128) * 2
+        self.assertAlmostEqual(report.loc["decoders.0.mlp", "gflops"], 2 * mlp_flops / 1e9)
+
+    def test_hooks_removed(self):
+        with ModuleProfiler(self.model):
+            self.train_step()
+        for module in self.model.modules():
+            self.assertFalse(module._forward_hooks or module._forward_pre_hooks or module._backward_hooks)
+
+    def test_disabled(self):
+        with ModuleProfiler(self.model, enabled=False) as profiler:
+            self.assertFalse(self.model.emb._forward_hooks)
+            self.train_step()
+        self.assertTrue(profiler.report().empty)
+
+    def test_chrome_trace(self):
+        with ModuleProfiler(self.model, count_ops=False) as profiler:
+            self.train_step()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "trace.json")
+            profiler.export_chrome_trace(path)
+            with open(path) as f:
+                events = json.load(f)["traceEvents"]
+        self.assertEqual({event["cat"] for event in events}, {"forward", "backward"})
+        root = [event for event in events if event["name"] == "DecoderOnlyTransformer" and event["cat"] == "forward"]
+        self.assertEqual(len(root), 1)
+        for event in events:
+            if event["cat"] == "forward":
+                self.assertGreaterEqual(event["ts"], root[0]["ts"])
+                self.assertLessEqual(event["ts"] + event["dur"], root[0]["ts"] + root[0]["dur"] + 1e-3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import pickle
+import unittest
+
+import torch as t
+
+from general_modules import Linear, QuantizedLinear, quantize_linear_layers
+from transformer_modules import DecoderOnlyTransformer, TransformerConfig
+from utils import quantization_report
+
+
+class TestQuantization(unittest.TestCase):
+    def setUp(self):
+        t.manual_seed(0)
+        config = TransformerConfig(num_layers=2, num_heads=2, vocab_size=50, hidden_size=32, max_seq_len=16)
+        self.model = DecoderOnlyTransformer(config).eval()
+        self.input_ids = t.randint(0, 50, (2, 16))
+
+    def test_linear_close_to_float(self):
+        linear = Linear(32, 16)
+        quantized = QuantizedLinear.from_float(linear)
+        x = t.randn(3, 5, 32)
+        expected = linear(x)
+        t.testing.assert_close(quantized(x), expected, atol=0.05 * expected.abs().max().item(), rtol=0)
+
+    def test_replaces_every_linear(self):
+        quantized = quantize_linear_layers(self.model)
+        self.assertFalse(any(isinstance(m, (Linear, t.nn.Linear)) for m in quantized.modules()))
+        self.assertTrue(any(isinstance(m, (Linear, t.nn.Linear)) for m in self.model.modules()))
+        with t.inference_mode():
+            logits, quantized_logits = self.model(self.input_ids), quantized(self.input_ids)
+        agreement = (logits.argmax(-1) == quantized_logits.argmax(-1)).float().mean()
+        self.assertGreater(agreement, 0.8)
+
+    def test_pickle_round_trip(self):
+        quantized = quantize_linear_layers(self.model)
+        with t.inference_mode():
+            expected = quantized(self.input_ids)
+            t.testing.assert_close(pickle.loads(pickle.dumps(quantized))(self.input_ids), expected)
+
+    def test_report(self):
+        report = quantization_report(self.model, quantize_linear_layers(self.model), self.input_ids, repeats=1)
+        self.assertEqual(list(report.index), ["float", "quantized"])
+        self.assertEqual(report.loc["float", "top1_agreement"], 1.0)
+        self.assertGreater(report.loc["quantized", "memory_saving"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
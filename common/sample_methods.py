@@ -1,3 +1,9 @@
+import inspect
+import threading
+import time
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple, Union
+
 import torch as t
 import torch.nn.functional as F
 
@@ -100,31 +106,810 @@ x
         return sample_top_p(logits, top_p)
     return sample_basic(logits)
 
+def _per_row(value, batch_size: int, dtype, device=None) -> t.Tensor:
+    '''
+    Broadcasts a scalar, list or tensor sampling parameter to a tensor of shape (batch_size, ).
+    '''
+    value = t.as_tensor(value, dtype=dtype, device=device)
+    if value.ndim == 0:
+        value = value.expand(batch_size)
+    assert value.shape == (batch_size,), f"Expected one value per row, got shape {tuple(value.shape)}"
+    return value.clone()
+
+
+def _gather_indices(indices: Optional[t.Tensor], selected: t.Tensor) -> t.Tensor:
+    '''
+    Maps column positions selected from a set of candidates back to vocabulary ids.
+    '''
+    return selected if indices is None else indices.gather(-1, selected)
+
+
+class LogitsProcessor:
+    '''
+    One step of the batched sampling pipeline.
+
+    Processors are called with logits of shape (batch, n) and `indices`, the vocabulary ids of
+    those n columns, of the same shape (or None when the columns are the whole vocabulary, in
+    order). They return a new (logits, indices) pair: truncating processors (greedy, top-k, top-p)
+    may narrow the columns down to the surviving candidates, so that later processors and the
+    sampler only touch those.
+
+    Per-row parameters and state are tensors whose first dimension is the batch; their attribute
+    names are listed in `row_state` so that rows can be dropped or appended as sequences finish or
+    join the batch.
+    '''
+    row_state: Tuple[str, ...] = ()
+
+    def __call__(
+        self, logits: t.Tensor, indices: Optional[t.Tensor] = None
+    ) -> Tuple[t.Tensor, Optional[t.Tensor]]:
+        raise NotImplementedError
+
+    def append_tokens(self, new_tokens: t.Tensor) -> None:
+        '''
+        new_tokens: shape (batch, ) - the token just sampled for each row
+        '''
+        pass
+
+    def select_rows(self, rows: t.Tensor) -> None:
+        '''
+        Keeps only the given rows (e.g. when finished sequences leave the batch).
+        '''
+        for name in self.row_state:
+            setattr(self, name, getattr(self, name)[rows])
+
+    def extend(self, other: "LogitsProcessor") -> None:
+        '''
+        Appends the rows of another processor of the same type (e.g. when new sequences join the batch).
+        '''
+        for name in self.row_state:
+            setattr(self, name, t.cat([getattr(self, name), getattr(other, name)]))
+
+
+class GreedyProcessor(LogitsProcessor):
+    '''
+    Rows with temperature 0 keep only their most likely token, so sampling them is greedy search.
+    '''
+    row_state = ("greedy",)
+
+    def __init__(self, greedy: t.Tensor):
+        self.greedy = greedy
+
+    def __call__(self, logits, indices=None):
+        if not self.greedy.any():
+            return logits, indices
+        top = logits.argmax(dim=-1, keepdim=True)
+        if self.greedy.all():
+            return logits.gather(-1, top), _gather_indices(indices, top)
+        only_top = t.full_like(logits, float("-inf")).scatter(-1, top, logits.gather(-1, top))
+        return t.where(self.greedy[:, None], only_top, logits), indices
+
+
+class TemperatureProcessor(LogitsProcessor):
+    row_state = ("temperature",)
+
+    def __init__(self, temperature: t.Tensor):
+        self.temperature = temperature
+
+    def __call__(self, logits, indices=None):
+        # greedy rows have temperature 0 and are handled by GreedyProcessor
+        temperature = t.where(self.temperature > 0, self.temperature, t.ones_like(self.temperature))
+        return logits / temperature[:, None], indices
+
+
+class FreqPenaltyProcessor(LogitsProcessor):
+    '''
+    Subtracts freq_penalty times the number of occurrences of each token in the row so far.
+
+    The counts are built once from the prompts and then updated in place as tokens are appended,
+    instead of recounting the whole sequence at every step.
+    '''
+    row_state = ("freq_penalty", "counts")
+
+    def __init__(self, input_ids: List[list], freq_penalty: t.Tensor, vocab_size: int):
+        self.freq_penalty = freq_penalty
+        self.counts = t.zeros((len(input_ids), vocab_size), device=freq_penalty.device)
+        for row, ids in enumerate(input_ids):
+            ids = t.as_tensor(ids, dtype=t.int64, device=freq_penalty.device)
+            self.counts[row].scatter_add_(0, ids, t.ones_like(ids, dtype=self.counts.dtype))
+
+    def __call__(self, logits, indices=None):
+        counts = self.counts if indices is None else self.counts.gather(-1, indices)
+        return logits - counts * self.freq_penalty[:, None], indices
+
+    def append_tokens(self, new_tokens: t.Tensor) -> None:
+        self.counts.scatter_add_(1, new_tokens[:, None], t.ones_like(new_tokens[:, None], dtype=self.counts.dtype))
+
+
+class TopKProcessor(LogitsProcessor):
+    '''
+    Keeps the top_k most likely tokens of each row; rows with top_k 0 are left unchanged.
+    '''
+    row_state = ("top_k",)
+
+    def __init__(self, top_k: t.Tensor):
+        self.top_k = top_k
+
+    def __call__(self, logits, indices=None):
+        max_k = min(int(self.top_k.max()), logits.shape[-1])
+        if max_k == 0:
+            return logits, indices
+        # a single partial selection for the largest k; rows with a smaller k drop the rest
+        top_values, top = logits.topk(max_k, dim=-1)
+        beyond_k = t.arange(max_k, device=logits.device) >= self.top_k[:, None]
+        if (self.top_k > 0).all():
+            return top_values.masked_fill(beyond_k, float("-inf")), _gather_indices(indices, top)
+        threshold = top_values.gather(-1, (self.top_k.clamp(1, max_k) - 1)[:, None])
+        filtered = logits.masked_fill(logits < threshold, float("-inf"))
+        return t.where((self.top_k > 0)[:, None], filtered, logits), indices
+
+
+class TopPProcessor(LogitsProcessor):
+    '''
+    Keeps the smallest set of most likely tokens whose probabilities add up to at least top_p;
+    rows with top_p 0 (or 1) are left unchanged.
+
+    Instead of sorting all the columns, only the `candidates` most likely tokens are selected,
+    and the selection is widened only if some row needs more than that to reach its top_p.
+    '''
+    row_state = ("top_p",)
+
+    def __init__(self, top_p: t.Tensor, candidates: int = 256, min_tokens_to_keep: int = 1):
+        self.top_p = top_p
+        self.candidates = candidates
+        self.min_tokens_to_keep = min_tokens_to_keep
+
+    def __call__(self, logits, indices=None):
+        active = (self.top_p > 0) & (self.top_p < 1)
+        if not active.any():
+            return logits, indices
+        width = logits.shape[-1]
+        log_probs = logits.log_softmax(dim=-1)
+        k = min(self.candidates, width)
+        while True:
+            top_log_probs, top = log_probs.topk(k, dim=-1)
+            top_probs = top_log_probs.exp()
+            cumulative = top_probs.cumsum(dim=-1)
+            if k == width or (cumulative[active, -1] >= self.top_p[active]).all():
+                break
+            k = min(4 * k, width)
+
+        # keep each token whose preceding cumulative probability is still below top_p
+        keep = (cumulative - top_probs) < self.top_p[:, None]
+        keep[:, : self.min_tokens_to_keep] = True
+        if active.all():
+            num_kept = int(keep.sum(dim=-1).max())
+            kept_logits = logits.gather(-1, top[:, :num_kept]).masked_fill(~keep[:, :num_kept], float("-inf"))
+            return kept_logits, _gather_indices(indices, top[:, :num_kept])
+        kept_logits = logits.gather(-1, top).masked_fill(~keep, float("-inf"))
+        filtered = t.full_like(logits, float("-inf")).scatter(-1, top, kept_logits)
+        return t.where(active[:, None], filtered, logits), indices
+
+
+class LogitsProcessorList(list):
+    '''
+    A chain of LogitsProcessors, applied in order.
+    '''
+
+    def __call__(
+        self, logits: t.Tensor, indices: Optional[t.Tensor] = None
+    ) -> Tuple[t.Tensor, Optional[t.Tensor]]:
+        for processor in self:
+            logits, indices = processor(logits, indices)
+        return logits, indices
+
+    def append_tokens(self, new_tokens: t.Tensor) -> None:
+        for processor in self:
+            processor.append_tokens(new_tokens)
+
+    def select_rows(self, rows: t.Tensor) -> None:
+        for processor in self:
+            processor.select_rows(rows)
+
+    def extend_rows(self, other: "LogitsProcessorList") -> None:
+        assert [type(p) for p in self] == [type(p) for p in other], "Processor chains must match"
+        for processor, other_processor in zip(self, other):
+            processor.extend(other_processor)
+
+
+def make_logits_processors(
+    input_ids: List[list],
+    vocab_size: int,
+    temperature=1.0,
+    freq_penalty=0.0,
+    top_k=0,
+    top_p=0.0,
+    device=None,
+    all_processors: bool = False,
+) -> LogitsProcessorList:
+    '''
+    Builds the sampling pipeline for a batch of sequences. Each sampling parameter is either a
+    single value for all rows or one value per row; unlike apply_sampling_methods, top-k and top-p
+    may be combined (top-k is applied first).
+
+    input_ids: the token ids of each row so far, used to initialise the frequency penalty counts
+    all_processors: include processors even when no row uses them, so that chains built for
+        different requests can be merged with extend_rows
+
+    Return: a LogitsProcessorList, whose output should be sampled with sample_from_logits
+    '''
+    batch_size = len(input_ids)
+    temperature = _per_row(temperature, batch_size, t.float32, device)
+    freq_penalty = _per_row(freq_penalty, batch_size, t.float32, device)
+    top_k = _per_row(top_k, batch_size, t.int64, device)
+    top_p = _per_row(top_p, batch_size, t.float32, device)
+    assert (temperature >= 0).all(), "Temperature should be non-negative"
+    assert ((0 <= top_p) & (top_p <= 1.0)).all(), "Top-p must be a probability"
+    assert (0 <= top_k).all(), "Top-k must be non-negative"
+
+    processors = LogitsProcessorList()
+    if all_processors or (temperature == 0).any():
+        processors.append(GreedyProcessor(temperature == 0))
+    if all_processors or (temperature != 1.0).any():
+        processors.append(TemperatureProcessor(temperature))
+    if all_processors or (freq_penalty != 0.0).any():
+        processors.append(FreqPenaltyProcessor(input_ids, freq_penalty, vocab_size))
+    if all_processors or (top_k > 0).any():
+        processors.append(TopKProcessor(top_k))
+    if all_processors or (top_p > 0).any():
+        processors.append(TopPProcessor(top_p))
+    return processors
+
+
+def scatter_candidates(logits: t.Tensor, indices: Optional[t.Tensor], vocab_size: int) -> t.Tensor:
+    '''
+    Expands the (logits, indices) output of a LogitsProcessorList back to shape (batch, vocab_size),
+    with -inf for every token that is not a candidate.
+    '''
+    if indices is None:
+        return logits
+    full = t.full((logits.shape[0], vocab_size), float("-inf"), dtype=logits.dtype, device=logits.device)
+    return full.scatter(-1, indices, logits)
+
+
+def sample_from_logits(logits: t.Tensor, indices: Optional[t.Tensor] = None) -> t.Tensor:
+    '''
+    logits: shape (batch, n) - processed logits, possibly containing -inf
+    indices: shape (batch, n) - vocabulary ids of the columns of logits, or None for the whole vocabulary
+
+    Return: shape (batch, ) - one sampled token per row
+    '''
+    # inverse transform sampling: one uniform number per row rather than one per column
+    cumulative = logits.softmax(dim=-1).cumsum(dim=-1)
+    total = cumulative[:, -1:]
+    u = t.minimum(t.rand_like(total) * total, t.nextafter(total, t.zeros_like(total)))
+    choice = t.searchsorted(cumulative, u, right=True)
+    return _gather_indices(indices, choice).squeeze(-1)
+
+
+def sample_next_tokens(logits: t.Tensor, processors: LogitsProcessorList) -> t.Tensor:
+    '''
+    Runs logits of shape (batch, vocab_size) through the processors, samples one token per row and
+    records the sampled tokens in the processors' running state. Logits are processed in float32
+    whatever the model's dtype.
+
+    Return: shape (batch, )
+    '''
+    new_tokens = sample_from_logits(*processors(logits.float()))
+    processors.append_tokens(new_tokens)
+    return new_tokens
+
+
+def model_device(model) -> t.device:
+    '''
+    Return the device of model's parameters, or the CPU for a model without any (e.g. an
+    onnx_export.OnnxModel, which runs outside of PyTorch).
+    '''
+    parameter = next(model.parameters(), None)
+    return t.device("cpu") if parameter is None else parameter.device
+
+
+def supports_kv_cache(model) -> bool:
+    '''
+    Return True if model.forward accepts the past_key_values/use_cache arguments of
+    DecoderOnlyTransformer and GPT, and the model wasn't built without them (an
+    onnx_export.OnnxModel exported with with_past=False).
+    '''
+    if not getattr(model, "with_past", True):
+        return False
+    return "past_key_values" in inspect.signature(model.forward).parameters
+
+
+def _uncached_logits(model, input_ids: t.Tensor) -> t.Tensor:
+    '''
+    Runs model on input_ids without a KV cache; models that take only_last (DecoderOnlyTransformer,
+    GPT, OnnxModel) project just the last position onto the vocabulary.
+
+    Return: logits, shape (batch, seq or 1, vocab_size), of which callers use the last position
+    '''
+    if "only_last" in inspect.signature(model.forward).parameters:
+        return model(input_ids, only_last=True)
+    output = model(input_ids)
+    return output if isinstance(output, t.Tensor) else output.logits
+
+
+def _generate_token_ids(
+    model,
+    tokenizer,
+    input_ids: list,
+    max_tokens_generated: int,
+    use_cache: bool = True,
+    stop_event: Optional[threading.Event] = None,
+    prefix_cache=None,
+    **kwargs
+) -> Iterator[int]:
+    '''
+    Yields sampled token ids one at a time; the shared loop behind sample_tokens and stream_tokens.
+
+    Inference mode is only entered around each step, so that it does not leak into the caller's
+    code while the generator is suspended.
+
+    prefix_cache: a prefix_cache.PrefixCache filled by the same model; the prompt's longest cached
+        prefix is reused and only the rest of the prompt is run through the model, after which
+        the prompt's keys and values are added to the cache
+    '''
+    model.eval()
+    generated = []
+    device = model_device(model)
+    use_cache = use_cache and supports_kv_cache(model)
+    use_prefix_cache = (
+        prefix_cache is not None and use_cache and len(input_ids) <= tokenizer.model_max_length
+    )
+    past_key_values = None
+    processors = None
+    for _ in range(max_tokens_generated):
+        if stop_event is not None and stop_event.is_set():
+            return
+        with t.inference_mode():
+            new_input_ids = t.tensor(input_ids + generated, dtype=t.int64, device=device)
+            window = min(tokenizer.model_max_length, new_input_ids.shape[0])
+            if use_cache:
+                if past_key_values is not None and past_key_values[0][0].shape[1] < window:
+                    # only the last token is new; everything before it is in the cache
+                    model_input = new_input_ids[-1:].unsqueeze(0)
+                elif use_prefix_cache and not generated:
+                    # reuse the longest cached prefix, but always run at least the last prompt token
+                    matched, past_key_values = prefix_cache.match(input_ids[:-1])
+                    model_input = new_input_ids[matched:].unsqueeze(0)
+                else:
+                    past_key_values = None
+                    model_input = new_input_ids[-window:].unsqueeze(0)
+                all_logits, past_key_values = model(
+                    model_input, past_key_values=past_key_values, use_cache=True, only_last=True
+                )
+                if use_prefix_cache and not generated:
+                    prefix_cache.insert(input_ids, past_key_values)
+            else:
+                new_input_ids_truncated = new_input_ids[-window:].unsqueeze(0)
+                all_logits = _uncached_logits(model, new_input_ids_truncated)
+            logits = all_logits[:, -1]
+            if processors is None:
+                processors = make_logits_processors([input_ids], logits.shape[-1], device=device, **kwargs)
+            new_token = int(sample_next_tokens(logits, processors)[0])
+        generated.append(new_token)
+        yield new_token
+        if new_token == getattr(tokenizer, "eos_token_id", None):
+            return
+
+
 def sample_tokens(
     model,
     tokenizer,
     initial_text: str,
     max_tokens_generated: int = 30,
+    use_cache: bool = True,
+    prefix_cache=None,
     **kwargs
 ) -> str:
     '''
     Sample tokens until the model outputs `tokenizer.eos_token_id` or the specified token limit is reached.
 
+    kwargs are the sampling parameters of make_logits_processors (temperature, freq_penalty, top_k, top_p).
+
+    If use_cache is True and the model supports it, keys and values of previous positions are
+    cached so that each step only runs the newly sampled token through the model. Once the
+    sequence no longer fits in `tokenizer.model_max_length`, the window slides and the cache is
+    rebuilt from the truncated window at each step, exactly as the uncached path would.
+
+    prefix_cache: optional prefix_cache.PrefixCache for this model, used to skip recomputing the
+        longest previously seen prefix of the prompt
+
     Return: the prompt and continuation concatenated
     '''
+    input_ids: list = tokenizer.encode(initial_text)
+    generated = list(
+        _generate_token_ids(
+            model, tokenizer, input_ids, max_tokens_generated, use_cache, prefix_cache=prefix_cache, **kwargs
+        )
+    )
+    return tokenizer.decode(input_ids + generated)
+
+
+def stream_tokens(
+    model,
+    tokenizer,
+    initial_text: str,
+    max_tokens_generated: int = 30,
+    use_cache: bool = True,
+    stop_event: Optional[threading.Event] = None,
+    prefix_cache=None,
+    **kwargs
+) -> Iterator[str]:
+    '''
+    Streaming version of sample_tokens: yields the decoded text of each token as soon as it is sampled.
+
+    Only the new token is decoded at each step, so the cost per step does not grow with the length
+    of the output. A byte-level tokenizer (bpe_tokenizer.BPETokenizer) can split a character's
+    UTF-8 bytes across tokens; such tokens are held back until the character is complete.
+    Generation stops early if stop_event is set (e.g. from another thread) or if the caller closes
+    the generator. prefix_cache is as in sample_tokens.
+
+    Return: an iterator over the pieces of the continuation (without the prompt)
+    '''
+    input_ids: list = tokenizer.encode(initial_text)
+    pending = []
+    for new_token in _generate_token_ids(
+        model, tokenizer, input_ids, max_tokens_generated, use_cache, stop_event, prefix_cache, **kwargs
+    ):
+        pending.append(new_token)
+        text = tokenizer.decode(pending)
+        # an incomplete character decodes as U+FFFD; a character is at most 4 bytes
+        if text.endswith("\ufffd") and len(pending) < 4:
+            continue
+        pending = []
+        yield text
+    if pending:
+        yield tokenizer.decode(pending)
+
+
+def left_pad(sequences: List[list], pad_token_id: int = 0, device=None) -> Tuple[t.Tensor, t.Tensor]:
+    '''
+    Left-pads token id lists to a common length, so that the last token of every row lines up.
+
+    Return: (input_ids, padding_mask), both of shape (batch, max_len); padding_mask is 1 for real
+    tokens and 0 for padding
+    '''
+    max_len = max(len(seq) for seq in sequences)
+    input_ids = t.full((len(sequences), max_len), pad_token_id, dtype=t.int64, device=device)
+    padding_mask = t.zeros((len(sequences), max_len), dtype=t.int64, device=device)
+    for row, seq in enumerate(sequences):
+        if len(seq) > 0:
+            input_ids[row, -len(seq):] = t.tensor(seq, dtype=t.int64, device=device)
+            padding_mask[row, -len(seq):] = 1
+    return input_ids, padding_mask
+
+
+def sample_tokens_batch(
+    model,
+    tokenizer,
+    prompts: List[str],
+    max_tokens_generated: Union[int, List[int]] = 30,
+    **kwargs
+) -> List[str]:
+    '''
+    Batched version of sample_tokens: generates a continuation for every prompt, advancing all
+    unfinished prompts with a single forward pass per step.
+
+    Prompts are left-padded to a common length, and the model is given a padding mask so that
+    no position attends to padding. A row leaves the batch (along with its cached keys and values)
+    as soon as it outputs `tokenizer.eos_token_id` or reaches its own token limit.
+
+    max_tokens_generated: either one limit for all prompts or one limit per prompt
+    kwargs: sampling parameters of make_logits_processors, each either one value or one per prompt
+
+    Return: one string per prompt, each the prompt and its continuation concatenated
+    '''
+    if isinstance(max_tokens_generated, int):
+        max_tokens_generated = [max_tokens_generated] * len(prompts)
+    assert len(max_tokens_generated) == len(prompts), "Need one max_tokens_generated per prompt"
+
+    if not supports_kv_cache(model):
+        return [
+            sample_tokens(model, tokenizer, prompt, max_tokens, **kwargs)
+            for prompt, max_tokens in zip(prompts, max_tokens_generated)
+        ]
+
     model.eval()
+    device = model_device(model)
+    eos_token_id = getattr(tokenizer, "eos_token_id", None)
+    sequences = [tokenizer.encode(prompt) for prompt in prompts]
+    num_generated = [0] * len(prompts)
+    # indices into prompts of the rows currently in the batch
+    active = [i for i in range(len(prompts)) if max_tokens_generated[i] > 0]
+    past_key_values = None
+    processors = None
+
+    with t.inference_mode():
+        while active:
+            if past_key_values is None or past_key_values[0][0].shape[1] >= tokenizer.model_max_length:
+                # (re)build the cache from each row's most recent window of tokens
+                windows = [sequences[i][-tokenizer.model_max_length:] for i in active]
+                input_ids, padding_mask = left_pad(windows, device=device)
+                past_key_values = None
+            else:
+                input_ids = t.tensor([[sequences[i][-1]] for i in active], dtype=t.int64, device=device)
+                padding_mask = t.cat([padding_mask, t.ones_like(padding_mask[:, :1])], dim=1)
+
+            all_logits, past_key_values = model(
+                input_ids,
+                past_key_values=past_key_values,
+                use_cache=True,
+                only_last=True,
+                padding_mask=padding_mask,
+            )
+
+            logits = all_logits[:, -1]
+            if processors is None:
+                processors = make_logits_processors(sequences, logits.shape[-1], device=device, **kwargs)
+                processors.select_rows(t.tensor(active, device=device))
+            new_tokens = sample_next_tokens(logits, processors).tolist()
+
+            keep = []
+            for row, (i, new_token) in enumerate(zip(active, new_tokens)):
+                sequences[i].append(new_token)
+                num_generated[i] += 1
+                if new_token != eos_token_id and num_generated[i] < max_tokens_generated[i]:
+                    keep.append(row)
+
+            if len(keep) < len(active):
+                active = [active[row] for row in keep]
+                if not active:
+                    break
+                keep = t.tensor(keep, device=device)
+                processors.select_rows(keep)
+                padding_mask = padding_mask[keep]
+                past_key_values = [(K[keep], V[keep]) for K, V in past_key_values]
+
+    return [tokenizer.decode(seq) for seq in sequences]
+
+
+def beam_search(
+    model,
+    tokenizer,
+    initial_text: str,
+    num_beams: int = 4,
+    max_new_tokens: int = 30,
+    length_penalty: float = 1.0,
+) -> str:
+    '''
+    Returns the highest-scoring continuation found by beam search.
+
+    All beams run as one batch through the model. After each step the surviving beams are chosen
+    from the top 2 * num_beams candidates, and their cached keys and values are reordered by
+    gathering on the beam index rather than recomputed. A hypothesis that outputs
+    `tokenizer.eos_token_id` is finished; only the num_beams best finished hypotheses are kept,
+    and the search stops as soon as no running beam can still beat the worst of them.
+
+    Hypotheses are scored by their summed log-probability divided by
+    (number of generated tokens) ** length_penalty, so length_penalty > 0 favours longer outputs.
+
+    Return: the prompt and best continuation concatenated
+    '''
+    if max_new_tokens < 0:
+        raise ValueError(f"max_new_tokens must be non-negative, got {max_new_tokens}")
+    model.eval()
+    device = model_device(model)
+    eos_token_id = getattr(tokenizer, "eos_token_id", None)
+    use_cache = supports_kv_cache(model)
     input_ids: list = tokenizer.encode(initial_text)
-    generated = []
-    device = next(model.parameters()).device
-    for _ in range(max_tokens_generated):
-        new_input_ids = t.tensor(input_ids + generated, dtype=t.int64, device=device)
-        new_input_ids_truncated = new_input_ids[-min(tokenizer.model_max_length, new_input_ids.shape[0]):].unsqueeze(0)
-        output = model(new_input_ids_truncated)
-        all_logits = output if isinstance(output, t.Tensor) else output.logits
-        logits = all_logits[0, -1]
-        new_token = apply_sampling_methods(new_input_ids, logits, **kwargs)
-        assert isinstance(new_token, int)
-        generated.append(new_token)
-        if new_token == getattr(tokenizer, "eos_token_id", None):
-            break
-    return tokenizer.decode(input_ids + generated)
\ No newline at end of file
+    if max_new_tokens == 0:
+        return tokenizer.decode(input_ids)
+
+    # running beams: token ids generated so far and their summed log-probabilities
+    beams = t.empty((1, 0), dtype=t.int64, device=device)
+    beam_scores = t.zeros(1, device=device)
+    # finished hypotheses as (score, generated token ids)
+    finished: List[Tuple[float, list]] = []
+    past_key_values = None
+    prompt = t.tensor(input_ids, dtype=t.int64, device=device)
+
+    with t.inference_mode():
+        for step in range(max_new_tokens):
+            sequences = t.cat([prompt.expand(beams.shape[0], -1), beams], dim=1)
+            window = min(tokenizer.model_max_length, sequences.shape[1])
+            if not use_cache:
+                all_logits = _uncached_logits(model, sequences[:, -window:])
+            else:
+                if past_key_values is not None and past_key_values[0][0].shape[1] < window:
+                    model_input = sequences[:, -1:]
+                else:
+                    past_key_values = None
+                    model_input = sequences[:, -window:]
+                all_logits, past_key_values = model(
+                    model_input, past_key_values=past_key_values, use_cache=True, only_last=True
+                )
+            log_probs = all_logits[:, -1].float().log_softmax(dim=-1)
+            vocab_size = log_probs.shape[-1]
+
+            # best 2 * num_beams continuations over all beams, so that enough remain after removing eos
+            candidate_scores = (beam_scores[:, None] + log_probs).flatten()
+            top_scores, top_positions = candidate_scores.topk(min(2 * num_beams, candidate_scores.shape[0]))
+            beam_indices = top_positions // vocab_size
+            tokens = top_positions % vocab_size
+
+            num_generated = step + 1
+            keep = []
+            for rank, (beam_index, token) in enumerate(zip(beam_indices.tolist(), tokens.tolist())):
+                if token == eos_token_id:
+                    hypothesis = beams[beam_index].tolist() + [token]
+                    score = top_scores[rank].item() / num_generated**length_penalty
+                    finished.append((score, hypothesis))
+                else:
+                    keep.append(rank)
+                if len(keep) == num_beams:
+                    break
+            finished = sorted(finished, key=lambda hypothesis: hypothesis[0], reverse=True)[:num_beams]
+
+            keep = t.tensor(keep, dtype=t.int64, device=device)
+            beam_indices = beam_indices[keep]
+            beams = t.cat([beams[beam_indices], tokens[keep, None]], dim=1)
+            beam_scores = top_scores[keep]
+            if past_key_values is not None:
+                past_key_values = [(K[beam_indices], V[beam_indices]) for K, V in past_key_values]
+
+            if len(finished) == num_beams:
+                # log-probabilities only decrease, so the best running beam's score is an upper
+                # bound once length_penalty no longer rewards extra tokens
+                best_running = beam_scores.max().item()
+                if length_penalty > 0:
+                    best_running /= max_new_tokens**length_penalty
+                else:
+                    best_running /= num_generated**length_penalty
+                if best_running <= finished[-1][0]:
+                    break
+
+    for score, beam in zip(beam_scores.tolist(), beams.tolist()):
+        finished.append((score / len(beam) ** length_penalty, beam))
+    best_score, best = max(finished, key=lambda hypothesis: hypothesis[0])
+    return tokenizer.decode(input_ids + best)
+
+
+@dataclass
+class SpeculativeStats:
+    '''
+    Counters from one run of speculative_sample_tokens.
+    '''
+    generated: int = 0
+    drafted: int = 0
+    accepted: int = 0
+    target_forwards: int = 0
+    draft_forwards: int = 0
+    seconds: float = 0.0
+
+    @property
+    def acceptance_rate(self) -> float:
+        '''Fraction of drafted tokens accepted by the target model.'''
+        return self.accepted / self.drafted if self.drafted else 0.0
+
+    @property
+    def tokens_per_target_forward(self) -> float:
+        '''Tokens generated per target forward pass (1.0 for ordinary sampling).'''
+        return self.generated / self.target_forwards if self.target_forwards else 0.0
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.generated / self.seconds if self.seconds else 0.0
+
+
+def _truncate_cache(past_key_values: Optional[List[Tuple[t.Tensor, t.Tensor]]], length: int):
+    '''
+    Drops the cached keys and values of every position from `length` onwards.
+    '''
+    if past_key_values is None:
+        return None
+    return [(K[:, :length], V[:, :length]) for K, V in past_key_values]
+
+
+def _processed_probs(logits: t.Tensor, **kwargs) -> t.Tensor:
+    '''
+    logits: shape (n, vocab_size)
+
+    Return: shape (n, vocab_size) - the probabilities that sample_tokens would sample from
+    '''
+    vocab_size = logits.shape[-1]
+    processors = make_logits_processors([[]] * logits.shape[0], vocab_size, device=logits.device, **kwargs)
+    return scatter_candidates(*processors(logits.float()), vocab_size).softmax(dim=-1)
+
+
+def speculative_sample_tokens(
+    model,
+    draft_model,
+    tokenizer,
+    initial_text: str,
+    max_tokens_generated: int = 30,
+    num_speculative_tokens: int = 4,
+    **kwargs
+) -> Tuple[str, SpeculativeStats]:
+    '''
+    Samples from `model` like sample_tokens, but uses a smaller `draft_model` (same vocabulary) to
+    propose num_speculative_tokens tokens at a time, which the target model then checks in a
+    single forward pass.
+
+    Each drafted token d is accepted with probability min(1, p(d) / q(d)), where p and q are the
+    target and draft distributions after temperature/top-k/top-p. At the first rejection a token is
+    sampled from the normalised residual max(0, p - q) instead, and if every draft is accepted a
+    bonus token is sampled from the target's next distribution. This makes the output distributed
+    exactly as if it had been sampled from the target model alone (greedy when temperature is 0).
+    The frequency penalty depends on every token before the one being sampled and is not supported.
+
+    Once the sequence fills `tokenizer.model_max_length`, the remaining tokens are sampled from the
+    target alone with a sliding window, as in sample_tokens.
+
+    Return: the prompt and continuation concatenated, and the run's SpeculativeStats
+    '''
+    assert kwargs.get("freq_penalty", 0.0) == 0.0, "Frequency penalty is not supported with speculative decoding"
+    assert supports_kv_cache(model) and supports_kv_cache(draft_model), "Both models need KV-cache support"
+    model.eval()
+    draft_model.eval()
+    device = model_device(model)
+    eos_token_id = getattr(tokenizer, "eos_token_id", None)
+    max_len = tokenizer.model_max_length
+    stats = SpeculativeStats()
+    start = time.perf_counter()
+
+    input_ids: list = tokenizer.encode(initial_text)
+    tokens = list(input_ids)
+    target_past, draft_past = None, None
+
+    with t.inference_mode():
+        while stats.generated < max_tokens_generated:
+            remaining = max_tokens_generated - stats.generated
+            k = max(0, min(num_speculative_tokens, remaining - 1, max_len - len(tokens)))
+
+            # draft k tokens autoregressively with the small model
+            drafted, draft_probs = [], []
+            for _ in range(k):
+                draft_len = 0 if draft_past is None else draft_past[0][0].shape[1]
+                draft_input = t.tensor([(tokens + drafted)[draft_len:]], dtype=t.int64, device=device)
+                draft_logits, draft_past = draft_model(
+                    draft_input, past_key_values=draft_past, use_cache=True, only_last=True
+                )
+                stats.draft_forwards += 1
+                q = _processed_probs(draft_logits[:, -1], **kwargs)
+                drafted.append(int(sample_from_logits(q.log())[0]))
+                draft_probs.append(q[0])
+
+            # score the pending tokens and all k drafts with one target forward pass
+            if len(tokens) > max_len:
+                # the window is full and slides every step, so the cache has to be rebuilt
+                target_past = None
+                pending = tokens[-max_len:]
+            else:
+                target_len = 0 if target_past is None else target_past[0][0].shape[1]
+                pending = tokens[target_len:] + drafted
+            target_logits, target_past = model(
+                t.tensor([pending], dtype=t.int64, device=device), past_key_values=target_past, use_cache=True
+            )
+            stats.target_forwards += 1
+            p = _processed_probs(target_logits[0, -(k + 1):], **kwargs)
+
+            new_tokens = []
+            for i, token in enumerate(drafted):
+                if t.rand(()).item() < min(1.0, (p[i, token] / draft_probs[i][token]).item()):
+                    new_tokens.append(token)
+                    continue
+                residual = (p[i] - draft_probs[i]).clamp(min=0)
+                if residual.sum() <= 0:
+                    residual = p[i]
+                new_tokens.append(int(sample_from_logits(residual[None].log())[0]))
+                break
+            else:
+                new_tokens.append(int(sample_from_logits(p[k][None].log())[0]))
+            stats.drafted += k
+            stats.accepted += len(new_tokens) - 1
+
+            # the caches hold every drafted token; keep only the accepted ones
+            accepted_len = len(tokens) + len(new_tokens) - 1
+            if len(tokens) <= max_len:
+                target_past = _truncate_cache(target_past, accepted_len)
+            draft_past = _truncate_cache(draft_past, accepted_len)
+
+            for token in new_tokens:
+                tokens.append(token)
+                stats.generated += 1
+                if token == eos_token_id:
+                    stats.seconds = time.perf_counter() - start
+                    return tokenizer.decode(tokens), stats
+
+    stats.seconds = time.perf_counter() - start
+    return tokenizer.decode(tokens), stats
@@ -0,0 +1,207 @@
+import threading
+import unittest
+from dataclasses import replace
+
+import torch as t
+from torch import nn
+
+import sample_methods as s
+from kv_cache_tests import IdTokenizer
+from transformer_modules import DecoderOnlyTransformer, TransformerConfig
+
+
+class NoCache(nn.Module):
+    """Hides the KV-cache arguments of the wrapped model, forcing the full-recompute path."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x):
+        return self.model(x)
+
+
+class TestSampleTokensBatch(unittest.TestCase):
+    def setUp(self):
+        t.manual_seed(0)
+        config = TransformerConfig(
+            num_layers=2, num_heads=4, vocab_size=50, hidden_size=32, max_seq_len=24, dropout=0.1
+        )
+        self.model = DecoderOnlyTransformer(config)
+
+    def test_left_pad(self):
+        input_ids, padding_mask = s.left_pad([[1, 2, 3], [4]])
+        t.testing.assert_close(input_ids, t.tensor([[1, 2, 3], [0, 0, 4]]))
+        t.testing.assert_close(padding_mask, t.tensor([[1, 1, 1], [0, 0, 1]]))
+
+    def test_matches_single_prompt_sampling(self):
+        tokenizer = IdTokenizer(model_max_length=8)
+        prompts = ["1 2 3 4 5", "6", "7 8 9"]
+        max_tokens = [10, 3, 6]
+        batched = s.sample_tokens_batch(self.model, tokenizer, prompts, max_tokens, temperature=0)
+        single = [
+            s.sample_tokens(self.model, tokenizer, prompt, max_tokens_generated=n, temperature=0)
+            for prompt, n in zip(prompts, max_tokens)
+        ]
+        self.assertEqual(batched, single)
+
+    def test_stops_at_eos(self):
+        tokenizer = IdTokenizer(model_max_length=16)
+        first = int(self.model.eval()(t.tensor([[1, 2]]))[0, -1].argmax())
+        tokenizer.eos_token_id = first
+        out = s.sample_tokens_batch(self.model, tokenizer, ["1 2", "3 4"], 5, temperature=0)
+        self.assertEqual(out[0], f"1 2 {first}")
+        self.assertLessEqual(len(out[1].split()), 7)
+
+
+class TestStreamTokens(unittest.TestCase):
+    def setUp(self):
+        t.manual_seed(0)
+        config = TransformerConfig(
+            num_layers=2, num_heads=4, vocab_size=50, hidden_size=32, max_seq_len=24, dropout=0.1
+        )
+        self.model = DecoderOnlyTransformer(config)
+        self.tokenizer = IdTokenizer(model_max_length=8)
+
+    def test_pieces_match_sample_tokens(self):
+        pieces = list(s.stream_tokens(self.model, self.tokenizer, "1 2 3", max_tokens_generated=10, temperature=0))
+        self.assertEqual(len(pieces), 10)
+        full = s.sample_tokens(self.model, self.tokenizer, "1 2 3", max_tokens_generated=10, temperature=0)
+        self.assertEqual(" ".join(["1 2 3"] + pieces), full)
+
+    def test_stop_event_cancels(self):
+        stop_event = threading.Event()
+        pieces = []
+        for piece in s.stream_tokens(self.model, self.tokenizer, "1 2 3", 10, stop_event=stop_event):
+            pieces.append(piece)
+            if len(pieces) == 3:
+                stop_event.set()
+        self.assertEqual(len(pieces), 3)
+
+
+class TestBeamSearch(unittest.TestCase):
+    def setUp(self):
+        t.manual_seed(0)
+        config = TransformerConfig(
+            num_layers=2, num_heads=4, vocab_size=50, hidden_size=32, max_seq_len=24, dropout=0.1
+        )
+        self.model = DecoderOnlyTransformer(config)
+        self.tokenizer = IdTokenizer(model_max_length=8)
+
+    def test_single_beam_is_greedy(self):
+        beam = s.beam_search(self.model, self.tokenizer, "1 2 3", num_beams=1, max_new_tokens=10)
+        greedy = s.sample_tokens(self.model, self.tokenizer, "1 2 3", max_tokens_generated=10, temperature=0)
+        self.assertEqual(beam, greedy)
+
+    def test_cache_matches_recompute(self):
+        cached = s.beam_search(self.model, self.tokenizer, "1 2 3", num_beams=4, max_new_tokens=10)
+        uncached = s.beam_search(NoCache(self.model), self.tokenizer, "1 2 3", num_beams=4, max_new_tokens=10)
+        self.assertEqual(cached, uncached)
+
+    def test_finishes_at_eos(self):
+        self.tokenizer.eos_token_id = 7
+        out = s.beam_search(self.model, self.tokenizer, "1 2 3", num_beams=4, max_new_tokens=10)
+        continuation = out.split()[3:]
+        self.assertTrue(len(continuation) == 10 or continuation[-1] == "7")
+
+    def test_no_new_tokens(self):
+        self.assertEqual(s.beam_search(self.model, self.tokenizer, "1 2 3", max_new_tokens=0), "1 2 3")
+        with self.assertRaises(ValueError):
+            s.beam_search(self.model, self.tokenizer, "1 2 3", max_new_tokens=-1)
+
+
+class TestSpeculativeSampling(unittest.TestCase):
+    def setUp(self):
+        t.manual_seed(0)
+        config = TransformerConfig(
+            num_layers=2, num_heads=4, vocab_size=6, hidden_size=32, max_seq_len=24, dropout=0.1
+        )
+        self.model = DecoderOnlyTransformer(config)
+        self.draft = DecoderOnlyTransformer(replace(config, num_layers=1, hidden_size=16))
+        self.tokenizer = IdTokenizer(model_max_length=8)
+
+    def test_greedy_matches_target(self):
+        out, stats = s.speculative_sample_tokens(
+            self.model, self.draft, self.tokenizer, "1 2 3", max_tokens_generated=10, temperature=0
+        )
+        expected = s.sample_tokens(self.model, self.tokenizer, "1 2 3", max_tokens_generated=10, temperature=0)
+        self.assertEqual(out, expected)
+        self.assertEqual(stats.generated, 10)
+        self.assertLessEqual(stats.target_forwards, 10)
+
+    def test_preserves_target_distribution(self):
+        # the first generated token is drafted and then accepted or resampled, and must still follow p
+        t.manual_seed(0)
+        counts = t.zeros(6)
+        prompt = "1 2"
+        for _ in range(1500):
+            out, _ = s.speculative_sample_tokens(
+                self.model, self.draft, self.tokenizer, prompt, max_tokens_generated=2, num_speculative_tokens=1
+            )
+            counts[int(out.split()[2])] += 1
+        with t.inference_mode():
+            expected = self.model.eval()(t.tensor([[1, 2]]))[0, -1].softmax(-1)
+        t.testing.assert_close(counts / counts.sum(), expected, atol=0.04, rtol=0)
+
+
+class TestLogitsProcessors(unittest.TestCase):
+    def setUp(self):
+        t.manual_seed(0)
+        self.logits = t.randn(4, 100) * 3
+
+    def kept(self, processed):
+        logits = s.scatter_candidates(*processed, 100)
+        return [set(row.isfinite().nonzero().flatten().tolist()) for row in logits]
+
+    def test_greedy(self):
+        tokens = s.sample_next_tokens(self.logits, s.make_logits_processors([[]] * 4, 100, temperature=0))
+        self.assertEqual(tokens.tolist(), self.logits.argmax(-1).tolist())
+
+        processors = s.make_logits_processors([[]] * 4, 100, temperature=[0, 0, 1, 1])
+        tokens = s.sample_next_tokens(self.logits, processors)
+        self.assertEqual(tokens[:2].tolist(), self.logits[:2].argmax(-1).tolist())
+
+    def test_top_k_per_row(self):
+        for top_k in [[1, 5, 0, 20], [1, 5, 3, 20]]:
+            kept = self.kept(s.make_logits_processors([[]] * 4, 100, top_k=top_k)(self.logits))
+            for row, k in enumerate(top_k):
+                expected = set(self.logits[row].topk(k).indices.tolist()) if k else set(range(100))
+                self.assertEqual(kept[row], expected)
+
+    def test_sampling_respects_candidates(self):
+        processors = s.make_logits_processors([[]] * 4, 100, temperature=[0, 1, 1, 1], top_k=[0, 3, 3, 3])
+        allowed = self.kept(processors(self.logits))
+        for _ in range(20):
+            tokens = s.sample_from_logits(*processors(self.logits))
+            for row, token in enumerate(tokens.tolist()):
+                self.assertIn(token, allowed[row])
+
+    def test_top_p_matches_full_sort(self):
+        for top_p in [[0.1, 0.5, 0.9, 0.0], [0.1, 0.5, 0.9, 0.95]]:
+            processors = s.make_logits_processors([[]] * 4, 100, top_p=top_p)
+            processors[0].candidates = 4  # force the selection to be widened
+            self.check_top_p(top_p, self.kept(processors(self.logits)))
+
+    def check_top_p(self, top_p, kept):
+        for row, p in enumerate(top_p):
+            if p == 0:
+                self.assertEqual(kept[row], set(range(100)))
+                continue
+            sorted_logits, indices = self.logits[row].sort(descending=True)
+            cumulative = sorted_logits.softmax(-1).cumsum(-1)
+            count = t.searchsorted(cumulative, p, right=False).item() + 1
+            self.assertEqual(kept[row], set(indices[:count].tolist()))
+
+    def test_freq_penalty_counts_are_incremental(self):
+        input_ids = [[1, 1, 2], [3], [], [4, 4, 4]]
+        processors = s.make_logits_processors(input_ids, 100, freq_penalty=0.5)
+        processors.append_tokens(t.tensor([2, 3, 5, 4]))
+        processors.select_rows(t.tensor([0, 3]))
+        out, _ = processors(self.logits[[0, 3]])
+        for row, ids in enumerate([[1, 1, 2, 2], [4, 4, 4, 4]]):
+            expected = s.apply_freq_penalty(t.tensor(ids), self.logits[[0, 3]][row], 0.5)
+            t.testing.assert_close(out[row], expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
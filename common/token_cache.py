@@ -0,0 +1,227 @@
+"""
+Pre-tokenized corpora: token ids in a flat binary file that training reads through np.memmap,
+so a run starts without reading, tokenizing or even holding the corpus in memory.
+
+    path = pretokenize("100-0.txt", tokenizer)     # tokenizes once, then reuses the cache
+    dataset = MemmapTokenDataset(path, seq_len=256)
+
+pretokenize writes two files to the cache directory, named by a key that hashes the corpus
+contents and the tokenizer:
+
+    <key>.bin   the token ids, native-endian uint16 if the vocabulary fits, else uint32
+    <key>.json  a header (format version, dtype, num_tokens, vocab_size, hashes, source path) and
+                the vocabulary as a list of words in id order
+
+Editing the corpus or the tokenizer's vocabulary changes the key, so stale files are never read.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+from typing import Optional
+
+import numpy as np
+import torch as t
+
+from nlp_modules import TokenWindowDataset, last_word_boundary
+
+FORMAT_VERSION = 1
+# characters of text encoded at a time
+CHUNK_CHARS = 1 << 22
+
+
+def pretokenize(filename: str, tokenizer, cache_dir: Optional[str] = None) -> str:
+    '''
+    Encodes filename with tokenizer into the cache, unless it's already there, and leaves the
+    tokenizer holding the vocabulary the ids refer to.
+
+    If the tokenizer has no vocabulary yet, one is built while encoding, with the ids build_dict
+    would give; on a cache hit it's read from the header. A tokenizer that already has a
+    vocabulary keeps it.
+
+    tokenizer: a WordsTokenizer; the file is split into chunks at word boundaries, which other
+        tokenizers (e.g. bpe_tokenizer.BPETokenizer) don't respect
+    cache_dir: where to write; default .token_cache next to filename
+    Return: path of the .bin file, to pass to MemmapTokenDataset
+    '''
+    if not hasattr(tokenizer, "word_id_map"):
+        raise TypeError(f"pretokenize needs a word-level tokenizer with a word_id_map, got {type(tokenizer).__name__}")
+    cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(filename)), ".token_cache")
+    corpus_hash = hashlib.sha256()
+    with open(filename, "rb") as f:
+        while block := f.read(1 << 20):
+            corpus_hash.update(block)
+    corpus_sha256 = corpus_hash.hexdigest()
+    fingerprint = tokenizer_fingerprint(tokenizer)
+    key = hashlib.sha256(f"{corpus_sha256}:{fingerprint}".encode()).hexdigest()[:32]
+    path = os.path.join(cache_dir, f"{key}.bin")
+
+    if os.path.exists(path) and os.path.exists(_header_path(path)):
+        _set_vocab(tokenizer, load_header(path)["vocab"])
+        return path
+
+    os.makedirs(cache_dir, exist_ok=True)
+    build = not tokenizer.word_id_map
+    word_id_map = {} if build else tokenizer.word_id_map
+
+    # write uint32 first, since the vocabulary size isn't known until the end
+    counts = np.zeros(0, dtype=np.int64)
+    with tempfile.NamedTemporaryFile(dir=cache_dir, suffix=".tmp", delete=False) as out:
+        num_tokens = 0
+        for chunk in _read_chunks(filename):
+            if build:
+                # numbered in order of first appearance for now
+                tokens = filter(None, re.split(r"\b", chunk))
+                ids = np.asarray([word_id_map.setdefault(token, len(word_id_map)) for token in tokens], dtype=np.uint32)
+                counts = np.pad(counts, (0, len(word_id_map) - len(counts)))
+                counts += np.bincount(ids, minlength=len(word_id_map))
+            else:
+                ids = tokenizer.encode_bulk(chunk, num_workers=1).astype(np.uint32)
+            ids.tofile(out)
+            num_tokens += len(ids)
+        wide_path = out.name
+
+    vocab = [None] * len(word_id_map)
+    for word, id in word_id_map.items():
+        vocab[id] = word
+    new_ids = None
+    if build:
+        # renumber from most to least frequent, ties in order of first appearance, as build_dict does
+        order = np.argsort(-counts, kind="stable")
+        vocab = [vocab[id] for id in order]
+        new_ids = np.empty(len(order), dtype=np.uint32)
+        new_ids[order] = np.arange(len(order), dtype=np.uint32)
+    dtype = np.uint16 if len(vocab) <= np.iinfo(np.uint16).max + 1 else np.uint32
+    try:
+        if not num_tokens:
+            raise ValueError(f"{filename} has no text to tokenize")
+        if dtype != np.uint32 or new_ids is not None:
+            _rewrite(wide_path, num_tokens, dtype, new_ids)
+        os.replace(wide_path, path)
+    finally:
+        if os.path.exists(wide_path):
+            os.remove(wide_path)
+
+    header = {
+        "format_version": FORMAT_VERSION,
+        "dtype": np.dtype(dtype).name,
+        "num_tokens": num_tokens,
+        "vocab_size": len(vocab),
+        "corpus_sha256": corpus_sha256,
+        "tokenizer": fingerprint,
+        "source": os.path.abspath(filename),
+        "vocab": vocab,
+    }
+    # the header goes last: a .bin without one is an interrupted write, and is redone
+    _atomic_write(_header_path(path), json.dumps(header))
+    _set_vocab(tokenizer, vocab)
+    return path
+
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    '''
+    Identifies how tokenizer maps text to ids: its class, and a hash of its vocabulary, or
+    "built" if it has none and pretokenize will build one.
+    '''
+    name = f"{type(tokenizer).__name__}-v{FORMAT_VERSION}"
+    if not tokenizer.word_id_map:
+        return f"{name}:built"
+    items = sorted(tokenizer.word_id_map.items(), key=lambda item: item[1])
+    return f"{name}:{hashlib.sha256(json.dumps(items).encode()).hexdigest()[:16]}"
+
+
+def load_header(path: str) -> dict:
+    with open(_header_path(path)) as f:
+        header = json.load(f)
+    if header["format_version"] != FORMAT_VERSION:
+        raise ValueError(f"{path} has format version {header['format_version']}, expected {FORMAT_VERSION}")
+    return header
+
+
+class MemmapTokenDataset(TokenWindowDataset):
+    '''
+    TokenWindowDataset over a file written by pretokenize. Windows are read from the file on
+    demand through np.memmap, so only the pages being trained on are ever resident, and each
+    DataLoader worker opens its own map rather than receiving a copy of the corpus.
+    '''
+
+    def __init__(self, path, seq_len, stride=1, random_offset=False, seed=0, truncate=None):
+        self.path = path
+        header = load_header(path)
+        self.dtype = np.dtype(header["dtype"])
+        self.num_tokens = header["num_tokens"]
+        self.vocab_size = header["vocab_size"]
+        self._tokens = None
+
+        token_count = self.num_tokens
+        if truncate:
+            token_count = int(token_count * truncate)
+
+        super().__init__(seq_len, token_count, stride, random_offset, seed)
+
+    @property
+    def tokens(self) -> np.memmap:
+        if self._tokens is None:
+            self._tokens = np.memmap(self.path, dtype=self.dtype, mode="r", shape=(self.num_tokens,))
+        return self._tokens
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_tokens"] = None
+        return state
+
+    def _window(self, pos):
+        window = t.from_numpy(self.tokens[pos:pos+self.seq_len+1].astype(np.int64))
+        return window[:-1], window[1:]
+
+
+def _read_chunks(filename):
+    '''
+    Yields the file's text in pieces split only at word boundaries (between a \\w and a \\W
+    character), so that tokenizing the pieces separately gives the same tokens as tokenizing it
+    whole.
+    '''
+    carry = ""
+    with open(filename, "r") as textfile:
+        while True:
+            text = textfile.read(CHUNK_CHARS)
+            if not text:
+                break
+            text = carry + text
+            cut = last_word_boundary(text)
+            carry = text[cut:]
+            if cut:
+                yield text[:cut]
+    if carry:
+        yield carry
+
+
+def _rewrite(path, num_tokens, dtype, new_ids=None):
+    '''
+    Rewrites a file of uint32 ids as dtype, mapping each id through new_ids if given.
+    '''
+    wide = np.memmap(path, dtype=np.uint32, mode="r", shape=(num_tokens,))
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=".tmp", delete=False) as out:
+        for start in range(0, num_tokens, CHUNK_CHARS):
+            ids = wide[start:start + CHUNK_CHARS]
+            if new_ids is not None:
+                ids = new_ids[ids]
+            ids.astype(dtype).tofile(out)
+    del wide
+    os.replace(out.name, path)
+
+
+def _atomic_write(path, text):
+    with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(path), suffix=".tmp", delete=False) as out:
+        out.write(text)
+    os.replace(out.name, path)
+
+
+def _header_path(path):
+    return os.path.splitext(path)[0] + ".json"
+
+
+def _set_vocab(tokenizer, vocab):
+    tokenizer.word_id_map = {word: id for id, word in enumerate(vocab)}
+    tokenizer.id_word_map = dict(enumerate(vocab))
@@ -0,0 +1,104 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import torch as t
+from torch.utils.data import DataLoader
+
+import token_cache
+from nlp_modules import WordsDataset, WordsTokenizer
+from token_cache import MemmapTokenDataset, load_header, pretokenize
+
+TEXT = "".join(f"Word{i % 53}, and\n\nthen {i % 7}... it's “done” {i}!\n" for i in range(500))
+
+
+class TestTokenCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "corpus.txt")
+        with open(self.filename, "w") as f:
+            f.write(TEXT)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_same_ids_as_encode(self):
+        # small chunks, so the corpus is split many times
+        with mock.patch.object(token_cache, "CHUNK_CHARS", 100):
+            tokenizer = WordsTokenizer(model_max_length=16)
+            path = pretokenize(self.filename, tokenizer)
+        ids = np.fromfile(path, dtype=np.uint16)
+        self.assertEqual(ids.tolist(), tokenizer.encode(TEXT))
+        self.assertEqual(tokenizer.decode(ids.tolist()), TEXT)
+
+        header = load_header(path)
+        self.assertEqual(header["dtype"], "uint16")
+        self.assertEqual(header["num_tokens"], len(ids))
+        self.assertEqual(header["vocab_size"], len(tokenizer.word_id_map))
+        self.assertEqual(os.path.dirname(path), os.path.join(self.directory.name, ".token_cache"))
+        self.assertEqual(header["corpus_sha256"], hashlib.sha256(TEXT.encode()).hexdigest())
+
+    def test_cache_hit_skips_tokenization(self):
+        path = pretokenize(self.filename, WordsTokenizer(model_max_length=16))
+        tokenizer = WordsTokenizer(model_max_length=16)
+        with mock.patch.object(token_cache, "_read_chunks", side_effect=AssertionError("re-tokenized")):
+            self.assertEqual(pretokenize(self.filename, tokenizer), path)
+        self.assertEqual(tokenizer.decode(np.fromfile(path, dtype=np.uint16).tolist()), TEXT)
+
+        with open(self.filename, "a") as f:
+            f.write(" more")
+        self.assertNotEqual(pretokenize(self.filename, WordsTokenizer(model_max_length=16)), path)
+
+    def test_existing_vocabulary(self):
+        tokenizer = WordsTokenizer(model_max_length=16)
+        tokenizer.build_dict(TEXT)
+        word_id_map = dict(tokenizer.word_id_map)
+        path = pretokenize(self.filename, tokenizer)
+        self.assertEqual(tokenizer.word_id_map, word_id_map)
+        self.assertEqual(np.fromfile(path, dtype=np.uint16).tolist(), tokenizer.encode(TEXT))
+
+    def test_uint32(self):
+        with open(self.filename, "w") as f:
+            f.write(" ".join(f"w{i}" for i in range(70000)))
+        tokenizer = WordsTokenizer(model_max_length=16)
+        path = pretokenize(self.filename, tokenizer)
+        self.assertEqual(load_header(path)["dtype"], "uint32")
+        x, _ = MemmapTokenDataset(path, 8)[2 * 69990]
+        self.assertEqual(tokenizer.decode(x.tolist()), "w69990 w69991 w69992 w69993 ")
+        self.assertGreater(x.max().item(), 65535)
+
+    def test_empty_corpus(self):
+        open(self.filename, "w").close()
+        with self.assertRaisesRegex(ValueError, "no text"):
+            pretokenize(self.filename, WordsTokenizer(model_max_length=16))
+        self.assertEqual(os.listdir(os.path.join(self.directory.name, ".token_cache")), [])
+
+    def test_same_windows_as_words_dataset(self):
+        tokenizer, words_tokenizer = WordsTokenizer(model_max_length=16), WordsTokenizer(model_max_length=16)
+        path = pretokenize(self.filename, tokenizer)
+        words = WordsDataset(16, self.filename, words_tokenizer, truncate=0.5, stride=3)
+        dataset = MemmapTokenDataset(path, 16, truncate=0.5, stride=3)
+        self.assertEqual(tokenizer.word_id_map, words_tokenizer.word_id_map)
+        self.assertEqual(len(dataset), len(words))
+        for i in (0, 1, len(dataset) // 2, len(dataset) - 1):
+            for window, words_window in zip(dataset[i], words[i]):
+                self.assertEqual(window.dtype, t.int64)
+                t.testing.assert_close(window, words_window)
+        with self.assertRaises(IndexError):
+            dataset[len(dataset)]
+
+    def test_dataloader_workers(self):
+        path = pretokenize(self.filename, WordsTokenizer(model_max_length=16))
+        dataset = MemmapTokenDataset(path, 16, stride=5)
+        dataset[0]
+        self.assertIsNone(pickle.loads(pickle.dumps(dataset))._tokens)
+        x = t.cat([x for x, _ in DataLoader(dataset, batch_size=8, num_workers=2)])
+        t.testing.assert_close(x, t.stack([dataset[i][0] for i in range(len(dataset))]))
+
+
+if __name__ == "__main__":
+    unittest.main()
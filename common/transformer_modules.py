@@ -1,12 +1,17 @@
+import math
+
 import numpy as np
 import torch as t
+import torch.utils.checkpoint
 from torch import nn
 import numpy as np
 from fancy_einsum import einsum
 from dataclasses import dataclass
+from typing import List, Optional, Tuple
 
 from einops import rearrange, reduce, repeat
 
+import attention
 import general_modules as cm
 
 @dataclass(frozen=True)
@@ -20,16 +25,20 @@ class TransformerConfig:
     max_seq_len: int
     dropout: float = 0.1
     layer_norm_epsilon: float = 1e-05
+    dtype: t.dtype = t.float32
+    attention_backend: str = "reference"
+    # checkpoint segments of checkpoint_every blocks, recomputing them during backward; 0 disables
+    checkpoint_every: int = 0
 
 class Embedding(nn.Module):
     """Returns an embedding of input tokens"""
 
-    def __init__(self, num_embeddings: int, embedding_dim: int):
+    def __init__(self, num_embeddings: int, embedding_dim: int, dtype: Optional[t.dtype] = None):
         super().__init__()
         self.num_embed = num_embeddings
         self.embed_dim = embedding_dim
         self.weight = nn.Parameter(
-            t.ones(num_embeddings, embedding_dim).uniform_(-1, to=1)
+            t.ones(num_embeddings, embedding_dim, dtype=dtype).uniform_(-1, to=1)
         )
 
     def forward(self, x: t.LongTensor) -> t.Tensor:
@@ -43,36 +52,84 @@ class Embedding(nn.Module):
 class PositionalEncoding(nn.Module):
     """Adds sin-cosine positional encoding to the input"""
 
-    def __init__(self, max_seq_len: int, embedding_dim: int):
+    def __init__(self, max_seq_len: int, embedding_dim: int, dtype: Optional[t.dtype] = None):
         super().__init__()
         self.max_seq_len = max_seq_len
         self.embed_dim = embedding_dim
         self.n = 10000
 
-        freqs = np.outer(
-            np.arange(max_seq_len),
-            1 / self.n ** (2 * np.arange(embedding_dim // 2) / embedding_dim),
+        # computed in float64, but stored in the model's dtype so that adding it doesn't upcast x
+        freqs = t.outer(
+            t.arange(max_seq_len, dtype=t.float64),
+            1 / self.n ** (2 * t.arange(embedding_dim // 2, dtype=t.float64) / embedding_dim),
         )
-        enc_2d = np.zeros((max_seq_len, embedding_dim))
-        enc_2d[:, ::2] = np.sin(freqs)
-        enc_2d[:, 1::2] = np.cos(freqs)
-        self.register_buffer("pos_enc", t.from_numpy(enc_2d))
-
-    def forward(self, x: t.Tensor) -> t.Tensor:
+        enc_2d = t.zeros(max_seq_len, embedding_dim, dtype=t.float64)
+        enc_2d[:, ::2] = t.sin(freqs)
+        enc_2d[:, 1::2] = t.cos(freqs)
+        self.register_buffer("pos_enc", enc_2d.to(dtype or t.get_default_dtype()))
+
+    def forward(
+        self, x: t.Tensor, offset: int = 0, position_ids: Optional[t.Tensor] = None
+    ) -> t.Tensor:
         """
         x: shape (batch, seq_len, embedding_dim)
+        offset: position of the first element of x (nonzero when decoding with a KV cache)
+        position_ids: shape (batch, seq_len) - overrides offset when rows start at different positions
         """
-        return x + self.pos_enc[: x.shape[1], :]
+        # the cast only touches the (seq_len, embedding_dim) slice, and is a no-op unless the
+        # model was pickled with the old float64 buffer
+        if position_ids is not None:
+            return x + self.pos_enc[position_ids].to(x.dtype)
+        return x + self.pos_enc[offset : offset + x.shape[1], :].to(x.dtype)
 
     def extra_repr(self) -> str:
         return f"max_freq={self.n}, max_seq_len={self.max_seq_len}, embedding_dim={self.embed_dim}"
 
 
+class LayerNormFunction(t.autograd.Function):
+    """
+    Layer normalization over the last `norm_size` elements of each row, saving only the input and
+    one reciprocal standard deviation per row for backward (the normalized input is recomputed).
+    """
+
+    @staticmethod
+    def forward(ctx, x, weight, bias, norm_dims, eps):
+        mean = x.mean(dim=norm_dims, keepdim=True)
+        rstd = t.rsqrt(x.var(dim=norm_dims, unbiased=False, keepdim=True) + eps)
+        out = (x - mean) * rstd
+        if weight is not None:
+            out = t.addcmul(bias, out, weight)
+        ctx.save_for_backward(x, weight, rstd)
+        ctx.norm_dims = norm_dims
+        return out
+
+    @staticmethod
+    def backward(ctx, grad_out):
+        x, weight, rstd = ctx.saved_tensors
+        norm_dims = ctx.norm_dims
+        x_hat = (x - x.mean(dim=norm_dims, keepdim=True)) * rstd
+        grad_weight = grad_bias = None
+        if weight is not None:
+            batch_dims = tuple(range(x.dim() - weight.dim()))
+            grad_weight = (grad_out * x_hat).sum(dim=batch_dims)
+            grad_bias = grad_out.sum(dim=batch_dims)
+            grad_out = grad_out * weight
+        # d/dx of (x - mean) * rstd, applied to grad_out
+        grad_x = grad_out - grad_out.mean(dim=norm_dims, keepdim=True)
+        grad_x -= x_hat * (grad_out * x_hat).mean(dim=norm_dims, keepdim=True)
+        grad_x *= rstd
+        return grad_x, grad_weight, grad_bias, None, None
+
+
 class LayerNorm(nn.Module):
     """Performs normalization over specified dimensions"""
 
     def __init__(
-        self, normalized_shape, eps: float = 1e-05, elementwise_affine: bool = True
+        self,
+        normalized_shape,
+        eps: float = 1e-05,
+        elementwise_affine: bool = True,
+        dtype: Optional[t.dtype] = None,
     ):
         super().__init__()
         self.norm_shape = (
@@ -84,26 +141,38 @@ class LayerNorm(nn.Module):
         self.elementwise_affine = elementwise_affine
 
         if self.elementwise_affine:
-            self.weight = nn.Parameter(t.ones(normalized_shape))
-            self.bias = nn.Parameter(t.zeros(normalized_shape))
+            self.weight = nn.Parameter(t.ones(normalized_shape, dtype=dtype))
+            self.bias = nn.Parameter(t.zeros(normalized_shape, dtype=dtype))
 
     def forward(self, x: t.Tensor) -> t.Tensor:
         """Normalize along each embedding"""
         x_dims, norm_shape_dims = len(x.shape), len(self.norm_shape)
         norm_dims = tuple([d for d in range(x_dims - norm_shape_dims, x_dims)])
 
-        self.mean = t.mean(x, dim=norm_dims, keepdim=True)
-        self.var = t.var(x, dim=norm_dims, unbiased=False, keepdim=True)
+        weight, bias = (self.weight, self.bias) if self.elementwise_affine else (None, None)
+        return LayerNormFunction.apply(x, weight, bias, norm_dims, self.eps)
+
+    def extra_repr(self) -> str:
+        return f"normalized_shape={self.norm_shape}, eps={self.eps}, elementwise_affine={self.elementwise_affine}"
 
-        out = (x - self.mean) / t.sqrt(self.var + self.eps)
 
-        if self.elementwise_affine:
-            out = out * self.weight + self.bias
+class DropoutFunction(t.autograd.Function):
+    """
+    Inverted dropout that saves only the boolean keep-mask (one byte per element) for backward.
+    """
 
-        return out
+    @staticmethod
+    def forward(ctx, x, p):
+        # draw in float32 on x's device; a low-precision rand would round probabilities near p
+        keep = t.rand(x.shape, device=x.device) >= p
+        ctx.save_for_backward(keep)
+        ctx.scale = 1 / (1 - p)
+        return x * keep * ctx.scale
 
-    def extra_repr(self) -> str:
-        return f"normalized_shape={self.norm_shape}, eps={self.eps}, elementwise_affine={self.elementwise_affine}"
+    @staticmethod
+    def backward(ctx, grad_out):
+        (keep,) = ctx.saved_tensors
+        return grad_out * keep * ctx.scale, None
 
 
 class Dropout(nn.Module):
@@ -114,15 +183,8 @@ class Dropout(nn.Module):
         self.p = p
 
     def forward(self, x: t.Tensor) -> t.Tensor:
-        if self.training:
-            d_shape = x.shape
-            dropout_matrix = t.rand(d_shape)
-            dropout_matrix[dropout_matrix < self.p] = 0
-            dropout_matrix[dropout_matrix >= self.p] = 1
-            # should this be on the device?
-            out = x * dropout_matrix.to(x.device)
-            out = out / (1 - self.p)
-            return out
+        if self.training and self.p > 0:
+            return DropoutFunction.apply(x, self.p)
         else:
             return x
 
@@ -130,92 +192,192 @@ class Dropout(nn.Module):
         return f"p={self.p}"
 
 
+_GELU_C = math.sqrt(2 / math.pi)
+
+
+class GELUFunction(t.autograd.Function):
+    """
+    The tanh approximation of GELU, saving only the input for backward instead of every
+    intermediate of the formula.
+    """
+
+    @staticmethod
+    def forward(ctx, x):
+        ctx.save_for_backward(x)
+        inner = (x * x).mul_(0.044715).add_(1).mul_(x).mul_(_GELU_C)
+        return inner.tanh_().add_(1).mul_(x).mul_(0.5)
+
+    @staticmethod
+    def backward(ctx, grad_out):
+        (x,) = ctx.saved_tensors
+        x_squared = x * x
+        tanh = (x_squared * 0.044715).add_(1).mul_(x).mul_(_GELU_C).tanh_()
+        # d/dx 0.5x(1 + tanh(u)) = 0.5(1 + tanh(u)) + 0.5x(1 - tanh(u)^2) du/dx
+        du = x_squared.mul_(3 * 0.044715).add_(1).mul_(_GELU_C)
+        grad = (1 - tanh * tanh).mul_(du).mul_(x).add_(tanh).add_(1).mul_(0.5)
+        return grad_out * grad
+
+
 class GELU(nn.Module):
     """Performs the GELU approximation"""
 
     def forward(self, x: t.Tensor) -> t.Tensor:
-        out = (
-            x * 0.5 * (1 + t.tanh(t.sqrt(t.tensor(2 / t.pi)) * (x + 0.044715 * x**3)))
-        )
-        return out
+        return GELUFunction.apply(x)
+
+
+# Per-layer key/value cache: (K, V), each of shape (batch, past_seq, nheads*headsize)
+KVCache = Tuple[t.Tensor, t.Tensor]
+
+
+class ChunkedCrossEntropy(t.autograd.Function):
+    """
+    Cross-entropy of hidden @ weight.T against targets, computed chunk_size rows at a time.
+
+    Only one (chunk_size, vocab_size) block of logits exists at any point: forward keeps just the
+    per-row logsumexp, and backward recomputes each block to form its gradient.
+    """
+
+    @staticmethod
+    def forward(ctx, hidden, weight, targets, chunk_size, ignore_index):
+        device_type = hidden.device.type
+        ctx.autocast = t.is_autocast_enabled(device_type)
+        ctx.autocast_dtype = t.get_autocast_dtype(device_type)
+
+        valid = targets != ignore_index
+        safe_targets = targets.masked_fill(~valid, 0)
+        lse = t.empty(hidden.shape[0], dtype=t.float32, device=hidden.device)
+        total = t.zeros((), dtype=t.float32, device=hidden.device)
+        for start in range(0, hidden.shape[0], chunk_size):
+            end = start + chunk_size
+            logits = (hidden[start:end] @ weight.T).float()
+            lse[start:end] = logits.logsumexp(dim=-1)
+            target_logits = logits.gather(-1, safe_targets[start:end, None])[:, 0]
+            total += ((lse[start:end] - target_logits) * valid[start:end]).sum()
+
+        count = valid.sum().clamp(min=1)
+        ctx.save_for_backward(hidden, weight, safe_targets, valid, lse, count)
+        ctx.chunk_size = chunk_size
+        return total / count
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        hidden, weight, targets, valid, lse, count = ctx.saved_tensors
+        grad_hidden = t.empty_like(hidden)
+        grad_weight = t.zeros(weight.shape, dtype=t.float32, device=weight.device)
+        # d(mean loss)/d(logits) = (softmax - onehot(target)) / count, for rows that count
+        scale = (grad_output / count).float()
+        with t.autocast(hidden.device.type, dtype=ctx.autocast_dtype, enabled=ctx.autocast):
+            for start in range(0, hidden.shape[0], ctx.chunk_size):
+                end = start + ctx.chunk_size
+                logits = (hidden[start:end] @ weight.T).float()
+                grad_logits = t.exp(logits - lse[start:end, None])
+                grad_logits[t.arange(grad_logits.shape[0], device=grad_logits.device), targets[start:end]] -= 1
+                grad_logits *= (valid[start:end, None] * scale)
+                grad_logits = grad_logits.to(hidden.dtype)
+                grad_hidden[start:end] = grad_logits @ weight.to(hidden.dtype)
+                grad_weight += (grad_logits.T @ hidden[start:end]).float()
+        return grad_hidden, grad_weight.to(weight.dtype), None, None, None
+
+
+def chunked_cross_entropy(
+    hidden: t.Tensor,
+    weight: t.Tensor,
+    targets: t.Tensor,
+    chunk_size: int = 1024,
+    ignore_index: int = -100,
+) -> t.Tensor:
+    """
+    Mean cross-entropy of the logits einsum("... E, V E -> ... V", hidden, weight) against targets,
+    without materializing the logits: peak extra memory is one (chunk_size, V) block.
+
+    hidden: shape (*, hidden_size)
+    weight: shape (vocab_size, hidden_size) - e.g. the tied embedding matrix
+    targets: shape (*, ) - positions equal to ignore_index don't count
+    """
+    return ChunkedCrossEntropy.apply(
+        hidden.reshape(-1, hidden.shape[-1]), weight, targets.reshape(-1), chunk_size, ignore_index
+    )
 
 
 class MultiheadMaskedAttention(nn.Module):
     W_QKV: nn.Linear
     W_O: nn.Linear
+    # one of attention.ATTENTION_BACKENDS; a class default so that models pickled before
+    # backends existed load with the reference implementation
+    backend = "reference"
 
-    def __init__(self, hidden_size: int, num_heads: int):
+    def __init__(
+        self, hidden_size: int, num_heads: int, dtype: Optional[t.dtype] = None, backend: str = "reference"
+    ):
         super().__init__()
         self.num_heads = num_heads
+        self.backend = backend
         self.query_size = int(hidden_size / num_heads)
-        self.qkv = cm.Linear(hidden_size, 3 * hidden_size)
-        self.ff = cm.Linear(hidden_size, hidden_size)
+        self.qkv = cm.Linear(hidden_size, 3 * hidden_size, dtype=dtype)
+        self.ff = cm.Linear(hidden_size, hidden_size, dtype=dtype)
 
     def multihead_masked_attention(
-        self, Q: t.Tensor, K: t.Tensor, V: t.Tensor, num_heads: int
+        self,
+        Q: t.Tensor,
+        K: t.Tensor,
+        V: t.Tensor,
+        num_heads: int,
+        padding_mask: Optional[t.Tensor] = None,
     ):
         """
-        Implements multihead masked attention on the matrices Q, K and V.
+        Implements multihead masked attention on the matrices Q, K and V, using self.backend.
 
         Q: shape (batch, seq, nheads*headsize)
-        K: shape (batch, seq, nheads*headsize)
-        V: shape (batch, seq, nheads*headsize)
+        K: shape (batch, kv_seq, nheads*headsize)
+        V: shape (batch, kv_seq, nheads*headsize)
+        padding_mask: shape (batch, kv_seq) - 1 for real tokens, 0 for padding
+
+        kv_seq may be longer than seq when cached keys and values are prepended, in
+        which case the queries are the last seq positions of the sequence.
 
         returns: shape (batch, seq, nheads*headsize)
         """
-        Q = rearrange(
-            Q, "B S (nheads headsize) -> B S nheads headsize", nheads=num_heads
-        )
-        K = rearrange(
-            K, "B S (nheads headsize) -> B S nheads headsize", nheads=num_heads
-        )
-        V = rearrange(
-            V, "B S (nheads headsize) -> B S nheads headsize", nheads=num_heads
-        )
-
-        batch_size, seq_len, nheads, headsize = Q.shape
-        scores = einsum(
-            "B Qseq nheads headsize, B Kseq nheads headsize -> B nheads Qseq Kseq", Q, K
-        )
-        scores /= Q.shape[-1] ** 0.5
-
-        # create lower-left triangle of ones, including the diagonal
-        mask = t.tril(t.ones(seq_len, seq_len).to(Q.device), diagonal=0)
-        #mask = mask.to(Q.device)
-        # fill with close-to-neg-inf values where mask==0
-        #print(mask.device)
-        #print(scores.device)
-        scores = scores.masked_fill(mask == 0, -1e9)
-
-        scores = t.softmax(scores, dim=-1)
-        Z = einsum(
-            "B nheads Qseq Kseq, B Kseq nheads headsize -> B Qseq nheads headsize",
-            scores,
-            V,
+        return attention.multihead_attention(
+            Q, K, V, num_heads, self.backend, padding_mask=padding_mask
         )
-        Z = rearrange(Z, "B Qseq nheads headsize -> B Qseq (nheads headsize)")
-        return Z
 
-    def forward(self, x: t.Tensor) -> t.Tensor:
+    def forward(
+        self,
+        x: t.Tensor,
+        past_key_value: Optional[KVCache] = None,
+        use_cache: bool = False,
+        padding_mask: Optional[t.Tensor] = None,
+    ):
         """
         x: shape (batch, seq, hidden_size)
+        past_key_value: keys and values of the preceding positions, if any
+        use_cache: if True, also return the keys and values including x's positions
+        padding_mask: shape (batch, past_seq + seq) - 1 for real tokens, 0 for padding
 
-        Return: shape (batch, seq, hidden_size)
+        Return: shape (batch, seq, hidden_size), plus the updated KVCache if use_cache
         """
         out = self.qkv(x)
         Q, K, V = t.tensor_split(out, 3, dim=-1)
 
-        Z = self.multihead_masked_attention(Q, K, V, self.num_heads)
+        if past_key_value is not None:
+            past_K, past_V = past_key_value
+            K = t.cat([past_K, K], dim=1)
+            V = t.cat([past_V, V], dim=1)
+
+        Z = self.multihead_masked_attention(Q, K, V, self.num_heads, padding_mask)
         out = self.ff(Z)
+
+        if use_cache:
+            return out, (K, V)
         return out
 
 
 class MLP(nn.Module):
-    def __init__(self, hidden_size, dropout):
+    def __init__(self, hidden_size, dropout, dtype: Optional[t.dtype] = None):
         super().__init__()
-        self.linear1 = cm.Linear(hidden_size, 4 * hidden_size)
+        self.linear1 = cm.Linear(hidden_size, 4 * hidden_size, dtype=dtype)
         self.gelu = GELU()
-        self.linear2 = cm.Linear(4 * hidden_size, hidden_size)
+        self.linear2 = cm.Linear(4 * hidden_size, hidden_size, dtype=dtype)
         self.dropout = Dropout(p=dropout)
 
     def forward(self, x):
@@ -223,44 +385,155 @@ class MLP(nn.Module):
         out = self.dropout(self.linear2(out))
         return out
 
+def run_blocks(blocks: nn.Module, x: t.Tensor, *args, checkpoint_every: int = 0) -> t.Tensor:
+    """
+    Applies blocks in order, as nn.Sequential would, passing args after x to every block.
+
+    When checkpoint_every is k > 0 and gradients are enabled, the blocks are split into segments
+    of k consecutive blocks, each run under activation checkpointing: a segment keeps only its
+    input after forward, and its blocks' activations are recomputed in backward, one segment at
+    a time. Larger k keeps fewer inputs but rebuilds more blocks at once. The RNG state is
+    restored for the recomputation, so Dropout draws the same masks both times.
+    """
+    if not checkpoint_every or not t.is_grad_enabled():
+        return _run_segment(blocks, x, *args)
+    for start in range(0, len(blocks), checkpoint_every):
+        x = t.utils.checkpoint.checkpoint(
+            _run_segment, blocks[start:start + checkpoint_every], x, *args, use_reentrant=False
+        )
+    return x
+
+
+def _run_segment(blocks, x, *args):
+    for block in blocks:
+        x = block(x, *args)
+    return x
+
+
 class DecoderBlock(nn.Module):
 
     def __init__(self, config: TransformerConfig):
         super().__init__()
-        self.attn = MultiheadMaskedAttention(config.hidden_size, config.num_heads)
-        self.lnorm1 = LayerNorm(config.hidden_size, eps=config.layer_norm_epsilon)
-        self.mlp = MLP(config.hidden_size, config.dropout)
-        self.lnorm2 = LayerNorm(config.hidden_size, eps=config.layer_norm_epsilon)
-
-    def forward(self, x: t.Tensor) -> t.Tensor:
-        normed_attn = self.lnorm1(self.attn(x))
+        self.attn = MultiheadMaskedAttention(
+            config.hidden_size, config.num_heads, dtype=config.dtype, backend=config.attention_backend
+        )
+        self.lnorm1 = LayerNorm(config.hidden_size, eps=config.layer_norm_epsilon, dtype=config.dtype)
+        self.mlp = MLP(config.hidden_size, config.dropout, dtype=config.dtype)
+        self.lnorm2 = LayerNorm(config.hidden_size, eps=config.layer_norm_epsilon, dtype=config.dtype)
+
+    def forward(
+        self,
+        x: t.Tensor,
+        past_key_value: Optional[KVCache] = None,
+        use_cache: bool = False,
+        padding_mask: Optional[t.Tensor] = None,
+    ):
+        attn = self.attn(x, past_key_value, use_cache, padding_mask)
+        if use_cache:
+            attn, present = attn
+        normed_attn = self.lnorm1(attn)
         out = normed_attn + x
         normed_mlp = self.lnorm2(self.mlp(out))
         out = normed_mlp + out
+
+        if use_cache:
+            return out, present
         return out
 
 class DecoderOnlyTransformer(nn.Module):
+    # a class default so that models pickled before checkpointing existed still load
+    checkpoint_every = 0
 
     def __init__(self, config: TransformerConfig):
         super().__init__()
-        self.emb = Embedding(config.vocab_size, config.hidden_size)
-        self.pos_enc = PositionalEncoding(config.max_seq_len, config.hidden_size)
+        self.emb = Embedding(config.vocab_size, config.hidden_size, dtype=config.dtype)
+        self.pos_enc = PositionalEncoding(config.max_seq_len, config.hidden_size, dtype=config.dtype)
         self.dropout = Dropout(p=config.dropout)
 
+        self.checkpoint_every = config.checkpoint_every
         decoders = [DecoderBlock(config) for l in range(config.num_layers)]
         self.decoders = nn.Sequential(*decoders)
         
-        self.post_norm = LayerNorm(config.hidden_size)
+        self.post_norm = LayerNorm(config.hidden_size, dtype=config.dtype)
+
+    def forward(
+        self,
+        x: t.Tensor,
+        past_key_values: Optional[List[KVCache]] = None,
+        use_cache: bool = False,
+        only_last: bool = False,
+        padding_mask: Optional[t.Tensor] = None,
+        targets: Optional[t.Tensor] = None,
+        chunk_size: int = 1024,
+        ignore_index: int = -100,
+    ):
+        """
+        x: shape (batch, seq) - token ids; only the new tokens when past_key_values is given
+        past_key_values: one KVCache per decoder block, as returned by a previous call
+        use_cache: if True, return (logits, past_key_values) instead of just the logits
+        only_last: if True, only project the last position onto the vocabulary
+        padding_mask: shape (batch, past_seq + seq) - 1 for real tokens, 0 for (left) padding;
+            positions are counted from each row's first real token
+        targets: shape (batch, seq) - if given, return the mean next-token cross-entropy against
+            them instead of the logits, computed chunk_size rows at a time by chunked_cross_entropy
+
+        Return: shape (batch, seq, vocab_size), or (batch, 1, vocab_size) if only_last
+        """
+        out, presents = self._decode(x, past_key_values, use_cache, padding_mask)
+        if targets is not None:
+            return chunked_cross_entropy(self.post_norm(out), self.emb.weight, targets, chunk_size, ignore_index)
+
+        if only_last:
+            out = out[:, -1:]
+        out = self.post_norm(out)
+
+        # einsum("B S E, V E -> B S V", out, self.emb.weight)
+        out = out @ self.emb.weight.T
+
+        if use_cache:
+            return out, presents
+        return out
+
+    def _decode(
+        self,
+        x: t.Tensor,
+        past_key_values: Optional[List[KVCache]] = None,
+        use_cache: bool = False,
+        padding_mask: Optional[t.Tensor] = None,
+    ):
+        """
+        Runs the embedding and decoder blocks.
+
+        Return: (hidden states of shape (batch, seq, hidden_size) before post_norm, presents)
+        """
+        offset = 0 if past_key_values is None else past_key_values[0][0].shape[1]
+        position_ids = None
+        if padding_mask is not None:
+            position_ids = (padding_mask.cumsum(dim=-1) - 1).clamp(min=0)[:, -x.shape[1] :]
 
-    def forward(self, x: t.Tensor) -> t.Tensor:
         embedding = self.emb(x.long())
-        embedding = self.pos_enc(embedding)
+        embedding = self.pos_enc(embedding, offset, position_ids)
         embedding = self.dropout(embedding)
-        embedding = embedding.to(t.float32)
 
-        out = self.decoders(embedding)
-        out = self.post_norm(out)
+        if past_key_values is None and not use_cache and padding_mask is None:
+            out = run_blocks(self.decoders, embedding, checkpoint_every=self.checkpoint_every)
+            presents = None
+        else:
+            if past_key_values is None:
+                past_key_values = [None] * len(self.decoders)
+            out, presents = embedding, []
+            for block, past_key_value in zip(self.decoders, past_key_values):
+                out, present = block(out, past_key_value, use_cache=True, padding_mask=padding_mask)
+                presents.append(present)
 
-        out = einsum("B S E, V E -> B S V", out, self.emb.weight)
+        return out, presents
 
-        return out
\ No newline at end of file
+    def loss(self, x: t.Tensor, targets: t.Tensor, chunk_size: int = 1024, ignore_index: int = -100) -> t.Tensor:
+        """
+        Mean next-token cross-entropy, equal to cross_entropy(self(x).flatten(0, 1), targets.flatten())
+        but without ever holding the (batch, seq, vocab_size) logits; see chunked_cross_entropy.
+
+        x: shape (batch, seq) - token ids
+        targets: shape (batch, seq) - the token following each position of x
+        """
+        return self(x, targets=targets, chunk_size=chunk_size, ignore_index=ignore_index)
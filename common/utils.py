@@ -1,7 +1,11 @@
+import time
+
 import pandas as pd
 import numpy as np
 import torch as t
 
+from general_modules import module_nbytes
+
 def print_param_count(*models, display_df=True, use_state_dict=False):
     """
     display_df: bool
@@ -76,4 +80,46 @@ def test_make_additive_attention_mask(make_additive_attention_mask):
     arr = t.randint(low=0, high=2, size=(3, 4))
     expected = make_additive_attention_mask_soln(arr)
     actual = make_additive_attention_mask(arr)
-    t.testing.assert_close(expected, actual)
\ No newline at end of file
+    t.testing.assert_close(expected, actual)
+
+
+def quantization_report(model, quantized_model, input_ids: t.Tensor, k: int = 5, repeats: int = 5) -> pd.DataFrame:
+    """ Compares a float model with its quantized copy on a batch of token ids.
+
+    input_ids: shape (batch, seq) - each position's next token is its target
+
+    Returns a dataframe with, for each model: next-token perplexity, forward time (best of
+    repeats), parameter/buffer memory, and agreement with the float model's top-1 prediction
+    and top-k set.
+    """
+    rows = []
+    reference_logits = None
+    for name, m in [("float", model), ("quantized", quantized_model)]:
+        m.eval()
+        with t.inference_mode():
+            logits = m(input_ids)
+            best = float("inf")
+            for _ in range(repeats):
+                start = time.perf_counter()
+                m(input_ids)
+                best = min(best, time.perf_counter() - start)
+        logits = logits[:, :-1].float()
+        loss = t.nn.functional.cross_entropy(logits.flatten(0, 1), input_ids[:, 1:].flatten())
+        if reference_logits is None:
+            reference_logits = logits
+        top1_agreement = (logits.argmax(-1) == reference_logits.argmax(-1)).float().mean().item()
+        topk = logits.topk(k, dim=-1).indices
+        reference_topk = reference_logits.topk(k, dim=-1).indices
+        topk_overlap = (topk[..., :, None] == reference_topk[..., None, :]).any(-1).float().mean().item()
+        rows.append({
+            "model": name,
+            "perplexity": loss.exp().item(),
+            "forward_ms": best * 1e3,
+            "memory_mb": module_nbytes(m) / 2**20,
+            "top1_agreement": top1_agreement,
+            f"top{k}_overlap": topk_overlap,
+        })
+    df = pd.DataFrame(rows).set_index("model")
+    df["speedup"] = df.loc["float", "forward_ms"] / df["forward_ms"]
+    df["memory_saving"] = 1 - df["memory_mb"] / df.loc["float", "memory_mb"]
+    return df
@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+
+import torch as t
+from torch.utils.data import DataLoader
+
+from nlp_modules import WordsDataset, WordsTokenizer
+
+TEXT = " ".join(f"word{i % 37} and, then {i % 11}." for i in range(200))
+
+
+class TestWordsDataset(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.filename = os.path.join(cls.directory.name, "corpus.txt")
+        with open(cls.filename, "w") as f:
+            f.write(TEXT)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def dataset(self, seq_len=16, **kwargs):
+        return WordsDataset(seq_len, self.filename, WordsTokenizer(model_max_length=seq_len), **kwargs)
+
+    def test_same_windows_as_stacked_copies(self):
+        dataset = self.dataset(truncate=0.5)
+        tokens = dataset.tokens.tolist()
+        word_count = int(len(tokens) * 0.5)
+        expected_x = t.stack([t.tensor(tokens[pos:pos + 16]) for pos in range(0, word_count - 16 - 1)])
+        expected_y = t.stack([t.tensor(tokens[pos + 1:pos + 17]) for pos in range(0, word_count - 16 - 1)])
+        self.assertEqual(len(dataset), len(expected_x))
+        t.testing.assert_close(t.stack([dataset[i][0] for i in range(len(dataset))]), expected_x)
+        t.testing.assert_close(t.stack([dataset[i][1] for i in range(len(dataset))]), expected_y)
+        t.testing.assert_close(dataset.x_seqs, expected_x)
+        t.testing.assert_close(dataset.y_seqs, expected_y)
+
+    def test_windows_are_views(self):
+        dataset = self.dataset(stride=4)
+        x, y = dataset[3]
+        for tensor in (x, y, dataset.x_seqs):
+            self.assertEqual(tensor.untyped_storage().data_ptr(), dataset.tokens.untyped_storage().data_ptr())
+        t.testing.assert_close(x, dataset.tokens[12:28])
+        t.testing.assert_close(y, dataset.tokens[13:29])
+
+    def test_stride_and_random_offset(self):
+        dataset = self.dataset(stride=8, random_offset=True)
+        offsets = set()
+        for epoch in range(20):
+            dataset.set_epoch(epoch)
+            offsets.add(dataset.offset)
+            last_x, last_y = dataset[len(dataset) - 1]
+            self.assertEqual(len(last_y), 16)
+            t.testing.assert_close(last_x, dataset.x_seqs[-1])
+            with self.assertRaises(IndexError):
+                dataset[len(dataset)]
+        self.assertGreater(len(offsets), 1)
+        self.assertTrue(all(0 <= offset < 8 for offset in offsets))
+
+    def test_dataloader_workers(self):
+        dataset = self.dataset(stride=3)
+        loader = DataLoader(dataset, batch_size=8, num_workers=2)
+        x = t.cat([x for x, _ in loader])
+        t.testing.assert_close(x, dataset.x_seqs)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+import os
+import pickle
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import torch as t
+
+from nlp_modules import Vocabulary, WordsTokenizer, split_at_word_boundaries
+
+ALPHABET = "abcXYZé_019 \n\t.,;'’“”!?-ǅ"
+
+
+def random_text(rng, length):
+    return "".join(rng.choice(ALPHABET) for _ in range(length))
+
+
+class TestWordsTokenizer(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(0)
+        self.texts = [random_text(rng, rng.randint(0, 60)) for _ in range(300)]
+        self.text = "".join(self.texts) + "a" * 500 + " ...\n\n" * 50
+        self.tokenizer = WordsTokenizer(model_max_length=16)
+        # the vocabulary of the whole text and of each text on its own
+        words = sorted({token for text in [self.text, *self.texts] for token in re.split(r"\b", text)})
+        self.tokenizer.word_id_map = {word: id for id, word in enumerate(words)}
+        self.tokenizer.id_word_map = dict(enumerate(words))
+
+    def test_split_at_word_boundaries(self):
+        longest_token = max(len(token) for token in re.split(r"\b", self.text))
+        for chunk_chars in (1, 7, 64, 1000, 10**6):
+            with self.subTest(chunk_chars=chunk_chars):
+                pieces = list(split_at_word_boundaries(self.text, chunk_chars))
+                self.assertEqual("".join(pieces), self.text)
+                tokens = [token for piece in pieces for token in re.split(r"\b", piece) if token]
+                self.assertEqual(tokens, [token for token in re.split(r"\b", self.text) if token])
+                # pieces only run over to fit in a token longer than chunk_chars
+                self.assertTrue(all(len(piece) <= max(chunk_chars, longest_token) for piece in pieces))
+
+    def test_encode_bulk(self):
+        expected = self.tokenizer.encode(self.text)
+        for num_workers in (1, 2):
+            for chunk_chars in (13, 10**6):
+                with self.subTest(num_workers=num_workers, chunk_chars=chunk_chars):
+                    encoded = self.tokenizer.encode_bulk(self.text, num_workers=num_workers, chunk_chars=chunk_chars)
+                    self.assertEqual(encoded.dtype, np.int64)
+                    self.assertEqual(encoded.tolist(), expected)
+        encoded = self.tokenizer.encode_bulk(self.text, return_tensors="pt", num_workers=1)
+        t.testing.assert_close(encoded, self.tokenizer.encode(self.text, return_tensors="pt"))
+        with self.assertRaises(KeyError):
+            self.tokenizer.encode_bulk(self.text + " unseen", num_workers=1)
+
+    def test_encode_batch(self):
+        expected = [self.tokenizer.encode(text) for text in self.texts]
+        self.assertEqual(self.tokenizer.encode_batch(self.texts), expected)
+        for return_tensors in ("np", "pt"):
+            with self.subTest(return_tensors=return_tensors):
+                encoded = self.tokenizer.encode_batch(self.texts, return_tensors=return_tensors)
+                self.assertEqual([ids.tolist() for ids in encoded], expected)
+        self.assertEqual(self.tokenizer.encode_batch([]), [])
+
+
+class TestVocabulary(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.tokenizer = WordsTokenizer(model_max_length=16)
+        self.tokenizer.build_dict("to be, or not to be: that is the question “é”")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_build_dict_frequency_order(self):
+        self.assertEqual(
+            [self.tokenizer.id_word_map[id] for id in range(6)], [" ", "to", "be", ", ", "or", "not"]
+        )
+        # the same ids whatever the hash seed
+        script = (
+            "import sys; sys.path.insert(0, sys.argv[1]); from nlp_modules import WordsTokenizer; "
+            "tokenizer = WordsTokenizer(16); tokenizer.build_dict(sys.argv[2]); print(tokenizer.word_id_map)"
+        )
+        text = " ".join(f"w{i % 17}" for i in range(100))
+        outputs = {
+            subprocess.run(
+                [sys.executable, "-c", script, os.path.dirname(os.path.abspath(__file__)), text],
+                env={**os.environ, "PYTHONHASHSEED": seed}, capture_output=True, text=True, check=True,
+            ).stdout
+            for seed in ("1", "2")
+        }
+        self.assertEqual(len(outputs), 1)
+
+    def test_save_and_load(self):
+        self.tokenizer.save_vocab(self.directory.name)
+        loaded = WordsTokenizer(model_max_length=16)
+        loaded.load_saved(self.directory.name)
+        self.assertIsInstance(loaded.id_word_map, Vocabulary)
+        self.assertIsNone(loaded._word_id_map)
+        self.assertEqual(dict(loaded.id_word_map.items()), self.tokenizer.id_word_map)
+        self.assertEqual(len(loaded.id_word_map), len(self.tokenizer.id_word_map))
+        ids = self.tokenizer.encode("not to be “é”")
+        self.assertEqual(loaded.decode(ids), "not to be “é”")
+        self.assertIsNone(loaded._word_id_map)
+        self.assertEqual(loaded.encode("not to be “é”"), ids)
+        self.assertEqual(loaded.word_id_map, self.tokenizer.word_id_map)
+        with self.assertRaises(KeyError):
+            loaded.id_word_map[len(loaded.id_word_map)]
+
+        vocabulary = pickle.loads(pickle.dumps(loaded.id_word_map))
+        self.assertEqual(vocabulary[1], "to")
+
+    def test_not_a_vocabulary(self):
+        path = os.path.join(self.directory.name, "vocab.bin")
+        with open(path, "wb") as file:
+            file.write(bytes(64))
+        with self.assertRaises(ValueError):
+            Vocabulary(path)
+
+
+if __name__ == "__main__":
+    unittest.main()